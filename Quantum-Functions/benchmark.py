@@ -0,0 +1,244 @@
+"""
+Benchmarks of the simulation and statistics hot paths, reporting throughput
+in gates/s or circuits/s. Results can be saved as a JSON baseline, and a later
+run compared against it fails when any benchmark has slowed down past a
+threshold.
+
+Usage:
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.25
+"""
+import argparse
+import importlib.util
+import json
+import platform
+import sys
+import time
+import numpy as np
+from chi_squared_calc import batch_chi_squared, chi_squared, significance_statement
+from expected_value import (
+    GATE_ANGLE_COUNTS,
+    GATE_NAMES,
+    GATE_QUBIT_COUNTS,
+    clear_gate_cache,
+    gate_matrix,
+    statevector_output,
+)
+from random_circuit import (
+    POTENTIAL_GATES,
+    evaluate_circuit,
+    gate_strings,
+    random_circuit,
+    random_program,
+)
+
+# Circuit depths statevector_output is timed at
+BENCHMARK_DEPTHS = (1, 10, 100, 1000, 10000, 100000)
+
+# The fraction a benchmark's throughput may drop below its baseline before it
+# counts as a regression
+DEFAULT_THRESHOLD = 0.25
+
+
+def time_call(function, repeat=3):
+    """
+    Times a function, keeping the fastest of several runs to reduce noise.
+
+    Args:
+        function: A function that takes no arguments
+        repeat: The number of times to run the function
+
+    Returns:
+        The fastest run time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(scale=1.0, depths=BENCHMARK_DEPTHS, seed=0):
+    """
+    Runs every benchmark once.
+
+    Args:
+        scale: A factor on the number of gates and circuits in each benchmark, so
+        quick runs can use less than 1
+        depths: The circuit depths to time statevector_output at
+        seed: A seed for the random circuits and counts
+
+    Returns:
+        A dictionary mapping each benchmark name to a dictionary of the number of
+        items processed, their unit, the seconds taken and the items per second.
+    """
+    rng = np.random.default_rng(seed)
+    n_gates = max(1, int(2000 * scale))
+    n_circuits = max(1, int(10000 * scale))
+    results = {}
+
+    def record(name, items, unit, seconds):
+        results[name] = {
+            "items": items,
+            "unit": unit,
+            "seconds": seconds,
+            "rate": items / seconds if seconds else float("inf"),
+        }
+
+    # gate_matrix for each gate type, clearing the cache so every matrix is built
+    for opcode, name in enumerate(GATE_NAMES[: len(POTENTIAL_GATES)]):
+        program = random_program(n_gates, seed=rng)
+        program["opcode"] = opcode
+        if GATE_QUBIT_COUNTS[opcode] == 1:
+            program["qubits"][:, 1] = -1
+        program["angles"][:, GATE_ANGLE_COUNTS[opcode] :] = 0
+        gates = gate_strings(program)
+
+        def build_matrices(gates=gates):
+            clear_gate_cache()
+            for gate in gates:
+                gate_matrix(gate)
+
+        record("gate_matrix." + name, n_gates, "gates", time_call(build_matrices))
+
+    # statevector_output from gate strings, repeating shallow circuits so every
+    # depth simulates a similar number of gates
+    for depth in depths:
+        repeats = max(1, int(10000 * scale) // depth)
+        circuits = [
+            gate_strings(program)
+            for program in random_program(depth, n_circuits=repeats, seed=rng)
+        ]
+
+        def simulate(circuits=circuits):
+            clear_gate_cache()
+            for gate_list in circuits:
+                statevector_output(gate_list)
+
+        record(
+            "statevector_output.depth_" + str(depth),
+            depth * repeats,
+            "gates",
+            time_call(simulate, repeat=1 if depth * repeats > 10000 else 3),
+        )
+
+    # random_circuit drawing one deep gate list
+    record(
+        "random_circuit",
+        n_gates * 10,
+        "gates",
+        time_call(lambda: random_circuit(n_gates * 10)),
+    )
+
+    # evaluate_circuit needs Qiskit to build the circuit object, so it is only
+    # timed where Qiskit is installed
+    if importlib.util.find_spec("qiskit") is not None:
+        gatelist = random_circuit(n_gates)
+        record(
+            "evaluate_circuit",
+            n_gates,
+            "gates",
+            time_call(lambda: evaluate_circuit(gatelist, rng=rng)),
+        )
+
+    # chi_squared and significance_statement over many circuits of counts
+    theory = rng.dirichlet(np.ones(4), size=n_circuits)
+    counts = np.array([rng.multinomial(1024, row) for row in theory])
+    theory_lists = (theory * 1024).tolist()
+    count_lists = counts.tolist()
+
+    def statements():
+        for theory_val, experimental_val in zip(theory_lists, count_lists):
+            significance_statement(chi_squared(theory_val, experimental_val))
+
+    record(
+        "chi_squared.significance_statement",
+        n_circuits,
+        "circuits",
+        time_call(statements),
+    )
+    record(
+        "batch_chi_squared",
+        n_circuits,
+        "circuits",
+        time_call(lambda: batch_chi_squared(theory * 1024, counts)),
+    )
+    return results
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the throughput of a run against a saved baseline.
+
+    Args:
+        results: The dictionary returned by run_benchmarks
+        baseline: The results of an earlier run, as saved by main
+        threshold: The fraction the throughput may drop before it is a regression
+
+    Returns:
+        A list of (name, baseline rate, rate) tuples of every benchmark in both runs
+        whose throughput dropped past the threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline:
+            baseline_rate = baseline[name]["rate"]
+            if result["rate"] < baseline_rate * (1 - threshold):
+                regressions.append((name, baseline_rate, result["rate"]))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks from the command line, printing the throughput of each.
+
+    Args:
+        argv: The command line arguments, read from sys.argv by default
+
+    Returns:
+        The exit status, which is 1 when a benchmark regressed past the threshold.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument(
+        "--depths", default=",".join(str(depth) for depth in BENCHMARK_DEPTHS)
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    depths = [int(depth) for depth in args.depths.split(",")]
+    results = run_benchmarks(args.scale, depths, args.seed)
+    for name, result in results.items():
+        print(f"{name:45} {result['rate']:14,.0f} {result['unit']}/s")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf8") as baseline_file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "results": results,
+                },
+                baseline_file,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, encoding="utf8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, baseline_rate, rate in regressions:
+            print(
+                f"Regression in {name}: {rate:,.0f} against a baseline of "
+                f"{baseline_rate:,.0f} {results[name]['unit']}/s"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,16 @@
 A Chi-squared calculator for comparing experimental
 and theoretical values for Qubit configurations
 """
+from functools import lru_cache
+import math
+import numpy as np
+from profiling import profiled
 
+# Stand-in for an expected value of zero, which would otherwise be divided by
+ZERO_EXPECTED = 0.00001
 
+
+@profiled("chi_squared")
 def chi_squared(theory_val, experimental_val):
     """
     Calculates the Chi-Squared value between the theoretical
@@ -11,7 +19,8 @@ def chi_squared(theory_val, experimental_val):
 
     Args:
         theory_val: A list of integers that represents the number of instances
-        the IBM qubit configuration (00, 01, 10, 11) is expected occurs.
+        the IBM qubit configuration (00, 01, 10, 11 for two qubits, or all 2^n
+        configurations for n qubits) is expected occurs.
 
         experimental_val: A list of integers that represents the number of instances
         the IBM qubit configuration (00, 01, 10, 11) is actually occured in our randomly
@@ -30,18 +39,140 @@ def chi_squared(theory_val, experimental_val):
 
     # Calculates the chi-squared value of all given data points
     chi_value = 0
-    for i in range(4):
+    for i in range(len(theory_val)):
         # Computes the chi squared of a specific qubit instance
         if theory_val[i] != 0:
             chi_value += (experimental_val[i] - theory_val[i]) ** 2 / theory_val[i]
         # If there are expected values equal to zero, then divde by a really small
         # number
         else:
-            chi_value += (experimental_val[i] - 0.00001) ** 2 / 0.00001
+            chi_value += (experimental_val[i] - ZERO_EXPECTED) ** 2 / ZERO_EXPECTED
     return round(chi_value, 3)
 
 
-def significance_statement(chi_value, significance=0.05):
+@profiled("batch_chi_squared")
+def batch_chi_squared(theory_val, experimental_val):
+    """
+    Calculates the Chi-Squared values of whole arrays of tests at once, in the
+    same way as chi_squared but without rounding.
+
+    Args:
+        theory_val: An array of shape (..., k) with the number of instances each of
+        the k qubit configurations is expected to occur in every test.
+
+        experimental_val: An array of shape (..., k) with the number of instances
+        each qubit configuration actually occured in every test. The leading
+        dimensions of both arrays are broadcast against eachother.
+
+    Returns:
+        A float64 array of the Chi-squared value of every test, and a boolean array
+        of the same shape that is True for tests whose sums are not the same. The
+        Chi-squared value of those tests is NaN.
+    """
+    theory_val = np.asarray(theory_val, dtype=np.float64)
+    experimental_val = np.asarray(experimental_val, dtype=np.float64)
+    # Checks to see if the arrays have the same number of qubit configurations
+    if theory_val.shape[-1] != experimental_val.shape[-1]:
+        raise ValueError("Arrays must have the same number of qubit configurations")
+
+    # Checks to see if the sum of all elements are the same in each test
+    invalid = (
+        np.abs(np.sum(theory_val, axis=-1) - np.sum(experimental_val, axis=-1)) > 0.001
+    )
+
+    # Expected values equal to zero are replaced by a really small number
+    theory_val = np.where(theory_val != 0, theory_val, ZERO_EXPECTED)
+    chi_value = np.sum((experimental_val - theory_val) ** 2 / theory_val, axis=-1)
+    return np.where(invalid, np.nan, chi_value), invalid
+
+
+def chi_squared_sf(chi_value, dof=3):
+    """
+    Calculates the probability that a Chi-squared value at least as large would
+    happen by chance (the p-value) for whole arrays of Chi-squared values.
+
+    Args:
+        chi_value: A float or array of Chi-squared values.
+        dof: A positive integer number of degrees of freedom, which is one less
+        than the number of qubit configurations. The value is preset to 3.
+
+    Returns:
+        An array of the same shape as chi_value with the p-value of every
+        Chi-squared value, accurate to float precision.
+    """
+    if dof < 1 or dof != int(dof):
+        raise ValueError("Degrees of freedom must be a positive integer")
+    half_chi = np.maximum(np.asarray(chi_value, dtype=np.float64), 0) / 2
+
+    # Start from the survival function of 1 or 2 degrees of freedom and add two
+    # degrees of freedom at a time, which adds x^a e^(-x) / Gamma(a + 1) each time
+    if dof % 2 == 0:
+        shape = 1.0
+        p_value = np.exp(-half_chi)
+    else:
+        shape = 0.5
+        p_value = _erfc(np.sqrt(half_chi))
+    with np.errstate(divide="ignore"):
+        log_half_chi = np.log(half_chi)
+    # Every term vanishes for an infinite statistic, but would be inf - inf
+    infinite = np.isposinf(half_chi)
+    finite_half_chi = np.where(infinite, 0, half_chi)
+    while shape < dof / 2:
+        exponent = shape * log_half_chi - finite_half_chi - math.lgamma(shape + 1)
+        p_value = p_value + np.exp(np.where(infinite, -np.inf, exponent))
+        shape += 1
+    return np.minimum(p_value, 1.0)
+
+
+@lru_cache(maxsize=None)
+def critical_value(dof, significance):
+    """
+    Finds the Chi-squared value whose p-value is exactly the level of
+    significance. Values are cached for every pair of arguments.
+
+    Args:
+        dof: A positive integer number of degrees of freedom.
+        significance: A float between 0 and 1 (non-inclusive) for the level of
+        significance.
+
+    Returns:
+        The critical Chi-squared value as a float.
+    """
+    if not 0 < significance < 1:
+        raise ValueError("Level of significance must be between 0 and 1")
+    # Bracket the critical value, then bisect until the bracket stops shrinking
+    lower, upper = 0.0, float(dof)
+    while chi_squared_sf(upper, dof) > significance:
+        lower, upper = upper, upper * 2
+    while True:
+        middle = (lower + upper) / 2
+        if middle in (lower, upper):
+            return upper
+        if chi_squared_sf(middle, dof) > significance:
+            lower = middle
+        else:
+            upper = middle
+
+
+def significance_mask(chi_value, significance=0.05, dof=3):
+    """
+    Determines which of a whole array of Chi-squared values are statistically
+    significant.
+
+    Args:
+        chi_value: A float or array of Chi-squared values.
+        significance: A float between 0 and 1 (non-inclusive) for the level of
+        significance. The value is preset to 0.05
+        dof: A positive integer number of degrees of freedom, preset to 3.
+
+    Returns:
+        A boolean array of the same shape as chi_value that is True where the
+        results are statistically significant.
+    """
+    return np.asarray(chi_value) >= critical_value(dof, significance)
+
+
+def significance_statement(chi_value, significance=0.05, dof=3):
     """
     Determines if the Chi squared value is statistically significant
     with a specified level of significance.
@@ -53,51 +184,136 @@ def significance_statement(chi_value, significance=0.05):
         significance: A float between 0 and 1 (non-inclusive) that is meant to represent
         the level of significance the Chi-squared test may exceed for the experimental and
         theoretical data to be independent. The value is preset to 0.05
+
+        dof: A positive integer number of degrees of freedom, preset to 3 for the four
+        configurations of two qubits.
     Returns:
         A string explaining whether or not the data is statistically
         significant.
     """
-
-    # Define a list of known chi-squared values respective to significance
-    # values of 3 degrees of freedom
-    significance_list = [0.115, 0.352, 0.584, 1.212, 2.366, 4.11, 6.25, 7.81, 11.34]
-    significance_level = [0.99, 0.95, 0.90, 0.75, 0.50, 0.25, 0.10, 0.05, 0.01]
-    lowest_significance = 1
-    significance_index = 0
-    invariant_boolean = False
-    for i, sig_fig in enumerate(significance_level):
-        approximate_significance = sig_fig - significance
-        if abs(approximate_significance) < abs(lowest_significance):
-            lowest_significance = approximate_significance
-            significance_index = i
-
-    # Iterate through the list to see if the significance is in the list
-    for i, level_index in enumerate(significance_level):
-        if abs(level_index - significance) < 0.001:
-            invariant_boolean = True
-            index = i
-            break
-
-    # Check to see if a given significant value is in the significant level list
-    if invariant_boolean is True:
-        relative_chi = significance_list[index]
-    # If not, approximate the level of significance linearly
-    else:
-        if lowest_significance < 0:
-            relative_chi = (
-                significance_list[significance_index]
-                - significance_list[significance_index - 1]
-            ) * lowest_significance + significance_list[i]
-        else:
-            relative_chi = (
-                significance_list[significance_index + 1]
-                - significance_list[significance_index]
-            ) * lowest_significance + significance_list[i]
-
     # Determine if the data is statistically significant
-    if relative_chi > chi_value:
+    if critical_value(dof, significance) > chi_value:
         significance_string = "The results are not statisically significant"
     else:
         significance_string = "The results are statisically significant"
 
     return significance_string
+
+
+# Coefficients of W. J. Cody's rational approximations of erf and erfc, from
+# "Rational Chebyshev approximations for the error function" (1969), for
+# |x| <= 0.46875, 0.46875 < |x| <= 4 and |x| > 4
+_ERF_SMALL_NUMERATOR = (
+    1.85777706184603153e-1,
+    3.16112374387056560e00,
+    1.13864154151050156e02,
+    3.77485237685302021e02,
+    3.20937758913846947e03,
+)
+_ERF_SMALL_DENOMINATOR = (
+    1.0,
+    2.36012909523441209e01,
+    2.44024637934444173e02,
+    1.28261652607737228e03,
+    2.84423683343917062e03,
+)
+_ERFC_MIDDLE_NUMERATOR = (
+    2.15311535474403846e-8,
+    5.64188496988670089e-1,
+    8.88314979438837594e00,
+    6.61191906371416295e01,
+    2.98635138197400131e02,
+    8.81952221241769090e02,
+    1.71204761263407058e03,
+    2.05107837782607147e03,
+    1.23033935479799725e03,
+)
+_ERFC_MIDDLE_DENOMINATOR = (
+    1.0,
+    1.57449261107098347e01,
+    1.17693950891312499e02,
+    5.37181101862009858e02,
+    1.62138957456669019e03,
+    3.29079923573345963e03,
+    4.36261909014324716e03,
+    3.43936767414372164e03,
+    1.23033935480374942e03,
+)
+_ERFC_LARGE_NUMERATOR = (
+    1.63153871373020978e-2,
+    3.05326634961232344e-1,
+    3.60344899949804439e-1,
+    1.25781726111229246e-1,
+    1.60837851487422766e-2,
+    6.58749161529837803e-4,
+)
+_ERFC_LARGE_DENOMINATOR = (
+    1.0,
+    2.56852019228982242e00,
+    1.87295284992346725e00,
+    5.27905102951428412e-1,
+    6.05183413124413191e-2,
+    2.33520497626869185e-3,
+)
+
+# exp(-r^2) of every multiple r of 1/16 up to 28, the largest value _erfc uses
+_EXP_SIXTEENTHS = np.exp(-((np.arange(28 * 16 + 1) / 16) ** 2))
+
+
+def _erfc(x):
+    """
+    Calculates the complementary error function of every element of an array
+    with whole array operations, accurate to float precision.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    shape = x.shape
+    x = x.reshape(-1)
+    # erfc underflows to 0 before 28, which also keeps infinities finite
+    y = np.minimum(np.abs(x), 28.0)
+
+    # Most values take the middle approximation, erfc over exp(-y^2), so it is
+    # evaluated everywhere and the few values outside its range are replaced
+    result = _horner(_ERFC_MIDDLE_NUMERATOR, y)
+    result /= _horner(_ERFC_MIDDLE_DENOMINATOR, y)
+    large = y > 4
+    if large.any():
+        y_large = y[large]
+        inverse_squared = 1 / (y_large * y_large)
+        result[large] = (
+            1 / math.sqrt(math.pi)
+            - inverse_squared
+            * _horner(_ERFC_LARGE_NUMERATOR, inverse_squared)
+            / _horner(_ERFC_LARGE_DENOMINATOR, inverse_squared)
+        ) / y_large
+
+    # exp(-y^2) is split as exp(-r^2) exp(-(y - r)(y + r)) with r = y rounded
+    # down to a sixteenth, so the rounding of y^2 is not magnified. NaN keeps
+    # its value through result, so only its table index is replaced
+    sixteenths = np.fmin(y * 16, 28 * 16).astype(np.intp)
+    result *= _EXP_SIXTEENTHS[sixteenths]
+    # -(y - r)(y + r) is d (d + 2y) for d = r - y
+    difference = sixteenths / 16 - y
+    result *= np.exp(difference * (difference + 2 * y))
+
+    # Near 0 erfc is taken from erf instead
+    small = y <= 0.46875
+    if small.any():
+        y_squared = y[small] ** 2
+        result[small] = 1 - y[small] * (
+            _horner(_ERF_SMALL_NUMERATOR, y_squared)
+            / _horner(_ERF_SMALL_DENOMINATOR, y_squared)
+        )
+    negative = x < 0
+    result[negative] = 2 - result[negative]
+    return result.reshape(shape)
+
+
+def _horner(coefficients, x):
+    """
+    Evaluates a polynomial, highest power first, in place on one array.
+    """
+    result = np.full_like(x, coefficients[0])
+    for coefficient in coefficients[1:]:
+        result *= x
+        result += coefficient
+    return result
@@ -0,0 +1,148 @@
+"""
+Parameterized circuit templates, whose angles are named slots such as
+".rx(theta, 0)" instead of numbers. A template is compiled once and then bound
+to whole arrays of angles, so the same circuit is simulated for M parameter
+values at once: the M matrices of every parameterized gate are built in one
+broadcast cos/sin step, and all M statevectors are propagated together.
+
+Any angle of the rx, ry, rz, p, u, rxx, ryy and rzz gates can be a slot, and
+the same name may be used in several places.
+"""
+import numpy as np
+from expected_value import (
+    GATE_ANGLE_COUNTS,
+    GATE_QUBIT_COUNTS,
+    apply_gate_matrix,
+    check_qubits,
+    compile_circuit,
+    compile_gate,
+    fuse_program,
+    local_gate_matrices,
+    run_fused_program,
+)
+
+
+def compile_template(gate_list):
+    """
+    Compiles a list of gate strings whose angles may be named slots.
+
+    Args:
+        gate_list: A list of gate strings such as ".rx(theta, 0)" or ".u(a, 0.5, b, 1)"
+
+    Returns:
+        A tuple of the compiled program, with every slot set to 0, and a dictionary
+        mapping each slot name to a list of the (gate index, angle index) places it
+        fills, in the order the names first appear.
+    """
+    gates = []
+    slots = {}
+    for i, gate in enumerate(gate_list):
+        open_paren = gate.find("(")
+        arguments = gate[open_paren + 1 : gate.rfind(")")].split(",")
+        places = {}
+        for j, argument in enumerate(arguments):
+            if argument.strip().isidentifier():
+                places[j] = argument.strip()
+                arguments[j] = "0"
+        gate = gate[: open_paren + 1] + ",".join(arguments) + ")"
+        opcode = compile_gate(gate)[0]
+        for j, name in places.items():
+            if j >= GATE_ANGLE_COUNTS[opcode]:
+                raise ValueError("Only angles can be parameters in gate " + repr(gate))
+            slots.setdefault(name, []).append((i, j))
+        gates.append(gate)
+    return compile_circuit(gates), slots
+
+
+def bind_template(template, parameters):
+    """
+    Fills the slots of a template with arrays of angles.
+
+    Args:
+        template: The tuple returned by compile_template
+        parameters: A dictionary mapping every slot name to a float or an array of
+        shape (M,)
+
+    Returns:
+        A float64 array of shape (M, number of gates, 3) with the angles of every
+        gate for each of the M bindings.
+    """
+    program, slots = template
+    missing = set(slots) - set(parameters)
+    if missing:
+        raise ValueError("No values given for parameters " + str(sorted(missing)))
+    values = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(parameters[name], dtype=float)) for name in slots]
+    )
+    n_bindings = len(values[0]) if values else 1
+    angles = np.repeat(program["angles"][None], n_bindings, axis=0)
+    for name, value in zip(slots, values):
+        for i, j in slots[name]:
+            angles[:, i, j] = value
+    return angles
+
+
+def template_statevectors(template, parameters, n_qubits=2, dtype=np.complex128):
+    """
+    Simulates a template for every binding of its parameters at once. Runs of
+    gates without parameters are fused and shared by every binding.
+
+    Args:
+        template: The tuple returned by compile_template, or a list of gate strings
+        parameters: A dictionary mapping every slot name to a float or an array of
+        shape (M,)
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64
+
+    Returns:
+        An array of shape (M, 2^n) in the given dtype with the final statevector of
+        every binding.
+    """
+    if not isinstance(template, tuple):
+        template = compile_template(template)
+    program, slots = template
+    check_qubits(program, n_qubits)
+    angles = bind_template(template, parameters)
+    parameterized = np.zeros(len(program), dtype=bool)
+    for places in slots.values():
+        parameterized[[i for i, _ in places]] = True
+
+    statevectors = np.zeros((len(angles), 2**n_qubits), dtype=dtype)
+    statevectors[:, 0] = 1
+    start = 0
+    for i in list(np.flatnonzero(parameterized)) + [len(program)]:
+        # Gates up to the next parameterized gate are the same for every binding
+        if i > start:
+            fixed = fuse_program(program[start:i], n_qubits)
+            statevectors = run_fused_program(fixed, n_qubits, statevectors)
+        if i < len(program):
+            opcode = program["opcode"][i]
+            statevectors = apply_gate_matrix(
+                statevectors,
+                local_gate_matrices(opcode, angles[:, i], dtype),
+                tuple(program["qubits"][i, : GATE_QUBIT_COUNTS[opcode]]),
+                n_qubits,
+            )
+        start = i + 1
+    return statevectors
+
+
+def template_probabilities(template, parameters, n_qubits=2, dtype=np.complex128):
+    """
+    Calculates the probability of every qubit configuration for every binding of
+    a template's parameters at once.
+
+    Args:
+        template: The tuple returned by compile_template, or a list of gate strings
+        parameters: A dictionary mapping every slot name to a float or an array of
+        shape (M,)
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64
+
+    Returns:
+        An array of shape (M, 2^n) with the probabilities of every binding, float64
+        by default or float32 for np.complex64.
+    """
+    return np.abs(template_statevectors(template, parameters, n_qubits, dtype)) ** 2
@@ -0,0 +1,202 @@
+"""
+A density matrix engine for simulating circuits under noise, so measured
+counts can be compared against a noise model instead of only the ideal
+probabilities of statevector_output.
+
+Every gate is followed by a depolarizing and an amplitude damping channel on
+the qubits it acts on, and measurements are flipped by a readout error. The
+density matrix of n qubits is handled as a vector over 2n qubits, the columns
+being qubits 0 to n - 1 and the rows qubits n to 2n - 1, so each gate and its
+noise is a single superoperator applied with expected_value.apply_gate_matrix.
+
+Noise parameters may be arrays of shape (M,), in which case M noise models are
+simulated at once, which is how a noise model is fitted to measured counts.
+"""
+import numpy as np
+from expected_value import (
+    GATE_OPCODES,
+    GATE_QUBIT_COUNTS,
+    apply_gate_matrix,
+    check_qubits,
+    compile_circuit,
+    local_gate_matrices,
+)
+
+
+def unitary_superoperators(gate_list):
+    """
+    Builds the superoperator of every gate of a circuit without noise, which
+    only has to be done once however many noise models it is simulated with.
+
+    Args:
+        gate_list: A list of gate strings such as ".h(0)", or a compiled program
+
+    Returns:
+        A list of (qubits, superoperator) pairs, one per gate, where the
+        superoperator of a gate on k qubits has shape (4^k, 4^k). Identity gates
+        are left out.
+    """
+    program = compile_circuit(gate_list)
+    superoperators = []
+    for opcode, qubits, angles in zip(
+        program["opcode"], program["qubits"], program["angles"]
+    ):
+        if opcode == GATE_OPCODES["id"]:
+            continue
+        matrix = local_gate_matrices(opcode, angles)
+        qubits = tuple(int(qubit) for qubit in qubits[: GATE_QUBIT_COUNTS[opcode]])
+        superoperators.append((qubits, np.kron(matrix, matrix.conj())))
+    return superoperators
+
+
+def noise_superoperators(n_gate_qubits, depolarizing=0.0, amplitude_damping=0.0):
+    """
+    Builds the superoperator of the noise that follows a gate.
+
+    Args:
+        n_gate_qubits: The number of qubits the gate acts on, 1 or 2
+        depolarizing: The probability the qubits of the gate are replaced by the
+        maximally mixed state, as a float or an array of shape (M,)
+        amplitude_damping: The probability each qubit of the gate decays from 1 to
+        0, as a float or an array of shape (M,)
+
+    Returns:
+        An array of shape (M, 4^k, 4^k) with the superoperator of every noise
+        model, where k is n_gate_qubits and M is 1 for float parameters.
+    """
+    depolarizing, amplitude_damping = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(depolarizing, dtype=float)),
+        np.atleast_1d(np.asarray(amplitude_damping, dtype=float)),
+    )
+    size = 2**n_gate_qubits
+
+    # Kraus operators of amplitude damping on one qubit, for every model
+    decay = np.zeros(depolarizing.shape + (2, 2, 2))
+    decay[:, 0, 0, 0] = 1
+    decay[:, 0, 1, 1] = np.sqrt(1 - amplitude_damping)
+    decay[:, 1, 0, 1] = np.sqrt(amplitude_damping)
+    damping = np.einsum("mkab,mkcd->macbd", decay, decay).reshape(-1, 4, 4)
+    if n_gate_qubits == 2:
+        # The damping of both qubits, on the column and row index of each qubit
+        damping = damping.reshape(-1, 2, 2, 2, 2)
+        damping = np.einsum("mabcd,mefgh->maebfcgdh", damping, damping).reshape(
+            -1, 16, 16
+        )
+
+    # Depolarizing keeps the state with probability 1 - p and otherwise replaces
+    # it by the identity over its dimension, so it maps vec(rho) to vec(I) tr(rho)
+    identity = np.eye(size).reshape(-1)
+    depolarize = (1 - depolarizing)[:, None, None] * np.eye(size**2) + (
+        depolarizing / size
+    )[:, None, None] * np.outer(identity, identity)
+    return np.matmul(depolarize, damping)
+
+
+def noisy_channels(gate_list, depolarizing=0.0, amplitude_damping=0.0):
+    """
+    Precomputes the superoperator of every gate of a circuit combined with the
+    noise that follows it.
+
+    Args:
+        gate_list: A list of gate strings such as ".h(0)", a compiled program, or
+        the list returned by unitary_superoperators
+        depolarizing: The depolarizing probability, as a float or an array (M,)
+        amplitude_damping: The amplitude damping probability, as a float or an
+        array (M,)
+
+    Returns:
+        A list of (qubits, superoperators) pairs, one per gate, where the
+        superoperators have shape (M, 4^k, 4^k).
+    """
+    if not _is_superoperator_list(gate_list):
+        gate_list = unitary_superoperators(gate_list)
+    noise = {
+        n_gate_qubits: noise_superoperators(
+            n_gate_qubits, depolarizing, amplitude_damping
+        )
+        for n_gate_qubits in (1, 2)
+    }
+    return [
+        (qubits, np.matmul(noise[len(qubits)], superoperator))
+        for qubits, superoperator in gate_list
+    ]
+
+
+def density_matrix_output(
+    gate_list,
+    n_qubits=2,
+    depolarizing=0.0,
+    amplitude_damping=0.0,
+    readout_error=0.0,
+    dtype=np.complex128,
+):
+    """
+    Calculates the probability of every qubit configuration after a circuit is
+    run under a noise model, starting from every qubit in the 0 state.
+
+    Args:
+        gate_list: A list of gate strings such as ".h(0)", a compiled program, or
+        the list returned by unitary_superoperators
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+        depolarizing: The depolarizing probability after every gate, as a float or
+        an array of shape (M,)
+        amplitude_damping: The amplitude damping probability of every qubit after
+        every gate it is acted on by, as a float or an array of shape (M,)
+        readout_error: The probability each qubit is measured flipped, as a float
+        or an array of shape (M,)
+        dtype: The complex precision of the density matrices, np.complex128 by
+        default or np.complex64 to halve their memory
+
+    Returns:
+        An array of shape (M, 2^n) with the measured probabilities of every noise
+        model, or (2^n,) when every noise parameter is a float. The probabilities are
+        float64 by default or float32 for np.complex64.
+    """
+    if not _is_superoperator_list(gate_list):
+        check_qubits(compile_circuit(gate_list), n_qubits)
+    n_models = np.broadcast(
+        np.asarray(depolarizing),
+        np.asarray(amplitude_damping),
+        np.asarray(readout_error),
+    ).shape
+    channels = noisy_channels(gate_list, depolarizing, amplitude_damping)
+
+    # vec(rho) of |0...0><0...0| for every noise model
+    density = np.zeros((int(np.prod(n_models)), 4**n_qubits), dtype=dtype)
+    density[:, 0] = 1
+    for qubits, superoperator in channels:
+        # The gate, the high kron factor, acts on the row index (qubits n to
+        # 2n - 1) and its conjugate on the column index (qubits 0 to n - 1)
+        density = apply_gate_matrix(
+            density,
+            superoperator.astype(dtype, copy=False),
+            qubits + tuple(qubit + n_qubits for qubit in qubits),
+            2 * n_qubits,
+        )
+    probabilities = np.real(
+        density.reshape(-1, 2**n_qubits, 2**n_qubits).diagonal(axis1=1, axis2=2)
+    )
+
+    # Readout errors flip each qubit independently
+    readout_error = np.broadcast_to(
+        np.asarray(readout_error, dtype=float), n_models
+    ).reshape(-1)
+    confusion = np.empty((len(readout_error), 2, 2), dtype=probabilities.dtype)
+    confusion[:, 0, 0] = confusion[:, 1, 1] = 1 - readout_error
+    confusion[:, 0, 1] = confusion[:, 1, 0] = readout_error
+    for qubit in range(n_qubits):
+        probabilities = apply_gate_matrix(probabilities, confusion, (qubit,), n_qubits)
+    probabilities = np.clip(probabilities, 0, None)
+    return probabilities.reshape(n_models + (2**n_qubits,))
+
+
+def _is_superoperator_list(gate_list):
+    """
+    Checks whether a circuit was already turned into superoperators by
+    unitary_superoperators.
+    """
+    return (
+        isinstance(gate_list, list)
+        and bool(gate_list)
+        and isinstance(gate_list[0], tuple)
+    )
@@ -3,46 +3,758 @@ Functions that calculate the probability of all qubit configurations
 after passing them through quantum gates and collapsing the superpositions
 when measured.
 """
+from collections import OrderedDict
+
 import numpy as np
+from profiling import count, profiled
+
+# Gate names indexed by their opcode. The first twenty opcodes match the keys of
+# POTENTIAL_GATES in random_circuit, and the identity gate is used for padding
+GATE_NAMES = (
+    "u",
+    "h",
+    "y",
+    "x",
+    "z",
+    "p",
+    "s",
+    "sdg",
+    "t",
+    "tdg",
+    "cx",
+    "swap",
+    "sx",
+    "sxdg",
+    "rx",
+    "ry",
+    "rz",
+    "rxx",
+    "ryy",
+    "rzz",
+    "id",
+)
+GATE_OPCODES = {name: opcode for opcode, name in enumerate(GATE_NAMES)}
+
+# Number of phase angles and number of qubits each gate reads, indexed by opcode
+GATE_ANGLE_COUNTS = np.array(
+    [3, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0]
+)
+GATE_QUBIT_COUNTS = np.array(
+    [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 1, 1, 1, 1, 1, 2, 2, 2, 1]
+)
+
+# Layout of a compiled circuit. Each row is one gate, with unused qubit slots set
+# to -1 and unused angle slots set to 0
+PROGRAM_DTYPE = np.dtype(
+    [("opcode", np.int8), ("qubits", np.int32, (2,)), ("angles", np.float64, (3,))]
+)
+
+# Permutation that exchanges the roles of the two qubits in a 4 by 4 operator
+QUBIT_EXCHANGE = np.array([0, 2, 1, 3])
+
+# Layout of a fused program. Each row is a 4 by 4 matrix acting on a pair of qubits,
+# indexed in the same way as the two qubit matrices of local_gate_matrices
+FUSED_DTYPE = np.dtype([("qubits", np.int32, (2,)), ("matrix", complex, (4, 4))])
+
+# Most matrices of gates with angles kept in the gate cache, which is keyed on the
+# opcode, qubits and angles of a compiled gate
+GATE_CACHE_SIZE = 4096
+_GATE_CACHE = OrderedDict()
+GATE_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# The largest circuit apply_pair_matrix contracts with einsum, above which summing
+# quarters of the state is faster
+INPLACE_EINSUM_MAX_QUBITS = 10
 
 
-def statevector_output(gate_list):
+@profiled("statevector_output")
+def statevector_output(gate_list, n_qubits=2, dtype=np.complex128, workspace=None):
     """
     Calculates the statevector and qubit probabilitiy indicies after a
     quantum circuit has been executed in real time.
 
     Args:
         gate_list: A list of ordered quantum gate instructions that a quantum circuit
-        must follow. Each gate has different properties when activated
+        must follow, or the program returned by compile_circuit for that list. Passing
+        the compiled program lets the same circuit be simulated again without parsing
+        the gate strings.
+        n_qubits: The number of qubits in the circuit. Two qubit circuits multiply
+        4 by 4 matrices, while larger circuits are fused with fuse_program and each
+        fused gate is applied directly to the qubits it acts on without building a
+        matrix for the whole circuit.
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64 for half the memory traffic
+        workspace: An optional dictionary returned by allocate_workspace to simulate
+        in. Reusing one workspace over many circuits means no statevector sized
+        arrays are allocated per gate or per call, but the returned arrays are views
+        into the workspace that the next call overwrites. The gate operators (or
+        fused gates) of the last program are also kept in the workspace, so the same
+        program simulated again only compares it against the kept copy instead of
+        building them again. Its precision replaces dtype.
 
     Returns:
-        Outputs three 4 by 1 arrays of the following: A statevector with complex numbers
-        as indicies of all qubit combinations, the statevector's respective complex
-        conjugate statevector, and the probability density vector of all qubit combinations.
+        Outputs three arrays of length 2^n of the following: The probability density
+        vector of all qubit combinations, a statevector with complex numbers as
+        indicies of all qubit combinations, and the statevector's respective complex
+        conjugate statevector. Qubit 0 is the least significant bit of each index.
     """
-    # Intialize a statevector with 00 as the only occurence as well as empty lists for the
-    # final conjugate statevectors and final qubit probabilities
-    statevector = np.array([1, 0, 0, 0])
-    conjugate_statevector = []
-    qubit_probabilities = []
-    # Perform matrix multiplication on all respective gates in the circuit
-    for i, gate in enumerate(gate_list):
-        gate_composition = gate_matrix(gate)
-        statevector = np.matmul(gate_composition, statevector)
+    program = compile_circuit(gate_list)
+    check_qubits(program, n_qubits)
+    if workspace is None:
+        workspace = allocate_workspace(n_qubits, dtype)
+    statevector = workspace["statevector"]
+    scratch = workspace["scratch"]
+    dtype = statevector.dtype
+
+    # Build the operators of the program, unless the workspace already holds them
+    kept = workspace.get("program")
+    if kept is None or kept.shape != program.shape or not (kept == program).all():
+        if n_qubits == 2:
+            operators = program_operators(program, dtype=dtype)
+        else:
+            # Fuse runs of gates on the same pair of qubits before contracting
+            fused = fuse_program(program, n_qubits)
+            operators = (fused["qubits"], fused["matrix"].astype(dtype, copy=False))
+        workspace["program"] = program.copy()
+        workspace["operators"] = operators
+    operators = workspace["operators"]
+
+    # Intialize a statevector with 00 as the only occurence
+    statevector[:] = 0
+    statevector[0] = 1
+    if n_qubits == 2:
+        # Perform matrix multiplication on all respective gates in the compiled
+        # circuit, alternating between the two buffers of the workspace
+        for gate_composition in operators:
+            np.matmul(gate_composition, statevector, out=scratch)
+            statevector, scratch = scratch, statevector
+    else:
+        for qubits, matrix in zip(*operators):
+            apply_pair_matrix(statevector, matrix, qubits, n_qubits, scratch, workspace)
+            statevector, scratch = scratch, statevector
 
     # Calculate the conjugate statevector and probabilties after the normal
     # statevector has been computed
-    for i in range(4):
-        conjugate_value = np.conjugate(statevector[i])
-        conjugate_statevector.append(conjugate_value)
-        qubit_probabilities.append(
-            float(np.real(np.multiply(statevector[i], conjugate_statevector[i])))
-        )
+    conjugate_statevector = np.conjugate(statevector, out=workspace["conjugate"])
+    qubit_probabilities = np.abs(statevector, out=workspace["probabilities"])
+    np.square(qubit_probabilities, out=qubit_probabilities)
 
     # Return all values
     return qubit_probabilities, statevector, conjugate_statevector
 
 
+def allocate_workspace(n_qubits=2, dtype=np.complex128):
+    """
+    Allocates the buffers statevector_output simulates in, so they can be
+    reused over many circuits.
+
+    Args:
+        n_qubits: The number of qubits in the circuits, set to 2 by default
+        dtype: The complex precision, np.complex128 by default or np.complex64
+
+    Returns:
+        A dictionary of the statevector and scratch buffers the gates alternate
+        between, the buffers the conjugate and probabilities are written to, a
+        quarter length partial buffer used by apply_pair_matrix, and the last
+        program simulated in it with its operators.
+    """
+    dtype = np.dtype(dtype)
+    size = 2**n_qubits
+    return {
+        "statevector": np.empty(size, dtype=dtype),
+        "scratch": np.empty(size, dtype=dtype),
+        "conjugate": np.empty(size, dtype=dtype),
+        "probabilities": np.empty(size, dtype=np.finfo(dtype).dtype),
+        "partial": np.empty(max(size // 4, 1), dtype=dtype),
+        "program": None,
+        "operators": None,
+    }
+
+
+def apply_pair_matrix(statevector, matrix, qubits, n_qubits, out, workspace=None):
+    """
+    Applies a 4 by 4 matrix on a pair of qubits to a single statevector, writing
+    the result into out without allocating any arrays the size of the state.
+
+    Args:
+        statevector: A contiguous array of length 2^n.
+        matrix: The 4 by 4 matrix of the gate, indexed by 2 * b + a where a and b
+        are the states of the first and second qubit of the pair.
+        qubits: The pair of different qubits the matrix acts on.
+        n_qubits: The number of qubits in the circuit.
+        out: A contiguous array of the same shape and type as statevector to write
+        the result to.
+        workspace: The dictionary from allocate_workspace, whose partial buffer is
+        used on circuits of more than INPLACE_EINSUM_MAX_QUBITS qubits. One is
+        allocated when needed by default.
+
+    Returns:
+        The out array.
+    """
+    first, second = int(qubits[0]), int(qubits[1])
+    low, high = min(first, second), max(first, second)
+    # Index the matrix by (high out, low out, high in, low in)
+    matrix = matrix.reshape(2, 2, 2, 2)
+    if first == high:
+        matrix = matrix.transpose(1, 0, 3, 2)
+    # Views of the state with one axis for each qubit of the pair
+    shape = (2 ** (n_qubits - 1 - high), 2, 2 ** (high - low - 1), 2, 2**low)
+    state = statevector.reshape(shape)
+    result = out.reshape(shape)
+    if n_qubits <= INPLACE_EINSUM_MAX_QUBITS:
+        np.einsum("pqrs,arbsc->apbqc", matrix, state, out=result)
+        return out
+
+    # On larger states, sum the four scaled quarters of the state into each
+    # quarter of the result, which streams through memory faster than einsum
+    if workspace is None:
+        workspace = allocate_workspace(n_qubits, statevector.dtype)
+    partial = workspace["partial"].reshape(shape[0], shape[2], shape[4])
+    for p in range(2):
+        for q in range(2):
+            quarter = result[:, p, :, q, :]
+            np.multiply(state[:, 0, :, 0, :], matrix[p, q, 0, 0], out=quarter)
+            for r, t in ((0, 1), (1, 0), (1, 1)):
+                np.multiply(state[:, r, :, t, :], matrix[p, q, r, t], out=partial)
+                np.add(quarter, partial, out=quarter)
+    return out
+
+
+@profiled("batch_statevector_output")
+def batch_statevector_output(circuit_list, n_qubits=2, dtype=np.complex128):
+    """
+    Calculates the qubit probabilities of many circuits at once by advancing
+    all of their statevectors together, one layer of gates at a time.
+
+    Args:
+        circuit_list: A list of gate lists (or compiled programs) of any lengths, or
+        a two dimensional program returned by stack_programs.
+        n_qubits: The number of qubits in every circuit.
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64 to halve the memory of large batches
+
+    Returns:
+        An array of shape (number of circuits, 2^n) with the probability of every
+        qubit configuration for every circuit, in the real precision of dtype.
+    """
+    programs = stack_programs(circuit_list)
+    check_qubits(programs, n_qubits)
+    statevectors = np.zeros((len(programs), 2**n_qubits), dtype=dtype)
+    statevectors[:, 0] = 1
+    for layer in programs.T:
+        if n_qubits == 2:
+            # Stack the gates of one layer into an (N, 4, 4) array and apply them together
+            operators = program_operators(layer, use_cache=False, dtype=dtype)
+            statevectors = np.matmul(operators, statevectors[:, :, None])[:, :, 0]
+            continue
+
+        # Apply the gates of one layer together for every circuit using the same qubits
+        active = layer["opcode"] != GATE_OPCODES["id"]
+        local_matrices = program_local_matrices(layer[active], dtype)
+        circuit_index = np.flatnonzero(active)
+        qubit_pairs = layer["qubits"][active]
+        for qubits in np.unique(qubit_pairs, axis=0):
+            selected = np.all(qubit_pairs == qubits, axis=1)
+            qubits = qubits[qubits >= 0]
+            size = 2 ** len(qubits)
+            rows = circuit_index[selected]
+            statevectors[rows] = apply_gate_matrix(
+                statevectors[rows],
+                local_matrices[selected, :size, :size],
+                qubits,
+                n_qubits,
+            )
+    return np.abs(statevectors) ** 2
+
+
+@profiled("sample_counts")
+def sample_counts(probabilities, shots=1024, trials=None, seed=None):
+    """
+    Samples measured counts from expected probabilities for whole batches of
+    circuits and trials in a single multinomial draw, as a local stand-in for
+    running them on a backend.
+
+    Args:
+        probabilities: An array of shape (..., k) with the probability of each of
+        the k qubit configurations of every circuit, such as the output of
+        batch_statevector_output
+        shots: The number of shots in every trial, set to 1024 by default
+        trials: The number of trials of every circuit. By default a single trial is
+        drawn and no trial axis is added.
+        seed: A seed or numpy.random.Generator that makes the counts reproducible
+
+    Returns:
+        An int64 array of shape (..., trials, k), or (..., k) without trials, with
+        the counts of every configuration. The expected counts
+        probabilities[..., None, :] * shots broadcast against it in
+        chi_squared_calc.batch_chi_squared.
+    """
+    rng = np.random.default_rng(seed)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    # Renormalise so rounding in the simulation never pushes the sum past one
+    probabilities = probabilities / probabilities.sum(axis=-1, keepdims=True)
+    if trials is None:
+        return rng.multinomial(shots, probabilities)
+    return rng.multinomial(
+        shots,
+        probabilities[..., None, :],
+        size=probabilities.shape[:-1] + (trials,),
+    )
+
+
+def apply_gate_matrix(statevectors, matrix, qubits, n_qubits):
+    """
+    Applies a one or two qubit gate to a stack of statevectors as a tensor
+    contraction over the axes of the qubits it acts on, so the 2^n by 2^n matrix
+    of the gate on the whole circuit is never built.
+
+    Args:
+        statevectors: An array of shape (number of statevectors, 2^n).
+        matrix: The 2 by 2 or 4 by 4 matrix of the gate as returned by
+        local_gate_matrices, either shared by every statevector or stacked with
+        one matrix per statevector.
+        qubits: The qubits the gate acts on, in the order given to the gate.
+        n_qubits: The number of qubits in the circuit.
+
+    Returns:
+        An array of the same shape as statevectors after the gate has been applied.
+    """
+    # Qubit 0 is the last axis, and the matrix index puts the first qubit lowest
+    axes = [n_qubits - qubit for qubit in reversed(qubits)]
+    ends = list(range(-len(axes), 0))
+    tensor = np.moveaxis(statevectors.reshape((-1,) + (2,) * n_qubits), axes, ends)
+    shape = tensor.shape
+    tensor = np.matmul(
+        tensor.reshape(shape[0], -1, 2 ** len(axes)), np.swapaxes(matrix, -1, -2)
+    )
+    return np.moveaxis(tensor.reshape(shape), ends, axes).reshape(statevectors.shape)
+
+
+def fuse_program(gate_list, n_qubits=2, return_unitary=False):
+    """
+    Collapses every run of consecutive gates that only act on the same two qubits
+    into a single 4 by 4 matrix. A two qubit circuit always fuses into one matrix.
+
+    Args:
+        gate_list: A list of ordered quantum gate instructions, or the program
+        returned by compile_circuit for that list.
+        n_qubits: The number of qubits in the circuit.
+        return_unitary: A boolean for whether to also return the 2^n by 2^n
+        matrix of the whole circuit. This is only practical for a few qubits.
+
+    Returns:
+        A structured array with the FUSED_DTYPE layout holding the qubit pair and
+        matrix of each fused gate, followed by the matrix of the whole circuit
+        when return_unitary is True.
+    """
+    program = compile_circuit(gate_list)
+    check_qubits(program, n_qubits)
+    local_matrices = program_local_matrices(program)
+
+    # Group the gates into runs whose qubits together number no more than two
+    runs = []
+    for i, gate in enumerate(program):
+        if gate["opcode"] == GATE_OPCODES["id"]:
+            continue
+        qubits = gate["qubits"][: GATE_QUBIT_COUNTS[gate["opcode"]]].tolist()
+        if runs:
+            pair, gates = runs[-1]
+            merged = pair + [qubit for qubit in qubits if qubit not in pair]
+            if len(merged) <= 2:
+                pair[:] = merged
+                gates.append(i)
+                continue
+        runs.append((qubits, [i]))
+
+    # Multiply the matrices of each run together on the qubit pair of the run
+    fused = np.zeros(len(runs), dtype=FUSED_DTYPE)
+    for i, (pair, gates) in enumerate(runs):
+        if len(pair) == 1:
+            pair.append((pair[0] + 1) % n_qubits)
+        matrix = np.eye(4, dtype=complex)
+        for gate in gates:
+            opcode = program["opcode"][gate]
+            size = 2 ** GATE_QUBIT_COUNTS[opcode]
+            flipped = int(program["qubits"][gate, 0] != pair[0])
+            operator = embed_operators(
+                opcode, local_matrices[gate : gate + 1, :size, :size], [flipped]
+            )[0]
+            matrix = np.matmul(operator, matrix)
+        fused[i] = (pair, matrix)
+
+    if not return_unitary:
+        return fused
+    # Column j of the unitary is the circuit applied to the jth basis state
+    unitary = run_fused_program(fused, n_qubits, np.eye(2**n_qubits, dtype=complex))
+    return fused, unitary.T
+
+
+def run_fused_program(fused, n_qubits, statevectors=None, dtype=np.complex128):
+    """
+    Applies a fused program to a stack of statevectors.
+
+    Args:
+        fused: A structured array returned by fuse_program.
+        n_qubits: The number of qubits in the circuit.
+        statevectors: An array of shape (number of statevectors, 2^n) to start from.
+        By default the circuit starts from a single statevector where every qubit is 0.
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64. The precision of statevectors replaces it when they are given.
+
+    Returns:
+        An array of shape (number of statevectors, 2^n) after every fused gate has
+        been applied.
+    """
+    if statevectors is None:
+        statevectors = np.zeros((1, 2**n_qubits), dtype=dtype)
+        statevectors[0, 0] = 1
+    matrices = fused["matrix"].astype(statevectors.dtype, copy=False)
+    for qubits, matrix in zip(fused["qubits"], matrices):
+        statevectors = apply_gate_matrix(statevectors, matrix, qubits, n_qubits)
+    return statevectors
+
+
+def check_qubits(program, n_qubits):
+    """
+    Checks that a circuit has at least the two qubits every engine acts on in
+    pairs, that every gate of a compiled program acts on one of them, and that
+    two qubit gates act on two different qubits.
+
+    Args:
+        program: A structured array returned by compile_circuit or stack_programs.
+        n_qubits: The number of qubits in the circuit.
+    """
+    if n_qubits < 2:
+        raise ValueError(
+            "Circuits need at least 2 qubits but " + str(n_qubits) + " were given"
+        )
+    # Only the qubit slots a gate uses are checked, since the others hold -1
+    used = np.arange(2) < GATE_QUBIT_COUNTS[program["opcode"]][..., None]
+    qubits = program["qubits"][used]
+    if qubits.size and qubits.max() >= n_qubits:
+        raise ValueError(
+            "Circuit uses qubit "
+            + str(qubits.max())
+            + " but only has "
+            + str(n_qubits)
+            + " qubits"
+        )
+    if qubits.size and qubits.min() < 0:
+        raise ValueError("Circuit uses the negative qubit " + str(qubits.min()))
+    two_qubit = GATE_QUBIT_COUNTS[program["opcode"]] == 2
+    repeated = program["qubits"][two_qubit]
+    if np.any(repeated[:, 0] == repeated[:, 1]):
+        raise ValueError("A two qubit gate acts on the same qubit twice")
+
+
+def prefix_probabilities(gate_list, depths=None, n_qubits=2, dtype=np.complex128):
+    """
+    Simulates one circuit a single time and yields the qubit probabilities after
+    each of the requested numbers of its first gates, so every prefix depth of a
+    long circuit costs no more than simulating the whole circuit once.
+
+    Args:
+        gate_list: A list of ordered quantum gate instructions, or the program
+        returned by compile_circuit for that list.
+        depths: An iterable of prefix depths between 0 and the length of the circuit.
+        By default the probabilities are yielded after every gate.
+        n_qubits: The number of qubits in the circuit.
+        dtype: The complex precision to simulate in, np.complex128 by default or
+        np.complex64
+
+    Yields:
+        A tuple of each requested depth, in increasing order, and an array with the
+        probability of every qubit configuration after that many gates.
+    """
+    program = compile_circuit(gate_list)
+    check_qubits(program, n_qubits)
+    if depths is None:
+        depths = range(1, len(program) + 1)
+    depths = sorted(set(depths))
+    if depths and (depths[0] < 0 or depths[-1] > len(program)):
+        raise ValueError(
+            "Prefix depths must be between 0 and " + str(len(program)) + " gates"
+        )
+
+    statevector = np.zeros((1, 2**n_qubits), dtype=dtype)
+    statevector[0, 0] = 1
+    reached = 0
+    for depth in depths:
+        # Only the gates between the previous depth and this one are simulated
+        segment = program[reached:depth]
+        if n_qubits == 2:
+            for gate_composition in program_operators(segment, dtype=dtype):
+                statevector = np.matmul(statevector, gate_composition.T)
+        else:
+            statevector = run_fused_program(
+                fuse_program(segment, n_qubits), n_qubits, statevector
+            )
+        reached = depth
+        yield depth, np.abs(statevector[0]) ** 2
+
+
+def stack_programs(circuit_list):
+    """
+    Compiles a list of circuits into one two dimensional program, padding the
+    shorter circuits with identity gates so every row has the same depth.
+
+    Args:
+        circuit_list: A list of gate lists or compiled programs. A two dimensional
+        program is returned unchanged.
+
+    Returns:
+        A structured array with the PROGRAM_DTYPE layout of shape
+        (number of circuits, greatest depth).
+    """
+    if isinstance(circuit_list, np.ndarray) and circuit_list.ndim == 2:
+        return compile_circuit(circuit_list)
+
+    programs = [compile_circuit(gate_list) for gate_list in circuit_list]
+    depth = max((len(program) for program in programs), default=0)
+    stacked = np.zeros((len(programs), depth), dtype=PROGRAM_DTYPE)
+    stacked["opcode"] = GATE_OPCODES["id"]
+    stacked["qubits"] = [0, -1]
+    for i, program in enumerate(programs):
+        stacked[i, : len(program)] = program
+    return stacked
+
+
+def compile_gate(gate):
+    """
+    Parses a single gate string into its opcode, qubits and angles.
+
+    Args:
+        gate: A string that denotes the gate applied to a quantum circuit
+        as well as which qubits the gate was applied to, such as ".rx(0.5, 1)"
+        or ".cx(0, 1)". Any text before the final period of the gate name is ignored.
+
+    Returns:
+        A tuple of the gate's opcode, a tuple of the qubits it acts on, and a
+        tuple of the angles it reads (in the order theta, phi, lambda).
+    """
+    open_paren = gate.find("(")
+    name = gate[gate.rfind(".", 0, open_paren) + 1 : open_paren]
+    if name not in GATE_OPCODES:
+        raise ValueError("Unknown gate " + repr(gate))
+    opcode = GATE_OPCODES[name]
+
+    # Angles come first in the argument list, followed by the qubit indicies
+    arguments = gate[open_paren + 1 : gate.rfind(")")].split(",")
+    angle_count = GATE_ANGLE_COUNTS[opcode]
+    if len(arguments) != angle_count + GATE_QUBIT_COUNTS[opcode]:
+        raise ValueError("Wrong number of arguments in gate " + repr(gate))
+    angles = tuple(float(argument) for argument in arguments[:angle_count])
+    qubits = tuple(int(argument) for argument in arguments[angle_count:])
+    return opcode, qubits, angles
+
+
+def compile_circuit(gate_list):
+    """
+    Compiles a list of gate strings into an array-backed program so the
+    gates never have to be parsed again.
+
+    Args:
+        gate_list: A list of ordered quantum gate instructions, such as the
+        qubit_input_list returned by random_circuit.evaluate_circuit. A program that
+        has already been compiled is returned unchanged.
+
+    Returns:
+        A structured NumPy array with the PROGRAM_DTYPE layout holding an opcode,
+        qubit and angle column with one row per gate.
+    """
+    if isinstance(gate_list, np.ndarray) and gate_list.dtype == PROGRAM_DTYPE:
+        return gate_list
+
+    program = np.zeros(len(gate_list), dtype=PROGRAM_DTYPE)
+    program["qubits"] = -1
+    for i, gate in enumerate(gate_list):
+        opcode, qubits, angles = compile_gate(gate)
+        program["opcode"][i] = opcode
+        program["qubits"][i, : len(qubits)] = qubits
+        program["angles"][i, : len(angles)] = angles
+    return program
+
+
+def local_gate_matrices(opcode, angles, dtype=np.complex128):
+    """
+    Builds the matrices of one type of gate for a whole column of angles at once.
+
+    Args:
+        opcode: The opcode of the gate, as listed in GATE_NAMES.
+        angles: An array of shape (..., 3) holding theta, phi and lambda for each gate.
+        dtype: The complex precision of the matrices, np.complex128 by default.
+
+    Returns:
+        An array of shape (..., 2, 2) for gates acting on one qubit, or (..., 4, 4) for
+        gates acting on two qubits. Two qubit matrices are indexed by 2 * b + a, where
+        a and b are the states of the first and second qubit given to the gate.
+    """
+    angles = np.asarray(angles, dtype=float)
+    theta, phi, lam = angles[..., 0], angles[..., 1], angles[..., 2]
+    rows = GATE_BUILDERS[GATE_NAMES[opcode]](theta, phi, lam)
+    return np.stack(
+        [
+            np.stack(
+                [np.broadcast_to(element, theta.shape) for element in row], axis=-1
+            )
+            for row in rows
+        ],
+        axis=-2,
+    ).astype(dtype)
+
+
+def program_local_matrices(program, dtype=np.complex128):
+    """
+    Builds the matrix of every gate in a compiled program on only the qubits the
+    gate acts on, handling each type of gate in a single vectorized step.
+
+    Args:
+        program: A structured array returned by compile_circuit.
+        dtype: The complex precision of the matrices, np.complex128 by default.
+
+    Returns:
+        An array of shape (number of gates, 4, 4). Gates acting on one qubit fill
+        only the upper left 2 by 2 block.
+    """
+    local_matrices = np.zeros((len(program), 4, 4), dtype=dtype)
+    for opcode in np.unique(program["opcode"]):
+        selected = program["opcode"] == opcode
+        size = 2 ** GATE_QUBIT_COUNTS[opcode]
+        local_matrices[selected, :size, :size] = local_gate_matrices(
+            opcode, program["angles"][selected], dtype
+        )
+    return local_matrices
+
+
+def program_operators(program, use_cache=True, dtype=np.complex128):
+    """
+    Builds the 4 by 4 transformation matrix of every gate in a compiled two
+    qubit program. Gates without angles are read from FIXED_OPERATORS, and gates
+    with angles are read from the angle-keyed gate cache, with every miss built in
+    a single vectorized step per type of gate.
+
+    Args:
+        program: A structured array returned by compile_circuit.
+        use_cache: A boolean for whether to look up and store the matrices of gates
+        with angles in the gate cache. Large batches of random angles rarely repeat,
+        so they skip the cache and are always built directly.
+        dtype: The complex precision of the matrices, np.complex128 by default.
+        Each precision has its own entries in the gate cache.
+
+    Returns:
+        An array of shape (number of gates, 4, 4) with the matrix of each gate.
+    """
+    opcodes = program["opcode"]
+    first_qubits = program["qubits"][:, 0]
+    operators = np.empty((len(program), 4, 4), dtype=dtype)
+    fixed = GATE_ANGLE_COUNTS[opcodes] == 0
+    operators[fixed] = FIXED_OPERATORS[opcodes[fixed], first_qubits[fixed]]
+
+    # Only the gates with angles that are not already cached need to be built
+    angled = np.flatnonzero(~fixed)
+    if use_cache:
+        keys = _gate_cache_keys(program[angled], dtype)
+        missing = []
+        for i, key in zip(angled, keys):
+            if key in _GATE_CACHE:
+                _GATE_CACHE.move_to_end(key)
+                operators[i] = _GATE_CACHE[key]
+                GATE_CACHE_STATS["hits"] += 1
+            else:
+                missing.append(i)
+        GATE_CACHE_STATS["misses"] += len(missing)
+        count("gate_cache.hits", len(keys) - len(missing))
+        count("gate_cache.misses", len(missing))
+        angled = np.array(missing, dtype=int)
+
+    for opcode in np.unique(opcodes[angled]):
+        selected = angled[opcodes[angled] == opcode]
+        operators[selected] = embed_operators(
+            opcode,
+            local_gate_matrices(opcode, program["angles"][selected], dtype),
+            first_qubits[selected],
+        )
+
+    # Store the new matrices, evicting the least recently used ones past the limit
+    if use_cache:
+        for i, key in zip(angled, _gate_cache_keys(program[angled], dtype)):
+            operator = operators[i].copy()
+            operator.setflags(write=False)
+            _GATE_CACHE[key] = operator
+        while len(_GATE_CACHE) > GATE_CACHE_SIZE:
+            _GATE_CACHE.popitem(last=False)
+    return operators
+
+
+def embed_operators(opcode, matrices, first_qubits):
+    """
+    Turns the matrices of one type of gate into 4 by 4 matrices acting on both
+    qubits of the circuit.
+
+    Args:
+        opcode: The opcode of the gate, as listed in GATE_NAMES.
+        matrices: An array of shape (number of gates, 2, 2) or (number of gates, 4, 4)
+        returned by local_gate_matrices.
+        first_qubits: An array with the first qubit each gate is applied to.
+
+    Returns:
+        An array of shape (number of gates, 4, 4) with the matrix of each gate.
+    """
+    on_first = (np.asarray(first_qubits) == 0)[:, None, None]
+    if GATE_QUBIT_COUNTS[opcode] == 1:
+        # Kronecker product with the identity on whichever qubit is left alone
+        identity = np.eye(2, dtype=matrices.dtype)
+        return np.where(
+            on_first,
+            np.einsum("ij,mkl->mikjl", identity, matrices).reshape(-1, 4, 4),
+            np.einsum("mij,kl->mikjl", matrices, identity).reshape(-1, 4, 4),
+        )
+    # Exchange the qubits when the gate lists the second qubit first
+    exchanged = matrices[:, QUBIT_EXCHANGE][:, :, QUBIT_EXCHANGE]
+    return np.where(on_first, matrices, exchanged)
+
+
+def _gate_cache_keys(program, dtype=np.complex128):
+    """
+    Turns the rows of a compiled program into hashable gate cache keys for one
+    precision.
+    """
+    precision = np.dtype(dtype).str
+    return [
+        key + (precision,)
+        for key in zip(
+            program["opcode"].tolist(),
+            map(tuple, program["qubits"].tolist()),
+            map(tuple, program["angles"].tolist()),
+        )
+    ]
+
+
+def gate_cache_info():
+    """
+    Reports how well the angle-keyed gate cache is working.
+
+    Returns:
+        A dictionary with the number of cache hits and misses since the cache was
+        last cleared, the number of stored matrices and the most it may hold.
+    """
+    return {
+        "hits": GATE_CACHE_STATS["hits"],
+        "misses": GATE_CACHE_STATS["misses"],
+        "size": len(_GATE_CACHE),
+        "maxsize": GATE_CACHE_SIZE,
+    }
+
+
+def clear_gate_cache():
+    """
+    Empties the angle-keyed gate cache and resets its hit and miss counters.
+    """
+    _GATE_CACHE.clear()
+    GATE_CACHE_STATS["hits"] = 0
+    GATE_CACHE_STATS["misses"] = 0
+
+
 def gate_matrix(gate):
     """
     Outputs and associates a given quantum gate to a respecitve 4 by 4
@@ -57,60 +769,14 @@ def gate_matrix(gate):
         A 4 by 4 transformation matrix with respect to the gate and the qubit
         input to update the statevector after passed through a quantum gate.
     """
-    # Initialize identity matrix for Kronecker product
-    iden_matrix = np.array([[1, 0], [0, 1]])
-
-    # Checks to see if the gate requires angle inputs
-    if "," in gate and ".cx(" not in gate and ".swap(" not in gate:
-        return angled_gate_matrix(gate)
-
-    # Checks to see if the gate is one of the basic gates
-    if ".x(" in gate or ".y(" in gate or ".z(" in gate or ".h(" in gate:
-        transform_matrix = basic_gate_matrix(gate)
-
-    # Matrix for swap gate (same reguardless of which qubits we are swtiching)
-    if ".swap(" in gate:
-        return np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
-    # Matricies for controlled NOT gate depdening on which qubit is the control
-    if ".cx(" in gate:
-        if "(0" in gate:
-            return np.array([[1, 0, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0], [0, 1, 0, 0]])
-        return np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
-    # Matrix for S gate
-    if ".s(" in gate:
-        transform_matrix = np.array([[1, 0], [0, 1j]])
-    # Matrix for S-Dagger gate
-    if ".sdg(" in gate:
-        transform_matrix = np.array([[1, 0], [0, -1j]])
-    # Matrix for T gate
-    if ".t(" in gate:
-        transform_matrix = np.array([[1, 0], [0, 2**-0.5 + 1j * (2**-0.5)]])
-    # Matrix for T-Dagger gate
-    if ".tdg(" in gate:
-        transform_matrix = np.array([[1, 0], [0, 2**-0.5 - 1j * (2**-0.5)]])
-    # Matrix for SX gate
-    if ".sx(" in gate:
-        transform_matrix = np.array(
-            [[0.5 + 0.5j, 0.5 - 0.5j], [0.5 - 0.5j, 0.5 + 0.5j]]
-        )
-    # Matrix for SX-Dagger gate
-    if ".sxdg(" in gate:
-        transform_matrix = np.array(
-            [[0.5 - 0.5j, 0.5 + 0.5j], [0.5 + 0.5j, 0.5 - 0.5j]]
-        )
-
-    # Choose which qubit gets passed through the gate via the given input.
-    if "0)" in gate:
-        return np.kron(iden_matrix, transform_matrix)
-    return np.kron(transform_matrix, iden_matrix)
+    return program_operators(compile_circuit([gate]))[0]
 
 
 def angled_gate_matrix(gate):
     """
-    An extension of gate_matrix where it outputs and associates a given
-    quantum gate to a respecitve 4 by 4 tranformation matrix to multiply
-    the statevector by to get the new superposition states for gates that
-    require phase angles
+    An extension of gate_matrix for gates that require phase angles. The
+    angles are read while the gate is compiled, so this is the same as
+    gate_matrix.
 
     Args:
         gate: A string that denotes the gate applied to a quantum circuit
@@ -120,91 +786,7 @@ def angled_gate_matrix(gate):
         A 4 by 4 transformation matrix with respect to the gate and the qubit
         input to update the statevector after passed through a quantum gate.
     """
-    iden_matrix = np.array([[1, 0], [0, 1]])
-    float_end = gate.find(",")
-    theta = float(gate[gate.find("(") + 1 : float_end])
-    # Matrix for RXX gate with a given angle input
-    if ".rxx(" in gate:
-        real_comp = np.cos(theta / 2)
-        imag_comp = -1j * np.sin(theta / 2)
-        return np.array(
-            [
-                [real_comp, 0, 0, imag_comp],
-                [0, real_comp, imag_comp, 0],
-                [0, imag_comp, real_comp, 0],
-                [imag_comp, 0, 0, real_comp],
-            ]
-        )
-    # Matrix for RYY gate with a given angle input
-    if ".ryy(" in gate:
-        real_comp = np.cos(theta / 2)
-        imag_comp = -1j * np.sin(theta / 2)
-        return np.array(
-            [
-                [real_comp, 0, 0, -1 * imag_comp],
-                [0, real_comp, imag_comp, 0],
-                [0, imag_comp, real_comp, 0],
-                [-1 * imag_comp, 0, 0, real_comp],
-            ]
-        )
-    # Matrix for RZZ gate with a given angle input
-    if ".rzz(" in gate:
-        euler_identity = np.cos(theta / 2) + 1j * np.sin(theta / 2)
-        euler_identity_conj = np.cos(theta / 2) + -1j * np.sin(theta / 2)
-        return np.array(
-            [
-                [euler_identity_conj, 0, 0, 0],
-                [0, euler_identity, 0, 0],
-                [0, 0, euler_identity, 0],
-                [0, 0, 0, euler_identity_conj],
-            ]
-        )
-    # Matrix for phase gate of a given angle input
-    if ".p(" in gate:
-        phase_output = np.cos(theta) + np.sin(theta) * 1j
-        transform_matrix = np.array([[1, 0], [0, phase_output]])
-    # Matrix for RX gate
-    if ".rx(" in gate:
-        real_comp = np.cos(theta / 2)
-        imag_comp = -1j * np.sin(theta / 2)
-        transform_matrix = np.array([[real_comp, imag_comp], [imag_comp, real_comp]])
-    # Matrix for RY gate
-    if ".ry(" in gate:
-        real_comp_cos = np.cos(theta / 2)
-        real_comp_sin = np.sin(theta / 2)
-        transform_matrix = np.array(
-            [[real_comp_cos, -1 * real_comp_sin], [real_comp_sin, real_comp_cos]]
-        )
-    # Matrix for RZ gate
-    if ".rz(" in gate:
-        euler_identity = np.cos(theta / 2) + 1j * np.sin(theta / 2)
-        euler_identity_conj = np.cos(theta / 2) + -1j * np.sin(theta / 2)
-        transform_matrix = np.array([[euler_identity_conj, 0], [0, euler_identity]])
-    # Matrix for U gate. Requires three phase angles to operate, so two other values are read
-    if ".u(" in gate:
-        gate = gate[float_end + 2 : :]
-        float_end = gate.find(",")
-        phi = float(gate[0:float_end])
-        gate = gate[float_end + 2 : :]
-        float_end = gate.find(",")
-        lam = float(gate[0:float_end])
-        transform_matrix = np.array(
-            [
-                [
-                    np.cos(theta / 2),
-                    -1 * (np.cos(lam) + 1j * np.sin(lam)) * np.sin(theta / 2),
-                ],
-                [
-                    (np.cos(phi) + 1j * np.sin(phi)) * np.sin(theta / 2),
-                    (np.cos(phi + lam) + 1j * np.sin(phi + lam)) * np.cos(theta / 2),
-                ],
-            ]
-        )
-
-    # Choose which qubit gets passed through the gate via the given input.
-    if "0)" in gate:
-        return np.kron(iden_matrix, transform_matrix)
-    return np.kron(transform_matrix, iden_matrix)
+    return gate_matrix(gate)
 
 
 def basic_gate_matrix(gate):
@@ -222,14 +804,144 @@ def basic_gate_matrix(gate):
         A 2 by 2 transformation matrix with respect to be used in the Kronecker
         product for the 4 by 4 matrix
     """
-    # Matrix for NOT gate (Also referred to as Pauli-X gate)
-    if ".x(" in gate:
-        return np.array([[0, 1], [1, 0]])
+    return local_gate_matrices(compile_gate(gate)[0], np.zeros(3))
+
+
+def _u_rows(theta, phi, lam):
+    """
+    Rows of the U gate, which requires three phase angles to operate.
+    """
+    return [
+        [np.cos(theta / 2), -1 * np.exp(1j * lam) * np.sin(theta / 2)],
+        [
+            np.exp(1j * phi) * np.sin(theta / 2),
+            np.exp(1j * (phi + lam)) * np.cos(theta / 2),
+        ],
+    ]
+
+
+def _rxx_rows(theta, phi, lam):
+    """
+    Rows of the RXX gate with a given angle input.
+    """
+    real_comp = np.cos(theta / 2)
+    imag_comp = -1j * np.sin(theta / 2)
+    return [
+        [real_comp, 0, 0, imag_comp],
+        [0, real_comp, imag_comp, 0],
+        [0, imag_comp, real_comp, 0],
+        [imag_comp, 0, 0, real_comp],
+    ]
+
+
+def _ryy_rows(theta, phi, lam):
+    """
+    Rows of the RYY gate with a given angle input.
+    """
+    real_comp = np.cos(theta / 2)
+    imag_comp = -1j * np.sin(theta / 2)
+    return [
+        [real_comp, 0, 0, -1 * imag_comp],
+        [0, real_comp, imag_comp, 0],
+        [0, imag_comp, real_comp, 0],
+        [-1 * imag_comp, 0, 0, real_comp],
+    ]
+
+
+def _rzz_rows(theta, phi, lam):
+    """
+    Rows of the RZZ gate with a given angle input.
+    """
+    euler_identity = np.exp(1j * theta / 2)
+    euler_identity_conj = np.exp(-1j * theta / 2)
+    return [
+        [euler_identity_conj, 0, 0, 0],
+        [0, euler_identity, 0, 0],
+        [0, 0, euler_identity, 0],
+        [0, 0, 0, euler_identity_conj],
+    ]
+
+
+# Functions returning the rows of each gate's matrix from broadcastable angle arrays
+GATE_BUILDERS = {
+    "u": _u_rows,
+    # Matrix for Hadamard gate
+    "h": lambda theta, phi, lam: [[2**-0.5, 2**-0.5], [2**-0.5, -1 * 2**-0.5]],
     # Matrix for Pauli-Y gate
-    if ".y(" in gate:
-        return np.array([[0, -1j], [1j, 0]])
+    "y": lambda theta, phi, lam: [[0, -1j], [1j, 0]],
+    # Matrix for NOT gate (Also referred to as Pauli-X gate)
+    "x": lambda theta, phi, lam: [[0, 1], [1, 0]],
     # Matrix for Pauli-Z gate
-    if ".z(" in gate:
-        return np.array([[1, 0], [0, -1]])
-    # Matrix for Hadamard gate
-    return np.array([[2**-0.5, 2**-0.5], [2**-0.5, -1 * 2**-0.5]])
+    "z": lambda theta, phi, lam: [[1, 0], [0, -1]],
+    # Matrix for phase gate of a given angle input
+    "p": lambda theta, phi, lam: [[1, 0], [0, np.exp(1j * theta)]],
+    # Matrix for S gate
+    "s": lambda theta, phi, lam: [[1, 0], [0, 1j]],
+    # Matrix for S-Dagger gate
+    "sdg": lambda theta, phi, lam: [[1, 0], [0, -1j]],
+    # Matrix for T gate
+    "t": lambda theta, phi, lam: [[1, 0], [0, 2**-0.5 + 1j * (2**-0.5)]],
+    # Matrix for T-Dagger gate
+    "tdg": lambda theta, phi, lam: [[1, 0], [0, 2**-0.5 - 1j * (2**-0.5)]],
+    # Matrix for controlled NOT gate with the first qubit as the control
+    "cx": lambda theta, phi, lam: [
+        [1, 0, 0, 0],
+        [0, 0, 0, 1],
+        [0, 0, 1, 0],
+        [0, 1, 0, 0],
+    ],
+    # Matrix for swap gate (same reguardless of which qubits we are swtiching)
+    "swap": lambda theta, phi, lam: [
+        [1, 0, 0, 0],
+        [0, 0, 1, 0],
+        [0, 1, 0, 0],
+        [0, 0, 0, 1],
+    ],
+    # Matrix for SX gate
+    "sx": lambda theta, phi, lam: [[0.5 + 0.5j, 0.5 - 0.5j], [0.5 - 0.5j, 0.5 + 0.5j]],
+    # Matrix for SX-Dagger gate
+    "sxdg": lambda theta, phi, lam: [
+        [0.5 - 0.5j, 0.5 + 0.5j],
+        [0.5 + 0.5j, 0.5 - 0.5j],
+    ],
+    # Matrix for RX gate
+    "rx": lambda theta, phi, lam: [
+        [np.cos(theta / 2), -1j * np.sin(theta / 2)],
+        [-1j * np.sin(theta / 2), np.cos(theta / 2)],
+    ],
+    # Matrix for RY gate
+    "ry": lambda theta, phi, lam: [
+        [np.cos(theta / 2), -1 * np.sin(theta / 2)],
+        [np.sin(theta / 2), np.cos(theta / 2)],
+    ],
+    # Matrix for RZ gate
+    "rz": lambda theta, phi, lam: [
+        [np.exp(-1j * theta / 2), 0],
+        [0, np.exp(1j * theta / 2)],
+    ],
+    "rxx": _rxx_rows,
+    "ryy": _ryy_rows,
+    "rzz": _rzz_rows,
+    # Matrix for the identity gate
+    "id": lambda theta, phi, lam: [[1, 0], [0, 1]],
+}
+
+
+def _fixed_operator_table():
+    """
+    Builds the 4 by 4 matrix of every gate without angles on either qubit.
+
+    Returns:
+        A read-only array of shape (number of gates, 2, 4, 4) indexed by the opcode
+        and the first qubit of the gate. Rows of gates that read angles are zero.
+    """
+    table = np.zeros((len(GATE_NAMES), 2, 4, 4), dtype=complex)
+    for opcode in np.flatnonzero(GATE_ANGLE_COUNTS == 0):
+        matrices = local_gate_matrices(opcode, np.zeros((2, 3)))
+        table[opcode] = embed_operators(opcode, matrices, [0, 1])
+    table.setflags(write=False)
+    return table
+
+
+# Finished matrices of every gate without angles, indexed by opcode and first qubit
+FIXED_OPERATORS = _fixed_operator_table()
@@ -0,0 +1,250 @@
+"""
+An asyncio pipeline that keeps several circuit jobs in flight at once on
+any backend, retrying failed jobs and streaming back their counts as soon
+as each one completes.
+
+A backend is any object with a method run(gate_list, quantum_circuit, shots)
+that returns the counts dictionary of one job, such as {"00": 510, "11": 514}.
+The method may either be a normal function, which is run in a worker thread,
+or a coroutine function. A backend whose run method also takes a job_id
+keyword is given the job_id of every job, so its counts can depend on the job
+and not on the order the jobs happen to run in.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import threading
+import numpy as np
+from expected_value import sample_counts, statevector_output
+from profiling import StageTimer, count
+
+
+class AerBackend:
+    """
+    Runs jobs on a Qiskit backend of the job_request session, the local Aer
+    qasm simulator by default, so a backend given to job_request.set_backend is
+    also used by the pipeline.
+    """
+
+    def __init__(self, name="qasm_simulator"):
+        """
+        Args:
+            name: The name of the session backend, set to the qasm simulator by
+            default
+        """
+        from job_request import get_backend
+
+        self.backend = get_backend(name)
+
+    def run(self, gate_list, quantum_circuit, shots):
+        """
+        Executes a circuit and waits for its counts.
+
+        Args:
+            gate_list: The gate list of the circuit, which is not needed by Aer
+            quantum_circuit: The circuit object to execute
+            shots: The number of shots to run
+
+        Returns:
+            The counts dictionary of the job.
+        """
+        from qiskit import execute
+
+        result = execute(quantum_circuit, self.backend, shots=shots).result()
+        return result.get_counts(quantum_circuit)
+
+
+class StatevectorBackend:
+    """
+    An in-process fake backend that samples ideal counts from the probabilities
+    of statevector_output, for running the pipeline offline.
+
+    Every job samples from its own generator, derived from the seed and the
+    job_id, so a seeded sweep gives the same counts whichever worker thread runs
+    each job and in whatever order the jobs complete.
+    """
+
+    def __init__(self, n_qubits=2, seed=None):
+        """
+        Args:
+            n_qubits: The number of qubits in every circuit, set to 2 by default
+            seed: A seed, numpy.random.SeedSequence or numpy.random.Generator for
+            the sampled counts
+        """
+        self.n_qubits = n_qubits
+        if isinstance(seed, np.random.Generator):
+            seed = seed.integers(2**63)
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.lock = threading.Lock()
+
+    def job_seed(self, job_id=None):
+        """
+        Derives the seed of one job.
+
+        Args:
+            job_id: The job_id of the job, or None to take the next child of the
+            seed instead
+
+        Returns:
+            A numpy.random.SeedSequence that only depends on the seed and job_id.
+        """
+        if job_id is None:
+            with self.lock:
+                return self.seed_sequence.spawn(1)[0]
+        digest = hashlib.sha256(repr(job_id).encode("utf8")).digest()
+        return np.random.SeedSequence(
+            self.seed_sequence.entropy,
+            spawn_key=self.seed_sequence.spawn_key
+            + tuple(int(word) for word in np.frombuffer(digest, dtype=np.uint32)),
+        )
+
+    def run(self, gate_list, quantum_circuit, shots, job_id=None):
+        """
+        Samples the counts of a circuit from its expected probabilities.
+
+        Args:
+            gate_list: The gate list of the circuit to simulate
+            quantum_circuit: The circuit object, which is not needed to simulate
+            shots: The number of shots to sample
+            job_id: The job_id the counts are seeded by, given by run_jobs
+
+        Returns:
+            The counts dictionary of the job, leaving out configurations that
+            never occured in the same way as Qiskit.
+        """
+        probabilities = statevector_output(gate_list, self.n_qubits)[0]
+        counts = sample_counts(probabilities, shots, seed=self.job_seed(job_id))
+        return {
+            format(i, "0" + str(self.n_qubits) + "b"): int(count)
+            for i, count in enumerate(counts)
+            if count
+        }
+
+
+async def run_jobs(jobs, backend, shots=1024, max_in_flight=4, retries=3, backoff=0.5):
+    """
+    Runs jobs on a backend with a bounded number in flight at once, yielding
+    each job's counts as soon as it completes.
+
+    Args:
+        jobs: An iterable of (job_id, gate_list, quantum_circuit) tuples. It is only
+        read as jobs are started, so it may be a lazy generator.
+        backend: An object following the backend interface of this module
+        shots: The number of shots in each job, set to 1024 by default
+        max_in_flight: The most jobs to have running at the same time
+        retries: The number of times to retry a failed job before giving up
+        backoff: The number of seconds to wait before the first retry, which
+        doubles after every failed attempt
+
+    Yields:
+        A tuple of each job_id and the counts dictionary of its job, in the order
+        the jobs complete. When a job fails for good, the other jobs that completed
+        with it are yielded first, and then its error is raised and every job still
+        in flight is cancelled.
+    """
+    jobs = iter(jobs)
+    in_flight = set()
+    try:
+        while True:
+            # Top up the jobs in flight before waiting on any of them
+            for job_id, gate_list, quantum_circuit in jobs:
+                in_flight.add(
+                    asyncio.ensure_future(
+                        _run_job(
+                            job_id,
+                            gate_list,
+                            quantum_circuit,
+                            backend,
+                            shots,
+                            retries,
+                            backoff,
+                        )
+                    )
+                )
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = await asyncio.wait(
+                in_flight, return_when=asyncio.FIRST_COMPLETED
+            )
+            failed = [task for task in done if task.exception() is not None]
+            for task in done:
+                if task not in failed:
+                    yield task.result()
+            if failed:
+                failed[0].result()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+def run_sweep(jobs, backend, **kwargs):
+    """
+    Runs jobs through run_jobs from synchronous code.
+
+    Args:
+        jobs: An iterable of (job_id, gate_list, quantum_circuit) tuples
+        backend: An object following the backend interface of this module
+        kwargs: Any other keyword arguments of run_jobs
+
+    Returns:
+        A dictionary mapping every job_id to the counts dictionary of its job.
+    """
+
+    async def collect():
+        return {
+            job_id: counts async for job_id, counts in run_jobs(jobs, backend, **kwargs)
+        }
+
+    return asyncio.run(collect())
+
+
+def sweep_jobs(evaluated_circuit_list, trials):
+    """
+    Lists the jobs of a sweep that runs every circuit a number of times.
+
+    Args:
+        evaluated_circuit_list: A list of the (gate_list, quantum_circuit) pairs
+        returned by random_circuit.evaluate_circuit, such as one for every depth
+        trials: The number of times to run each circuit
+
+    Returns:
+        A generator of jobs whose job_id is the (circuit index, trial) pair.
+    """
+    return (
+        ((i, trial), gate_list, quantum_circuit)
+        for i, (gate_list, quantum_circuit) in enumerate(evaluated_circuit_list)
+        for trial in range(trials)
+    )
+
+
+async def _run_job(
+    job_id, gate_list, quantum_circuit, backend, shots, retries, backoff
+):
+    """
+    Runs a single job, retrying it with exponential backoff when it fails. The
+    whole job, retries included, is profiled as the run_job stage.
+    """
+    run = backend.run
+    if "job_id" in inspect.signature(run).parameters:
+        run = functools.partial(run, job_id=job_id)
+    with StageTimer("run_job"):
+        for attempt in range(retries + 1):
+            try:
+                if inspect.iscoroutinefunction(backend.run):
+                    counts = await run(gate_list, quantum_circuit, shots)
+                else:
+                    counts = await asyncio.get_running_loop().run_in_executor(
+                        None, run, gate_list, quantum_circuit, shots
+                    )
+                return job_id, counts
+            except Exception:  # pylint: disable=broad-except
+                if attempt == retries:
+                    raise
+                count("run_job.retries")
+                await asyncio.sleep(backoff * 2**attempt)
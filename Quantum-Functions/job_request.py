@@ -2,10 +2,73 @@
 Function to call and record jobs to IBM's backend
 to run quantum simulations
 """
-from qiskit import IBMQ, execute, Aer
+import threading
+from profiling import profiled
+from result_store import add_circuit
 
+# Your unique IBM API token
+API_TOKEN = "<Insert your unique API token>"
 
-def job_acquisition(gate_list, quantum_circuit, iterations):
+# Process-wide session shared by every call and thread: whether the IBM account has
+# been loaded, and the backends that have been looked up so far by name
+_SESSION = {"account_loaded": False, "backends": {}}
+_SESSION_LOCK = threading.Lock()
+
+
+def get_backend(name="qasm_simulator"):
+    """
+    Returns a backend from the process-wide session, loading the IBM account and
+    looking up the backend only the first time it is asked for.
+
+    Args:
+        name: The name of the backend, set to the qasm simulator by default
+
+    Returns:
+        The backend object to execute circuits on.
+    """
+    with _SESSION_LOCK:
+        if name not in _SESSION["backends"]:
+            from qiskit import IBMQ, Aer
+
+            # Load your IBM account onto your own compyter once per process
+            if not _SESSION["account_loaded"]:
+                IBMQ.save_account(API_TOKEN, overwrite=True)
+                IBMQ.load_account()
+                _SESSION["account_loaded"] = True
+            _SESSION["backends"][name] = Aer.get_backend(name)
+        return _SESSION["backends"][name]
+
+
+def set_backend(backend, name="qasm_simulator"):
+    """
+    Replaces a backend in the process-wide session, such as with a local fake
+    backend for offline runs. No IBM account is loaded for a replaced backend.
+
+    The session only holds Qiskit backends, which is what job_acquisition and
+    batch_job_acquisition pass to qiskit's execute. The backends of job_pipeline,
+    whose run method takes (gate_list, quantum_circuit, shots), cannot be set
+    here; job_pipeline.AerBackend instead runs pipeline jobs on a session backend.
+
+    Args:
+        backend: Any backend object that qiskit's execute accepts
+        name: The name the backend is returned under by get_backend
+    """
+    with _SESSION_LOCK:
+        _SESSION["backends"][name] = backend
+
+
+def reset_session():
+    """
+    Forgets every backend and the loaded account, so the next call to
+    get_backend sets up the session again.
+    """
+    with _SESSION_LOCK:
+        _SESSION["account_loaded"] = False
+        _SESSION["backends"].clear()
+
+
+@profiled("job_acquisition")
+def job_acquisition(gate_list, quantum_circuit, iterations, store_path=None):
     """
     Takes a given random quantum circuit and sends four requests to
     run qubits through IBM's backend and records the simulation IDs
@@ -16,18 +79,85 @@ def job_acquisition(gate_list, quantum_circuit, iterations):
         quantum_circuit: An object that details how the constructed circuit will function
         across the two qubits
         iterations: The number of times to run the circuit on IBM's backend
+        store_path: An optional result_store directory to append the counts to, under
+        a new circuit id, instead of writing a text file
 
     Returns:
         The file `job_id_strings_(number).txt` with each of the four new request IDs for every
         simulation ran with a given circuit configuration where (number) is the depth of the
         circuit
     """
-    # Load your IBM account onto your own compyter
-    IBMQ.save_account("<Insert your unique API token>")
-    IBMQ.load_account()
+    from qiskit import execute
 
     # Acesss the backend to use the quantum computer
-    backend = Aer.get_backend("qasm_simulator")
+    backend = get_backend()
+
+    # Execute the circuit for the number of iterations and record the results
+    counts_list = []
+    while iterations != 0:
+        result = execute(quantum_circuit, backend, shots=1024).result()
+        counts_list.append(result.get_counts(quantum_circuit))
+        iterations -= 1
+    write_job_file(gate_list, counts_list, store_path)
+
+
+@profiled("batch_job_acquisition")
+def batch_job_acquisition(
+    gate_lists, quantum_circuits, iterations, shots=1024, store_path=None
+):
+    """
+    Packs every iteration of every given circuit into a single batched job on
+    IBM's backend, instead of waiting on one job per iteration, and records the
+    results in the same files as job_acquisition
+
+    Args:
+        gate_lists: A list of the gate lists of each circuit, such as one for every
+        depth of a sweep
+        quantum_circuits: A list of the circuit objects matching gate_lists
+        iterations: The number of times to run each circuit on IBM's backend
+        shots: The number of shots in each run, set to 1024 by default
+        store_path: An optional result_store directory to append the counts to
+        instead of writing text files
+
+    Returns:
+        The single result object of the batched job, in which the counts of iteration
+        j of circuit i are experiment i * iterations + j. The file
+        `job_id_strings_(number).txt` is also written for every circuit.
+    """
+    from qiskit import execute
+
+    # Acesss the backend to use the quantum computer
+    backend = get_backend()
+
+    # Submit every iteration of every circuit together and wait for them once
+    batch = [circuit for circuit in quantum_circuits for _ in range(iterations)]
+    result = execute(batch, backend, shots=shots).result()
+    for i, gate_list in enumerate(gate_lists):
+        write_job_file(
+            gate_list,
+            [result.get_counts(i * iterations + j) for j in range(iterations)],
+            store_path,
+        )
+    return result
+
+
+def write_job_file(gate_list, counts_list, store_path=None):
+    """
+    Records a circuit and the counts of each of its runs in the file
+    `job_id_strings_(number).txt` where (number) is the depth of the circuit
+
+    Args:
+        gate_list: A list of ordered quantum gate instructions that a quantum circuit
+        must follow
+        counts_list: A list of the counts dictionaries of each run of the circuit
+        store_path: An optional result_store directory to append the counts to
+        instead, under a new circuit id with its depth kept in the metadata
+
+    Returns:
+        The circuit id of the circuit when a store_path is given.
+    """
+    if store_path is not None:
+        return add_circuit(store_path, gate_list, counts_list)
 
     # Write to a new file with a given qubit depth
     with open(
@@ -36,11 +166,7 @@ def job_acquisition(gate_list, quantum_circuit, iterations):
         # Record the circuit that is being tested as well as its arguments
         job_ids.write(str(gate_list))
         job_ids.write("\n")
-        # Execute and record the results for the number of iterations on the text file
-        while iterations != 0:
-            result = execute(quantum_circuit, backend, shots=1024).result()
-            counts = result.get_counts(quantum_circuit)
+        # Record the results of every run on the text file
+        for counts in counts_list:
             job_ids.write(str(counts))
             job_ids.write("\n")
-            iterations -= 1
-    job_ids.close()
@@ -0,0 +1,192 @@
+"""
+Opt-in timers and counters for the stages of a run, such as drawing,
+evaluating and simulating circuits, acquiring jobs and computing chi squared
+values. Profiling is off unless enable() is called or the QUANTUM_PROFILE
+environment variable is set, and while it is off every timed stage only costs
+a single flag check.
+
+Usage:
+    profiling.enable()
+    ...run a sweep...
+    profiling.write_summary("profile.json")
+
+Stages recorded on worker processes are handed back to the parent with
+collect() and added to its own recordings with merge().
+"""
+import functools
+import json
+import os
+import time
+import numpy as np
+
+# Whether stages are being timed, and the durations and counters recorded so far
+_STATE = {"enabled": bool(os.environ.get("QUANTUM_PROFILE"))}
+_TIMINGS = {}
+_COUNTERS = {}
+
+# The latency percentiles reported for every stage
+SUMMARY_PERCENTILES = (50, 90, 99)
+
+
+def enable():
+    """
+    Starts recording the time of every profiled stage.
+    """
+    _STATE["enabled"] = True
+
+
+def disable():
+    """
+    Stops recording, keeping everything recorded so far.
+    """
+    _STATE["enabled"] = False
+
+
+def is_enabled():
+    """
+    Returns whether stages are being recorded.
+    """
+    return _STATE["enabled"]
+
+
+def reset():
+    """
+    Forgets every recorded duration and counter.
+    """
+    _TIMINGS.clear()
+    _COUNTERS.clear()
+
+
+def profiled(stage_name):
+    """
+    Decorates a function so every call is timed as a stage while profiling is
+    enabled.
+
+    Args:
+        stage_name: The name the calls are recorded under
+
+    Returns:
+        A decorator for the function.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage_name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class StageTimer:
+    """
+    A context manager that times the block inside it as a stage while
+    profiling is enabled.
+
+    Usage:
+        with StageTimer("sweep.depth"):
+            ...
+    """
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+        self.start = None
+
+    def __enter__(self):
+        if _STATE["enabled"]:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            record(self.stage_name, time.perf_counter() - self.start)
+            self.start = None
+
+
+def record(stage_name, seconds):
+    """
+    Adds the duration of one call to a stage.
+
+    Args:
+        stage_name: The name of the stage
+        seconds: How long the call took
+    """
+    _TIMINGS.setdefault(stage_name, []).append(seconds)
+
+
+def count(counter_name, amount=1):
+    """
+    Adds to a counter, such as the hits of a cache, while profiling is enabled.
+
+    Args:
+        counter_name: The name of the counter
+        amount: The amount to add, set to 1 by default
+    """
+    if _STATE["enabled"]:
+        _COUNTERS[counter_name] = _COUNTERS.get(counter_name, 0) + amount
+
+
+def collect():
+    """
+    Returns everything recorded so far and forgets it, so a worker process can
+    send its recordings to the process that merges them.
+
+    Returns:
+        A dictionary with a "timings" dictionary mapping each stage to the list of
+        its durations in seconds, and a "counters" dictionary of every counter.
+    """
+    recorded = {"timings": dict(_TIMINGS), "counters": dict(_COUNTERS)}
+    reset()
+    return recorded
+
+
+def merge(recorded):
+    """
+    Adds the recordings of another process to this one's.
+
+    Args:
+        recorded: A dictionary returned by collect
+    """
+    for stage_name, durations in recorded["timings"].items():
+        _TIMINGS.setdefault(stage_name, []).extend(durations)
+    for counter_name, amount in recorded["counters"].items():
+        _COUNTERS[counter_name] = _COUNTERS.get(counter_name, 0) + amount
+
+
+def summary():
+    """
+    Summarises everything recorded so far.
+
+    Returns:
+        A dictionary with a "stages" dictionary mapping each stage to its number of
+        calls, total seconds and the SUMMARY_PERCENTILES of its latency in seconds,
+        and a "counters" dictionary of every counter.
+    """
+    stages = {}
+    for stage_name, durations in sorted(_TIMINGS.items()):
+        percentiles = np.percentile(durations, SUMMARY_PERCENTILES)
+        stages[stage_name] = {
+            "calls": len(durations),
+            "total_seconds": float(np.sum(durations)),
+        }
+        for percentile, latency in zip(SUMMARY_PERCENTILES, percentiles):
+            stages[stage_name]["p" + str(percentile) + "_seconds"] = float(latency)
+    return {"stages": stages, "counters": dict(sorted(_COUNTERS.items()))}
+
+
+def write_summary(path):
+    """
+    Writes the summary of everything recorded so far to a JSON file.
+
+    Args:
+        path: The file to write
+    """
+    with open(path, "w", encoding="utf8") as summary_file:
+        json.dump(summary(), summary_file, indent=2)
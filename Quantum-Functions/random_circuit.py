@@ -4,10 +4,16 @@ then evaluates each gate in the path within it's specified parameters(Random
 angle values, Random qubit values, etc).
 """
 
-# Import statements(including qiskit methods)
-from random import choice, randrange
-from qiskit import QuantumCircuit
+# Import statements (qiskit is only imported once a circuit object is built)
+from random import randrange
 import numpy as np
+from expected_value import (
+    GATE_ANGLE_COUNTS,
+    GATE_NAMES,
+    GATE_QUBIT_COUNTS,
+    PROGRAM_DTYPE,
+)
+from profiling import profiled
 
 
 # Define the potential gates as a dictionary
@@ -34,8 +40,31 @@ POTENTIAL_GATES = {
     19: ".rzz(",
 }
 
+# Opcode of each gate of POTENTIAL_GATES, for compiling the gates evaluate_circuit
+# is given
+GATE_STRING_OPCODES = {gate: opcode for opcode, gate in POTENTIAL_GATES.items()}
 
-def random_circuit(depth, gatelist):
+# The qiskit method, number of angles and number of qubits of every opcode, which
+# are also the gate names of OpenQASM 2
+CIRCUIT_DISPATCH = [
+    (name, int(angle_count), int(qubit_count))
+    for name, angle_count, qubit_count in zip(
+        GATE_NAMES, GATE_ANGLE_COUNTS, GATE_QUBIT_COUNTS
+    )
+]
+
+# Start of every OpenQASM program, defining the RYY gate that qelib1.inc lacks in
+# the same way as qiskit
+QASM_HEADER = (
+    "OPENQASM 2.0;\n"
+    'include "qelib1.inc";\n'
+    "gate ryy(theta) a,b { rx(pi/2) a; rx(pi/2) b; cx a,b; rz(theta) b; cx a,b; "
+    "rx(-pi/2) a; rx(-pi/2) b; }"
+)
+
+
+@profiled("random_circuit")
+def random_circuit(depth, gatelist=None, rng=None):
     """
     Returns a randomized list of quantum gates based on
     a specified depth parameter. This list represents
@@ -46,8 +75,10 @@ def random_circuit(depth, gatelist):
     Args:
         depth: an int which specifies the amount of quantum gates that
         will be included in the final list.
-        gatelist: an empty list(defined in the arguments) that is used in
-        appending each of the randomized gates into it
+        gatelist: an optional list that each of the randomized gates is appended
+        to. A new list is made by default.
+        rng: an optional numpy.random.Generator to draw the gates from. Python's
+        random module is used by default.
 
     Returns:
         A list of strings(each mapped to a key in the global POTENTIAL_GATES
@@ -55,20 +86,94 @@ def random_circuit(depth, gatelist):
         inputted qubit would take.
 
     """
+    if gatelist is None:
+        gatelist = []
 
-    # Base Case if the specified depth asks for no quantum functions
-    if depth == 0:
+    # Append a random gate from POTENTIAL_GATES for each level of depth
+    if rng is not None:
+        gatelist.extend(
+            POTENTIAL_GATES[gate_select]
+            for gate_select in rng.integers(len(POTENTIAL_GATES), size=depth).tolist()
+        )
         return gatelist
+    for _ in range(depth):
+        gatelist.append(POTENTIAL_GATES[randrange(len(POTENTIAL_GATES))])
+    return gatelist
+
+
+def random_program(depth, n_circuits=None, n_qubits=2, seed=None):
+    """
+    Draws whole random circuits as compiled programs in a few vectorized calls,
+    rather than one gate at a time. Only the angles and second qubits that a gate
+    actually uses are drawn.
+
+    Args:
+        depth: an int which specifies the amount of quantum gates in each circuit.
+        n_circuits: the number of circuits to draw. By default a single circuit is
+        drawn.
+        n_qubits: the number of qubits in each circuit, set to 2 by default.
+        seed: a seed or numpy.random.Generator that makes the circuits reproducible.
+
+    Returns:
+        A structured array with the expected_value.PROGRAM_DTYPE layout, of shape
+        (depth,) or (n_circuits, depth), holding the opcode (a key of
+        POTENTIAL_GATES), qubits and angles of every gate.
+    """
+    if n_qubits < 2:
+        raise ValueError(
+            "Circuits need at least 2 qubits but " + str(n_qubits) + " were given"
+        )
+    rng = np.random.default_rng(seed)
+    shape = (depth,) if n_circuits is None else (n_circuits, depth)
+    opcodes = rng.integers(len(POTENTIAL_GATES), size=shape, dtype=np.int8)
+    qubits = np.full(shape + (2,), -1, dtype=np.int32)
+    qubits[..., 0] = rng.integers(n_qubits, size=shape)
+
+    # The second qubit of a two qubit gate is any qubit other than the first
+    two_qubit = GATE_QUBIT_COUNTS[opcodes] == 2
+    offsets = rng.integers(1, n_qubits, size=np.count_nonzero(two_qubit))
+    qubits[two_qubit, 1] = (qubits[two_qubit, 0] + offsets) % n_qubits
 
-    # Intialize a variable that gives a random range based on the length of POTENTIAL_GATES
-    gate_select = randrange(len(POTENTIAL_GATES))
+    # Fill in only the angle slots each gate reads
+    angles = np.zeros(shape + (3,))
+    angle_slots = np.arange(3) < GATE_ANGLE_COUNTS[opcodes][..., None]
+    angles[angle_slots] = rng.uniform(0, 2 * np.pi, size=np.count_nonzero(angle_slots))
 
-    # Append a random gate to the initalized empty gatelist and recursively return the output
-    gatelist.append(POTENTIAL_GATES[gate_select])
-    return random_circuit(depth - 1, gatelist)
+    program = np.empty(shape, dtype=PROGRAM_DTYPE)
+    program["opcode"] = opcodes
+    program["qubits"] = qubits
+    program["angles"] = angles
+    return program
 
 
-def evaluate_circuit(random_gatelist):
+def gate_strings(program):
+    """
+    Writes a compiled program back out as gate strings in the format of
+    evaluate_circuit.
+
+    Args:
+        program: A structured array with the expected_value.PROGRAM_DTYPE layout
+
+    Returns:
+        A list of gate strings such as ".rx(0.5, 1)".
+    """
+    gates = []
+    for opcode, qubits, angles in zip(
+        program["opcode"].tolist(),
+        program["qubits"].tolist(),
+        program["angles"].tolist(),
+    ):
+        arguments = (
+            angles[: GATE_ANGLE_COUNTS[opcode]] + qubits[: GATE_QUBIT_COUNTS[opcode]]
+        )
+        gates.append(
+            "." + GATE_NAMES[opcode] + "(" + ", ".join(map(str, arguments)) + ")"
+        )
+    return gates
+
+
+@profiled("evaluate_circuit")
+def evaluate_circuit(random_gatelist, n_qubits=2, rng=None, output="qiskit"):
     """
     Returns a list of quantum gates with inputted random values for
     different qubits and angles, a circuit with these random gates and randomized inputs,
@@ -78,140 +183,170 @@ def evaluate_circuit(random_gatelist):
         gatelist: An imputted list of quantum gates, this is meant to be the output of the
         random_circuit function, but any list of quantum gates in the specified format
         .<GATE>( will work in the following function.
+        n_qubits: The number of qubits in the circuit, set to 2 by default.
+        rng: An optional numpy.random.Generator to draw the random values from. The
+        global random state of numpy and Python is used by default.
+        output: What to return as the circuit: "qiskit" for a qiskit object, "qasm"
+        for OpenQASM 2 text, or None to skip building a circuit so Qiskit is never
+        imported.
     Returns:
         qubit_input_list: A list of strings of each random quantum gate, with randomly inputted
         values for each gate represented within parentheses of each gate.
         circuit: A qiskit object that represents the actual quantum circuit with the randomly
-        inputted values.
+        inputted values, its OpenQASM text, or None, depending on output.
 
     """
-    # Defined list to append each logic gate to
-    qubit_input_list = []
-    # Initalize a qiskit object to add random value to
-    circuit = QuantumCircuit(2)
-    # Iterate through each random gate in the inputted random Quantum gate list
+    if n_qubits < 2:
+        raise ValueError(
+            "Circuits need at least 2 qubits but " + str(n_qubits) + " were given"
+        )
+    # Choose where the random values are drawn from
+    if rng is None:
+        uniform, integer = np.random.uniform, randrange
+    else:
+        uniform, integer = rng.uniform, rng.integers
+    # Record the opcode, qubits and angles of each gate in the inputted list
+    opcodes = []
+    qubits = []
+    angles = []
     for gate in random_gatelist:
-        # Define random angle values and random qubit variables
-        theta = np.random.uniform(0, 2 * np.pi)
-        lam = np.random.uniform(0, 2 * np.pi)
-        phi = np.random.uniform(0, 2 * np.pi)
-        qubit_select = choice([0, 1])
-        # Input parameters for X gate and append to qubit_input_list
-        if gate == ".x(":
-            circuit.x(qubit_select)
-            qubit_input_list.append(".x(" + str(qubit_select) + ")")
-        # Input parameters for Y gate and append to qubit_input_list
-        elif gate == ".y(":
-            circuit.y(qubit_select)
-            qubit_input_list.append(".y(" + str(qubit_select) + ")")
-        # Input parameters for Z gate and append to qubit_input_list
-        elif gate == ".z(":
-            circuit.z(qubit_select)
-            qubit_input_list.append(".z(" + str(qubit_select) + ")")
-        # Input parameters for H gate and append to qubit_input_list
-        elif gate == ".h(":
-            circuit.h(qubit_select)
-            qubit_input_list.append(".h(" + str(qubit_select) + ")")
-        # Input parameters for SX gate and append to qubit_input_list
-        elif gate == ".sx(":
-            circuit.sx(qubit_select)
-            qubit_input_list.append(".sx(" + str(qubit_select) + ")")
-        # Input parameters for SXDG gate and append to qubit_input_list
-        elif gate == ".sxdg(":
-            circuit.sxdg(qubit_select)
-            qubit_input_list.append(".sxdg(" + str(qubit_select) + ")")
-        # Input parameters for T gate and append to qubit_input_list
-        elif gate == ".t(":
-            circuit.t(qubit_select)
-            qubit_input_list.append(".t(" + str(qubit_select) + ")")
-        # Input parameters for Pauli gate and append to qubit_input_list
-        elif gate == ".p(":
-            circuit.p(theta, qubit_select)
-            qubit_input_list.append(".p(" + str(theta) + ", " + str(qubit_select) + ")")
-        # Input parameters for TDG gate and append to qubit_input_list
-        elif gate == ".tdg(":
-            circuit.tdg(qubit_select)
-            qubit_input_list.append(".t(" + str(qubit_select) + ")")
-        # Input parameters for Controlled Not gate and append to qubit_input_list
-        elif gate == ".cx(":
-            if qubit_select == 0:
-                circuit.cx(qubit_select, 1)
-                qubit_input_list.append(".cx(0, 1)")
-            else:
-                circuit.cx(qubit_select, 0)
-                qubit_input_list.append(".cx(1, 0)")
-        # Input parameters for RXX gate and append to qubit_input_list
-        elif gate == ".rxx(":
-            if qubit_select == 0:
-                circuit.rxx(theta, qubit_select, 1)
-                qubit_input_list.append(".rxx(" + str(theta) + ", 0, 1)")
-            else:
-                circuit.rxx(theta, qubit_select, 0)
-                qubit_input_list.append(".rxx(" + str(theta) + ", 1, 0)")
-        # Input parameters for RYY gate and append to qubit_input_list
-        elif gate == ".ryy(":
-            if qubit_select == 0:
-                circuit.ryy(theta, qubit_select, 1)
-                qubit_input_list.append(".ryy(" + str(theta) + ", 0, 1)")
-            else:
-                circuit.ryy(theta, qubit_select, 0)
-                qubit_input_list.append(".ryy(" + str(theta) + ", 0, 1)")
-        # Input parameters for RZZ gate and append to qubit_input_list
-        elif gate == ".rzz(":
-            if qubit_select == 0:
-                circuit.rzz(theta, qubit_select, 1)
-                qubit_input_list.append(".rzz(" + str(theta) + ", 0, 1)")
-            else:
-                circuit.rzz(theta, qubit_select, 0)
-                qubit_input_list.append(".rzz(" + str(theta) + ", 0, 1)")
-        # Input parameters for RX gate and append to qubit_input_list
-        elif gate == ".rx(":
-            circuit.rx(theta, qubit_select)
-            qubit_input_list.append(
-                ".rx(" + str(theta) + ", " + str(qubit_select) + ")"
-            )
-        # Input parameters for RY gate and append to qubit_input_list
-        elif gate == ".ry(":
-            circuit.ry(theta, qubit_select)
-            qubit_input_list.append(
-                ".ry(" + str(theta) + ", " + str(qubit_select) + ")"
-            )
-        # Input parameters for RZ gate and append to qubit_input_list
-        elif gate == ".rz(":
-            circuit.rz(theta, qubit_select)
-            qubit_input_list.append(
-                ".rz(" + str(theta) + ", " + str(qubit_select) + ")"
-            )
-        # Input parameters for S gate and append to qubit_input_list
-        elif gate == ".s(":
-            circuit.s(qubit_select)
-            qubit_input_list.append(".s(" + str(qubit_select) + ")")
-        # Input parameters for SDG gate and append to qubit_input_list
-        elif gate == ".sdg(":
-            circuit.sdg(qubit_select)
-            qubit_input_list.append(".sdg(" + str(qubit_select) + ")")
-        # Input parameters for SWAP gate and append to qubit_input_list
-        elif gate == ".swap(":
-            if qubit_select == 0:
-                circuit.swap(qubit_select, 1)
-                qubit_input_list.append(".rz(" + str(qubit_select) + ",1)")
-            else:
-                circuit.swap(qubit_select, 0)
-                qubit_input_list.append(".rz(" + str(qubit_select) + ",0)")
-        # Input parameters for U gate and append to qubit_input_list
-        elif gate == ".u(":
-            circuit.u(theta, phi, lam, qubit_select)
-            qubit_input_list.append(
-                ".u("
-                + str(theta)
-                + ", "
-                + str(phi)
-                + ", "
-                + str(lam)
-                + ", "
-                + str(qubit_select)
-                + ")"
-            )
+        # Define random angle values and random qubit variables, where the second
+        # qubit of a two qubit gate is any qubit other than the first
+        theta = float(uniform(0, 2 * np.pi))
+        lam = float(uniform(0, 2 * np.pi))
+        phi = float(uniform(0, 2 * np.pi))
+        qubit_select = int(integer(n_qubits))
+        other_qubit = (qubit_select + 1 + int(integer(n_qubits - 1))) % n_qubits
+        if gate not in GATE_STRING_OPCODES:
+            continue
+        opcode = GATE_STRING_OPCODES[gate]
+        opcodes.append(opcode)
+        qubits.append(
+            (qubit_select, other_qubit if GATE_QUBIT_COUNTS[opcode] == 2 else -1)
+        )
+        # The U gate reads all three angles, and other gates with angles only theta
+        angles.append((theta, phi, lam)[: GATE_ANGLE_COUNTS[opcode]] + (0.0,) * 3)
+
+    program = np.zeros(len(opcodes), dtype=PROGRAM_DTYPE)
+    program["opcode"] = opcodes
+    program["qubits"] = np.reshape(qubits, (-1, 2))
+    program["angles"] = np.reshape([row[:3] for row in angles], (-1, 3))
+    qubit_input_list = gate_strings(program)
+
     # Return qubit_input_list, random qiskit circuit object
-    circuit.measure_all()
-    return qubit_input_list, circuit
+    if output == "qiskit":
+        return qubit_input_list, program_circuit(program, n_qubits)
+    if output == "qasm":
+        return qubit_input_list, program_qasm(program, n_qubits)
+    if output is None:
+        return qubit_input_list, None
+    raise ValueError("Unknown circuit output " + repr(output))
+
+
+def program_circuit(program, n_qubits=2, measure=True):
+    """
+    Builds a qiskit circuit from a compiled program in one pass, looking up the
+    qiskit method of every gate in CIRCUIT_DISPATCH.
+
+    Args:
+        program: A structured array with the expected_value.PROGRAM_DTYPE layout
+        n_qubits: The number of qubits in the circuit, set to 2 by default.
+        measure: Whether to measure every qubit at the end, as evaluate_circuit does.
+
+    Returns:
+        A qiskit QuantumCircuit of the program.
+    """
+    from qiskit import QuantumCircuit
+
+    circuit = QuantumCircuit(n_qubits)
+    for opcode, qubits, angles in zip(
+        program["opcode"].tolist(),
+        program["qubits"].tolist(),
+        program["angles"].tolist(),
+    ):
+        name, angle_count, qubit_count = CIRCUIT_DISPATCH[opcode]
+        getattr(circuit, name)(*angles[:angle_count], *qubits[:qubit_count])
+    if measure:
+        circuit.measure_all()
+    return circuit
+
+
+def program_qasm(program, n_qubits=2, measure=True):
+    """
+    Writes a compiled program as OpenQASM 2 text without going through Qiskit.
+
+    Args:
+        program: A structured array with the expected_value.PROGRAM_DTYPE layout
+        n_qubits: The number of qubits in the circuit, set to 2 by default.
+        measure: Whether to measure every qubit at the end into a register named
+        meas, in the same way as qiskit's measure_all.
+
+    Returns:
+        A string of the OpenQASM 2 program, which qiskit's
+        QuantumCircuit.from_qasm_str can read back.
+    """
+    lines = [QASM_HEADER, "qreg q[" + str(n_qubits) + "];"]
+    for opcode, qubits, angles in zip(
+        program["opcode"].tolist(),
+        program["qubits"].tolist(),
+        program["angles"].tolist(),
+    ):
+        name, angle_count, qubit_count = CIRCUIT_DISPATCH[opcode]
+        if angle_count:
+            name += "(" + ",".join(map(repr, angles[:angle_count])) + ")"
+        lines.append(
+            name
+            + " "
+            + ",".join("q[" + str(qubit) + "]" for qubit in qubits[:qubit_count])
+            + ";"
+        )
+    if measure:
+        all_qubits = ",".join("q[" + str(qubit) + "]" for qubit in range(n_qubits))
+        lines.append("creg meas[" + str(n_qubits) + "];")
+        lines.append("barrier " + all_qubits + ";")
+        lines.extend(
+            "measure q[" + str(qubit) + "] -> meas[" + str(qubit) + "];"
+            for qubit in range(n_qubits)
+        )
+    return "\n".join(lines) + "\n"
+
+
+def circuit_ensemble(
+    depth, n_circuits, chunk_size=1000, n_qubits=2, seed=None, shards=None
+):
+    """
+    Lazily generates and evaluates random circuits in fixed-size chunks, so the
+    memory used stays the same no matter how many circuits are generated. Each
+    chunk is a shard with its own independent seed spawned from the given seed,
+    so a sweep split across any number of workers gives the same circuits.
+
+    Args:
+        depth: an int which specifies the amount of quantum gates in each circuit.
+        n_circuits: the total number of circuits in the ensemble.
+        chunk_size: the number of circuits in each shard, which must be the same
+        across workers for their circuits to match.
+        n_qubits: the number of qubits in each circuit, set to 2 by default.
+        seed: the seed of the whole ensemble. Without one the ensemble is not
+        reproducible.
+        shards: an optional iterable of the shard indicies to generate, such as
+        range(worker, number of shards, number of workers). Every shard is
+        generated by default.
+
+    Yields:
+        A tuple of each shard index and a list of the (qubit_input_list, circuit)
+        pairs returned by evaluate_circuit for the circuits in that shard.
+    """
+    root = np.random.SeedSequence(seed)
+    n_shards = -(-n_circuits // chunk_size)
+    if shards is None:
+        shards = range(n_shards)
+    for shard in shards:
+        # Same seed as root.spawn(n_shards)[shard], without making every child
+        rng = np.random.default_rng(
+            np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (shard,))
+        )
+        size = min(chunk_size, n_circuits - shard * chunk_size)
+        yield shard, [
+            evaluate_circuit(random_circuit(depth, rng=rng), n_qubits, rng)
+            for _ in range(size)
+        ]
@@ -0,0 +1,278 @@
+"""
+A content-addressed on-disk cache of expected probabilities and measured
+counts. Every circuit is keyed by a hash of its compiled gate list, so a gate
+list that is evaluated again, however its gate strings were written, is read
+back from the cache instead of being simulated or run on the backend again.
+
+A cache is a directory holding, for every circuit key:
+    (key)-expected.npy: the float64 probabilities from statevector_output
+    (key)-counts-(backend)-(shots).npy: a uint32 array of shape
+    (trials, configurations) with the counts of every run of the circuit on one
+    backend with that many shots, where (backend) is a hash of the backend name
+Files are evicted least recently used first once the directory grows past its
+size limit. Each process keeps a running total of the size of every cache it
+writes to, so the directory is only scanned when that total passes the limit.
+"""
+import hashlib
+import os
+import numpy as np
+from expected_value import compile_circuit, statevector_output
+from profiling import count
+from result_store import counts_to_array
+
+# The size the cache is trimmed back to once it grows past it, 256 MiB by default
+DEFAULT_CACHE_BYTES = 256 * 2**20
+
+# The running total of bytes of every cache directory this process has written to
+_CACHE_BYTES = {}
+
+
+def circuit_key(gate_list, n_qubits=2):
+    """
+    Hashes the compiled form of a gate list, so equal circuits share a key no
+    matter how their gate strings are spaced or which module prefix they use.
+
+    Args:
+        gate_list: A list of gate strings such as ".h(0)", or a compiled program
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+
+    Returns:
+        A hexadecimal sha256 digest of the circuit.
+    """
+    program = np.ascontiguousarray(compile_circuit(gate_list))
+    digest = hashlib.sha256(str(n_qubits).encode())
+    digest.update(program.tobytes())
+    return digest.hexdigest()
+
+
+def cached_probabilities(cache_path, gate_list, n_qubits=2, max_bytes=None):
+    """
+    Returns the expected probabilities of a circuit, simulating it only when
+    they are not already in the cache.
+
+    Args:
+        cache_path: The directory of the cache
+        gate_list: A list of gate strings such as ".h(0)", or a compiled program
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+        max_bytes: The size to trim the cache back to, DEFAULT_CACHE_BYTES if None
+
+    Returns:
+        A float64 array of the probability of every qubit configuration.
+    """
+    path = os.path.join(cache_path, circuit_key(gate_list, n_qubits) + "-expected.npy")
+    probabilities = _read_entry(path)
+    if probabilities is None:
+        probabilities = np.array(statevector_output(gate_list, n_qubits)[0])
+        _write_entry(cache_path, path, probabilities, max_bytes)
+    return probabilities
+
+
+def cached_counts(
+    cache_path,
+    gate_list,
+    quantum_circuit,
+    trials,
+    backend,
+    shots=1024,
+    n_qubits=2,
+    max_bytes=None,
+    backend_name=None,
+):
+    """
+    Returns the counts of several runs of a circuit, only running the trials
+    that are not already in the cache on the backend.
+
+    Args:
+        cache_path: The directory of the cache
+        gate_list: A list of ordered quantum gate instructions of the circuit
+        quantum_circuit: The circuit object to run, which may be None for a backend
+        that only needs the gate list, such as job_pipeline.StatevectorBackend
+        trials: The number of runs to return
+        backend: An object with a method run(gate_list, quantum_circuit, shots)
+        that returns a counts dictionary, as in job_pipeline
+        shots: The number of shots in each run, set to 1024 by default
+        n_qubits: The number of qubits the circuit acts on, set to 2 by default
+        max_bytes: The size to trim the cache back to, DEFAULT_CACHE_BYTES if None
+        backend_name: The name the counts of the backend are cached under, the
+        class name of the backend by default. Backends of the same class that
+        give different counts, such as two devices, need different names.
+
+    Returns:
+        A uint32 array of shape (trials, number of configurations) with the
+        counts of every run.
+    """
+    backend_name = backend_name or type(backend).__name__
+    counts = read_counts_entry(cache_path, gate_list, shots, n_qubits, backend_name)
+    if len(counts) < trials:
+        # Run only the missing trials, and keep every earlier one
+        new_counts = [
+            counts_to_array(backend.run(gate_list, quantum_circuit, shots), 2**n_qubits)
+            for _ in range(trials - len(counts))
+        ]
+        counts = np.concatenate([counts, np.array(new_counts, dtype=np.uint32)])
+        write_counts_entry(
+            cache_path, gate_list, counts, shots, n_qubits, backend_name, max_bytes
+        )
+    return counts[:trials]
+
+
+def read_counts_entry(cache_path, gate_list, shots, n_qubits, backend_name):
+    """
+    Reads the counts of every run of a circuit already in the cache, without
+    running anything, for callers that run the missing trials themselves.
+
+    Args:
+        cache_path: The directory of the cache
+        gate_list: A list of gate strings such as ".h(0)", or a compiled program
+        shots: The number of shots in each run
+        n_qubits: The number of qubits the circuit acts on
+        backend_name: The name the counts of the backend are cached under
+
+    Returns:
+        A uint32 array of shape (cached trials, 2^n_qubits), with no rows when
+        the circuit has not been run.
+    """
+    counts = _read_entry(
+        _counts_path(cache_path, gate_list, shots, n_qubits, backend_name)
+    )
+    if counts is None:
+        counts = np.zeros((0, 2**n_qubits), dtype=np.uint32)
+    return counts
+
+
+def write_counts_entry(
+    cache_path, gate_list, counts, shots, n_qubits, backend_name, max_bytes=None
+):
+    """
+    Caches the counts of every run of a circuit, replacing any cached before.
+
+    Args:
+        cache_path: The directory of the cache
+        gate_list: A list of gate strings such as ".h(0)", or a compiled program
+        counts: An array of shape (trials, 2^n_qubits) with the counts of every run
+        shots: The number of shots in each run
+        n_qubits: The number of qubits the circuit acts on
+        backend_name: The name the counts of the backend are cached under
+        max_bytes: The size to trim the cache back to, DEFAULT_CACHE_BYTES if None
+    """
+    _write_entry(
+        cache_path,
+        _counts_path(cache_path, gate_list, shots, n_qubits, backend_name),
+        np.asarray(counts, dtype=np.uint32),
+        max_bytes,
+    )
+
+
+def cache_info(cache_path):
+    """
+    Summarises the entries of a cache.
+
+    Args:
+        cache_path: The directory of the cache
+
+    Returns:
+        A dictionary with the number of files in the cache and their total bytes.
+    """
+    entries = _cache_entries(cache_path)
+    return {
+        "files": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+    }
+
+
+def evict(cache_path, max_bytes=None):
+    """
+    Deletes the least recently used files of a cache until it is no larger
+    than max_bytes.
+
+    Args:
+        cache_path: The directory of the cache
+        max_bytes: The size to trim the cache back to, DEFAULT_CACHE_BYTES if None
+
+    Returns:
+        The number of files deleted.
+    """
+    if max_bytes is None:
+        max_bytes = DEFAULT_CACHE_BYTES
+    entries = sorted(_cache_entries(cache_path), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for path, size, _ in entries:
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        deleted += 1
+    _CACHE_BYTES[os.path.abspath(cache_path)] = total
+    return deleted
+
+
+def _counts_path(cache_path, gate_list, shots, n_qubits, backend_name):
+    """
+    Returns the file the counts of a circuit on a backend are cached in.
+    """
+    backend_key = hashlib.sha256(backend_name.encode("utf8")).hexdigest()[:16]
+    return os.path.join(
+        cache_path,
+        circuit_key(gate_list, n_qubits)
+        + "-counts-"
+        + backend_key
+        + "-"
+        + str(shots)
+        + ".npy",
+    )
+
+
+def _cache_entries(cache_path):
+    """
+    Lists the (path, size, last used time) of every file in a cache.
+    """
+    if not os.path.isdir(cache_path):
+        return []
+    entries = []
+    for entry in os.scandir(cache_path):
+        if entry.name.endswith(".npy") and entry.is_file():
+            stat = entry.stat()
+            entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return entries
+
+
+def _read_entry(path):
+    """
+    Loads a cached array, marking it as recently used, or returns None when it
+    is missing.
+    """
+    try:
+        array = np.load(path)
+    except FileNotFoundError:
+        count("result_cache.misses")
+        return None
+    count("result_cache.hits")
+    os.utime(path)
+    return array
+
+
+def _write_entry(cache_path, path, array, max_bytes):
+    """
+    Saves an array to the cache through a temporary file, so readers never see
+    a half-written entry, and then trims the cache once its running total of
+    bytes passes the size limit.
+    """
+    if max_bytes is None:
+        max_bytes = DEFAULT_CACHE_BYTES
+    directory = os.path.abspath(cache_path)
+    if directory not in _CACHE_BYTES:
+        # Scan the directory once, the first time this process writes to it
+        _CACHE_BYTES[directory] = cache_info(cache_path)["bytes"]
+    os.makedirs(cache_path, exist_ok=True)
+    temporary_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporary_path, "wb") as entry:
+        np.save(entry, array)
+    try:
+        replaced_bytes = os.path.getsize(path)
+    except FileNotFoundError:
+        replaced_bytes = 0
+    _CACHE_BYTES[directory] += os.path.getsize(temporary_path) - replaced_bytes
+    os.replace(temporary_path, path)
+    if _CACHE_BYTES[directory] > max_bytes:
+        evict(cache_path, max_bytes)
@@ -0,0 +1,395 @@
+"""
+An append-only binary store for measured counts, replacing the
+job_id_strings_(number).txt files. Counts are kept as fixed-width uint32
+rows indexed by (circuit id, trial), with the circuit metadata stored
+alongside, so analyses can memory-map them without any parsing.
+
+A store is a directory holding:
+    store.json: the number of qubit configurations counted in every row
+    counts.u32: one row of uint32 counts per run, in the order they were added
+    index.i64: the int64 (circuit id, trial) pair of every row of counts.u32
+    circuits.jsonl: one JSON object of metadata per circuit
+    ids.i64: an int64 pair per circuit id, the next trial of the circuit and one
+    more than the byte offset of its metadata in circuits.jsonl (0 for none), so
+    appending never reads the index or the metadata of the other circuits
+"""
+import glob
+import json
+import os
+import re
+import numpy as np
+
+HEADER_FILE = "store.json"
+COUNTS_FILE = "counts.u32"
+INDEX_FILE = "index.i64"
+CIRCUITS_FILE = "circuits.jsonl"
+IDS_FILE = "ids.i64"
+
+# Tokens of a job_id_strings_(number).txt file: quoted gates on the first line, and
+# then line breaks between the quoted bitstrings and counts of each run
+GATE_TOKEN = re.compile(r"'((?:[^'\\]|\\.)*)'")
+COUNTS_TOKEN = re.compile(r"(\n)|'([01 ]+)':\s*(\d+)")
+
+
+def counts_to_array(counts, n_outcomes):
+    """
+    Turns a counts dictionary returned by Qiskit into an array indexed by the
+    qubit configuration.
+
+    Args:
+        counts: A dictionary mapping bitstrings such as "01" to their counts
+        n_outcomes: The number of qubit configurations, 2^n for n qubits
+
+    Returns:
+        A uint32 array of length n_outcomes, where index i holds the counts of the
+        configuration whose bitstring is i written in binary.
+    """
+    counts_array = np.zeros(n_outcomes, dtype=np.uint32)
+    for bitstring, count in counts.items():
+        counts_array[int(bitstring.replace(" ", ""), 2)] = count
+    return counts_array
+
+
+def add_circuit(store_path, gate_list, counts_list):
+    """
+    Adds a new circuit to a store under the next unused circuit id, so circuits
+    of the same depth never share rows.
+
+    Args:
+        store_path: The directory of the store
+        gate_list: The gate list of the circuit, whose length is recorded as its depth
+        counts_list: A list of the counts dictionaries (or arrays) of each run
+
+    Returns:
+        The circuit id the runs were stored under.
+    """
+    circuit_id = next_circuit_id(store_path)
+    append_counts(store_path, circuit_id, counts_list, gate_list)
+    return circuit_id
+
+
+def next_circuit_id(store_path):
+    """
+    Finds the circuit id after every id already used in a store.
+
+    Args:
+        store_path: The directory of the store
+
+    Returns:
+        An int one greater than the largest circuit id in the store, or 0 for an
+        empty store.
+    """
+    ids_path = _ids_path(store_path)
+    if not os.path.exists(ids_path):
+        return 0
+    return os.path.getsize(ids_path) // 16
+
+
+def append_counts(
+    store_path, circuit_id, counts_list, gate_list=None, first_trial=None
+):
+    """
+    Adds the counts of several runs of one circuit to the end of a store,
+    creating the store the first time it is used. Only the entry of the circuit
+    in ids.i64 is read, so appending takes the same time however large the
+    store has grown.
+
+    Args:
+        store_path: The directory of the store
+        circuit_id: A non-negative integer that identifies the circuit, as returned
+        by next_circuit_id
+        counts_list: A list of the counts dictionaries (or arrays) of each run
+        gate_list: The gate list of the circuit, recorded in the metadata the first
+        time it is given for a circuit id. A different gate list for an id that is
+        already recorded raises a ValueError.
+        first_trial: The trial number of the first run in counts_list. By default
+        the runs continue after the last trial stored for the circuit id. Trials
+        before that raise a ValueError.
+    """
+    if not counts_list:
+        return
+    if circuit_id < 0:
+        raise ValueError("Circuit ids must not be negative")
+    if not os.path.exists(os.path.join(store_path, HEADER_FILE)):
+        # Size every row from the bitstrings of the first run
+        first_run = counts_list[0]
+        if isinstance(first_run, dict):
+            n_outcomes = 2 ** len(next(iter(first_run)).replace(" ", ""))
+        else:
+            n_outcomes = len(first_run)
+        os.makedirs(store_path, exist_ok=True)
+        with open(
+            os.path.join(store_path, HEADER_FILE), "w", encoding="utf8"
+        ) as header:
+            json.dump({"n_outcomes": n_outcomes}, header)
+    n_outcomes = store_outcomes(store_path)
+
+    counts_rows = np.array(
+        [
+            counts_to_array(counts, n_outcomes) if isinstance(counts, dict) else counts
+            for counts in counts_list
+        ],
+        dtype=np.uint32,
+    )
+    if counts_rows.ndim != 2 or counts_rows.shape[1] != n_outcomes:
+        raise ValueError(
+            "Counts must have " + str(n_outcomes) + " configurations in this store"
+        )
+
+    # Number the runs after the trials already stored for the circuit
+    next_trial, metadata_offset = _read_circuit_entry(store_path, circuit_id)
+    if first_trial is None:
+        first_trial = next_trial
+    if first_trial < next_trial:
+        raise ValueError(
+            "Trials of circuit " + str(circuit_id) + " are already in the store"
+        )
+    index_rows = np.empty((len(counts_list), 2), dtype=np.int64)
+    index_rows[:, 0] = circuit_id
+    index_rows[:, 1] = np.arange(first_trial, first_trial + len(counts_list))
+
+    circuits_path = os.path.join(store_path, CIRCUITS_FILE)
+    if gate_list is not None and metadata_offset:
+        with open(circuits_path, "rb") as circuits:
+            circuits.seek(metadata_offset - 1)
+            stored = json.loads(circuits.readline())
+        if stored["gate_list"] != list(gate_list):
+            raise ValueError(
+                "Circuit " + str(circuit_id) + " is stored with a different gate list"
+            )
+    elif gate_list is not None:
+        with open(circuits_path, "ab") as circuits:
+            metadata_offset = circuits.tell() + 1
+            circuits.write(
+                json.dumps(
+                    {
+                        "circuit_id": int(circuit_id),
+                        "depth": len(gate_list),
+                        "gate_list": list(gate_list),
+                    }
+                ).encode("utf8")
+            )
+            circuits.write(b"\n")
+
+    # The index is written last and rows are paired with it by position, so
+    # first cut off any counts or partial index row left by an interrupted append
+    index_path = os.path.join(store_path, INDEX_FILE)
+    n_rows = os.path.getsize(index_path) // 16 if os.path.exists(index_path) else 0
+    with open(os.path.join(store_path, COUNTS_FILE), "ab") as counts_file:
+        counts_file.truncate(n_rows * n_outcomes * 4)
+        counts_file.write(counts_rows.tobytes())
+    _write_circuit_entry(
+        store_path, circuit_id, first_trial + len(counts_list), metadata_offset
+    )
+    with open(index_path, "ab") as index_file:
+        index_file.truncate(n_rows * 16)
+        index_file.write(index_rows.tobytes())
+
+
+def store_outcomes(store_path):
+    """
+    Reads the number of qubit configurations counted in every row of a store.
+
+    Args:
+        store_path: The directory of the store
+
+    Returns:
+        The width of each row of counts as an int.
+    """
+    with open(os.path.join(store_path, HEADER_FILE), encoding="utf8") as header:
+        return json.load(header)["n_outcomes"]
+
+
+def read_counts(store_path):
+    """
+    Memory-maps the counts and index of a store without reading them into memory.
+
+    Args:
+        store_path: The directory of the store
+
+    Returns:
+        A read-only uint32 array of shape (number of runs, number of configurations)
+        and a read-only int64 array of shape (number of runs, 2) with the
+        (circuit id, trial) of each run.
+    """
+    index_path = os.path.join(store_path, INDEX_FILE)
+    if not os.path.getsize(index_path):
+        return (
+            np.zeros((0, store_outcomes(store_path)), dtype=np.uint32),
+            np.zeros((0, 2), dtype=np.int64),
+        )
+    index = np.memmap(index_path, dtype=np.int64, mode="r").reshape(-1, 2)
+    counts = np.memmap(
+        os.path.join(store_path, COUNTS_FILE), dtype=np.uint32, mode="r"
+    ).reshape(-1, store_outcomes(store_path))
+    return counts[: len(index)], index
+
+
+def read_circuits(store_path):
+    """
+    Reads the metadata of every circuit in a store.
+
+    Args:
+        store_path: The directory of the store
+
+    Returns:
+        A dictionary mapping each circuit id to its metadata, which holds the depth
+        and gate list of the circuit.
+    """
+    circuits_path = os.path.join(store_path, CIRCUITS_FILE)
+    if not os.path.exists(circuits_path):
+        return {}
+    with open(circuits_path, encoding="utf8") as circuits:
+        metadata = [json.loads(line) for line in circuits]
+    return {circuit["circuit_id"]: circuit for circuit in metadata}
+
+
+def load_counts_tensor(store_path):
+    """
+    Gathers every run in a store into one (circuit, trial, configuration) tensor.
+
+    Args:
+        store_path: The directory of the store
+
+    Returns:
+        A sorted array of the circuit ids, and a uint32 array of shape
+        (number of circuits, number of trials, number of configurations) with the
+        counts of every run. Runs that were never stored are left as zeros.
+    """
+    counts, index = read_counts(store_path)
+    circuit_ids, rows = np.unique(index[:, 0], return_inverse=True)
+    n_trials = int(index[:, 1].max()) + 1 if len(index) else 0
+    tensor = np.zeros((len(circuit_ids), n_trials, counts.shape[1]), dtype=np.uint32)
+    tensor[rows, index[:, 1]] = counts
+    return circuit_ids, tensor
+
+
+def load_job_archive(directory):
+    """
+    Reads every job_id_strings_(number).txt file written by job_request in a
+    directory into arrays, with a single pass over the text of each file.
+
+    Args:
+        directory: The directory holding the text files
+
+    Returns:
+        A sorted int array of the depth in each file name, a uint32 array of shape
+        (number of depths, number of trials, number of configurations) with the
+        counts of every run, and a list of the gate list of each depth. Files with
+        fewer trials than the others are padded with zeros.
+    """
+    paths = {}
+    for path in glob.glob(os.path.join(directory, "job_id_strings_*.txt")):
+        depth = os.path.basename(path)[len("job_id_strings_") : -len(".txt")]
+        if depth.isdigit():
+            paths[int(depth)] = path
+    depths = np.array(sorted(paths), dtype=int)
+
+    gate_lists = []
+    runs = []
+    n_outcomes = 4
+    for depth in depths:
+        with open(paths[depth], encoding="utf8") as job_ids:
+            first_line, _, body = job_ids.read().partition("\n")
+        gate_lists.append(GATE_TOKEN.findall(first_line))
+
+        # Each line break closes the run on the line before it
+        trials = []
+        trial = {}
+        for newline, bitstring, count in COUNTS_TOKEN.findall(body + "\n"):
+            if newline:
+                if trial:
+                    trials.append(trial)
+                trial = {}
+            else:
+                bitstring = bitstring.replace(" ", "")
+                trial[int(bitstring, 2)] = int(count)
+                n_outcomes = max(n_outcomes, 2 ** len(bitstring))
+        runs.append(trials)
+
+    n_trials = max((len(trials) for trials in runs), default=0)
+    counts = np.zeros((len(depths), n_trials, n_outcomes), dtype=np.uint32)
+    for i, trials in enumerate(runs):
+        for j, trial in enumerate(trials):
+            counts[i, j, list(trial)] = list(trial.values())
+    return depths, counts, gate_lists
+
+
+def convert_job_archive(directory, store_path):
+    """
+    Converts a directory of job_id_strings_(number).txt files into a result
+    store once, so later analyses can memory-map the counts instead.
+
+    Args:
+        directory: The directory holding the text files
+        store_path: The directory of the store to append to, giving each file a new
+        circuit id and keeping its depth in the metadata
+
+    Returns:
+        A list of the circuit id of each file, in order of depth.
+    """
+    _, counts, gate_lists = load_job_archive(directory)
+    circuit_ids = []
+    for depth_counts, gate_list in zip(counts, gate_lists):
+        # Leave out the zero padding of files with fewer trials
+        runs = depth_counts[depth_counts.sum(axis=1) > 0]
+        circuit_ids.append(add_circuit(store_path, gate_list, list(runs)))
+    return circuit_ids
+
+
+def _ids_path(store_path):
+    """
+    Returns the path of ids.i64, building it from the index and metadata of a
+    store written before ids.i64 was kept.
+    """
+    ids_path = os.path.join(store_path, IDS_FILE)
+    index_path = os.path.join(store_path, INDEX_FILE)
+    circuits_path = os.path.join(store_path, CIRCUITS_FILE)
+    if os.path.exists(ids_path) or not (
+        os.path.exists(index_path) or os.path.exists(circuits_path)
+    ):
+        return ids_path
+    index = np.zeros((0, 2), dtype=np.int64)
+    if os.path.exists(index_path) and os.path.getsize(index_path):
+        index = read_counts(store_path)[1]
+    offsets = {}
+    if os.path.exists(circuits_path):
+        with open(circuits_path, "rb") as circuits:
+            offset = 0
+            for line in circuits:
+                offsets.setdefault(json.loads(line)["circuit_id"], offset + 1)
+                offset += len(line)
+    n_ids = max([int(index[:, 0].max()) if len(index) else -1] + list(offsets)) + 1
+    table = np.zeros((n_ids, 2), dtype=np.int64)
+    np.maximum.at(table[:, 0], index[:, 0], index[:, 1] + 1)
+    for circuit_id, offset in offsets.items():
+        table[circuit_id, 1] = offset
+    table.tofile(ids_path)
+    return ids_path
+
+
+def _read_circuit_entry(store_path, circuit_id):
+    """
+    Reads the next trial and metadata offset of a circuit from ids.i64, which
+    are both 0 for a circuit that is not in the store.
+    """
+    ids_path = _ids_path(store_path)
+    if not os.path.exists(ids_path) or os.path.getsize(ids_path) < 16 * (
+        circuit_id + 1
+    ):
+        return 0, 0
+    with open(ids_path, "rb") as ids:
+        ids.seek(16 * circuit_id)
+        next_trial, metadata_offset = np.frombuffer(ids.read(16), dtype=np.int64)
+    return int(next_trial), int(metadata_offset)
+
+
+def _write_circuit_entry(store_path, circuit_id, next_trial, metadata_offset):
+    """
+    Writes the entry of a circuit in ids.i64, extending the file with empty
+    entries up to it.
+    """
+    ids_path = _ids_path(store_path)
+    with open(ids_path, "r+b" if os.path.exists(ids_path) else "wb") as ids:
+        ids.seek(16 * circuit_id)
+        ids.write(np.array([next_trial, metadata_offset], dtype=np.int64).tobytes())
@@ -0,0 +1,388 @@
+"""
+A command line sweep that draws a random circuit for every depth, runs it on a
+backend over many trials and tests the counts against the expected
+probabilities. Results are written as each depth completes, so a sweep can run
+without Jupyter and be followed while it runs.
+
+The --backend option picks where the counts come from:
+    offline: ideal counts sampled from the expected probabilities on worker
+    processes, so every Chi-squared value is a draw from the null hypothesis.
+    This is the default.
+    statevector: job_pipeline's in-process StatevectorBackend
+    aer: the Aer qasm simulator of the job_request session, through job_pipeline.
+    Unless a backend was given to job_request.set_backend, this saves and loads
+    the IBMQ account with job_request.API_TOKEN first, so the placeholder token
+    has to be replaced with a real one.
+With statevector or aer, the circuits are drawn on worker processes and the
+trials of every depth are sent through a single job_pipeline.run_jobs stream,
+with up to --workers jobs in flight.
+
+The --cache option names a result_cache directory that is shared between
+sweeps. The expected probabilities of every circuit drawn before are read from
+it instead of being simulated again, and on the statevector and aer backends
+only the trials that are not already cached for the circuit are run.
+
+Usage:
+    python sweep.py --depths 1,2,5,200 --trials 10 --shots 1024 --workers 4 --seed 7
+    python sweep.py --depths 1,2,5,200 --backend statevector --cache sweep_cache
+    python sweep.py --depths 1,2,5,200 --profile profile.json
+
+Writes to the --output directory, which must be new or empty:
+    store/: a result_store of the counts of every trial, where the circuit id is
+    the position of the depth in --depths
+    results.jsonl: one JSON object per depth with its circuit id, expected
+    probabilities, the Chi-squared value of every trial and whether it is
+    significant
+With --profile, the stages of the sweep are also timed, including the ones run
+on worker processes, and profiling.write_summary writes them to the given JSON
+file when the sweep ends.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import profiling
+from chi_squared_calc import batch_chi_squared, significance_mask
+from expected_value import sample_counts, statevector_output
+from job_pipeline import AerBackend, StatevectorBackend, run_jobs
+from random_circuit import gate_strings, program_circuit, random_program
+from result_cache import cached_probabilities, read_counts_entry, write_counts_entry
+from result_store import append_counts, counts_to_array
+
+RESULTS_FILE = "results.jsonl"
+STORE_DIRECTORY = "store"
+BACKENDS = ("offline", "statevector", "aer")
+
+
+@profiling.profiled("draw_depth")
+def draw_depth(depth, n_qubits, seed, cache=None):
+    """
+    Draws the circuit of one depth and calculates its expected probabilities.
+
+    Args:
+        depth: The number of gates in the circuit
+        n_qubits: The number of qubits in the circuit
+        seed: A numpy.random.SeedSequence for this depth
+        cache: A result_cache directory to read and write the expected
+        probabilities through, or None to always simulate the circuit
+
+    Returns:
+        A tuple of the compiled program of the circuit, its gate list, its expected
+        probabilities and the generator the circuit was drawn with.
+    """
+    rng = np.random.default_rng(seed)
+    program = random_program(depth, n_qubits=n_qubits, seed=rng)
+    gate_list = gate_strings(program)
+    if cache is None:
+        probabilities = np.array(statevector_output(gate_list, n_qubits)[0])
+    else:
+        probabilities = cached_probabilities(cache, gate_list, n_qubits)
+    return program, gate_list, probabilities, rng
+
+
+def run_depth(depth, trials, shots, n_qubits, seed, cache=None):
+    """
+    Draws and simulates the circuit of one depth, and samples ideal counts from
+    its expected probabilities for an offline sweep.
+
+    Args:
+        depth: The number of gates in the circuit
+        trials: The number of times to sample the counts of the circuit
+        shots: The number of shots in every trial
+        n_qubits: The number of qubits in the circuit
+        seed: A numpy.random.SeedSequence for this depth
+        cache: A result_cache directory for the expected probabilities, or None
+
+    Returns:
+        A tuple of the gate list of the circuit, its expected probabilities and a
+        uint32 array of shape (trials, 2^n_qubits) with the counts of every trial.
+    """
+    _, gate_list, probabilities, rng = draw_depth(depth, n_qubits, seed, cache)
+    counts = sample_counts(probabilities, shots, trials, rng).astype(np.uint32)
+    return gate_list, probabilities, counts
+
+
+def _on_worker(profile, function, *args):
+    """
+    Calls a function on a worker process, recording its stages when the sweep
+    is profiled so they can be merged into the parent's recordings.
+
+    Returns:
+        A tuple of the value returned by the function and the recordings of
+        profiling.collect, or None when the sweep is not profiled.
+    """
+    if not profile:
+        return function(*args), None
+    # Forget anything inherited from the parent or left by an earlier call
+    profiling.reset()
+    profiling.enable()
+    return function(*args), profiling.collect()
+
+
+def _merge_worker(returned):
+    """
+    Merges the recordings returned by _on_worker and returns the function's
+    value.
+    """
+    value, recorded = returned
+    if recorded is not None:
+        profiling.merge(recorded)
+    return value
+
+
+def _offline_runs(depths, trials, shots, workers, seeds, n_qubits, cache=None):
+    """
+    Runs every depth with run_depth on a pool of worker processes, keeping at
+    most two depths queued per worker.
+
+    Yields:
+        A tuple of the position of each depth in depths and the values returned
+        by run_depth, in the order the depths complete.
+    """
+    tasks = iter(enumerate(zip(depths, seeds)))
+    profile = profiling.is_enabled()
+    with ProcessPoolExecutor(workers) as executor:
+        pending = {}
+        while True:
+            for i, (depth, depth_seed) in tasks:
+                future = executor.submit(
+                    _on_worker,
+                    profile,
+                    run_depth,
+                    depth,
+                    trials,
+                    shots,
+                    n_qubits,
+                    depth_seed,
+                    cache,
+                )
+                pending[future] = i
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield (pending.pop(future),) + _merge_worker(future.result())
+
+
+def _backend_runs(depths, trials, shots, workers, seeds, n_qubits, backend, cache=None):
+    """
+    Draws every depth on a pool of worker processes and runs the trials of all
+    of them as one stream of job_pipeline jobs, with up to workers jobs in
+    flight at once across depths. With a cache, trials already cached for a
+    circuit on the backend are reused, and the counts of every depth that ran
+    new trials are cached once it completes.
+
+    Yields:
+        A tuple of the position of each depth in depths, its gate list, its
+        expected probabilities and a uint32 array of shape (trials, 2^n_qubits)
+        with the counts of every trial, as soon as its last trial completes.
+    """
+    backend_name = type(backend).__name__
+    drawn = {}
+    remaining = {}
+    # Depths whose every trial was already cached, which never enter the stream
+    ready = []
+    profile = profiling.is_enabled()
+
+    def jobs(executor):
+        # The pool draws the depths in order while earlier jobs are running
+        drawn_depths = executor.map(
+            _on_worker,
+            [profile] * len(depths),
+            [draw_depth] * len(depths),
+            depths,
+            [n_qubits] * len(depths),
+            seeds,
+            [cache] * len(depths),
+        )
+        for i, returned in enumerate(drawn_depths):
+            program, gate_list, probabilities, _ = _merge_worker(returned)
+            counts = np.zeros((trials, 2**n_qubits), dtype=np.uint32)
+            cached_trials = 0
+            if cache is not None:
+                cached = read_counts_entry(
+                    cache, gate_list, shots, n_qubits, backend_name
+                )[:trials]
+                cached_trials = len(cached)
+                counts[:cached_trials] = cached
+            if cached_trials == trials:
+                ready.append((i, gate_list, probabilities, counts))
+                continue
+            # The statevector backend simulates the gate list without Qiskit
+            quantum_circuit = None
+            if isinstance(backend, AerBackend):
+                quantum_circuit = program_circuit(program, n_qubits)
+            drawn[i] = (gate_list, probabilities, counts)
+            remaining[i] = trials - cached_trials
+            for trial in range(cached_trials, trials):
+                yield (i, trial), gate_list, quantum_circuit
+
+    loop = asyncio.new_event_loop()
+    with ProcessPoolExecutor(min(workers, os.cpu_count())) as executor:
+        stream = run_jobs(jobs(executor), backend, shots=shots, max_in_flight=workers)
+        try:
+            while True:
+                try:
+                    (i, trial), job_counts = loop.run_until_complete(stream.__anext__())
+                except StopAsyncIteration:
+                    yield from ready
+                    return
+                while ready:
+                    yield ready.pop(0)
+                gate_list, probabilities, counts = drawn[i]
+                counts[trial] = counts_to_array(job_counts, 2**n_qubits)
+                remaining[i] -= 1
+                if not remaining[i]:
+                    del drawn[i], remaining[i]
+                    if cache is not None:
+                        write_counts_entry(
+                            cache, gate_list, counts, shots, n_qubits, backend_name
+                        )
+                    yield i, gate_list, probabilities, counts
+        finally:
+            loop.run_until_complete(stream.aclose())
+            loop.close()
+
+
+def parallel_sweep(
+    depths,
+    output,
+    trials=10,
+    shots=1024,
+    workers=None,
+    seed=None,
+    n_qubits=2,
+    backend="offline",
+    cache=None,
+):
+    """
+    Runs every depth of a sweep and writes each one as soon as it completes.
+
+    Args:
+        depths: A list of distinct circuit depths to run
+        output: The directory to write the result store and results.jsonl to, which
+        must be new or empty
+        trials: The number of trials of every depth, set to 10 by default
+        shots: The number of shots in every trial, set to 1024 by default
+        workers: The number of worker processes of an offline sweep, or the number
+        of jobs in flight on a backend, which draws its circuits on up to that many
+        processes, the number of CPUs by default
+        seed: A seed that makes the whole sweep reproducible
+        n_qubits: The number of qubits in every circuit, set to 2 by default
+        backend: One of BACKENDS, set to "offline" by default. "aer" loads the IBMQ
+        account through job_request.get_backend unless the session already has a
+        backend.
+        cache: A result_cache directory shared between sweeps, or None to simulate
+        and run every circuit
+
+    Yields:
+        The dictionary written to results.jsonl for each depth, in the order the
+        depths complete.
+    """
+    if len(set(depths)) != len(depths):
+        raise ValueError("Every depth of a sweep must be different")
+    if backend not in BACKENDS:
+        raise ValueError("The backend must be one of " + ", ".join(BACKENDS))
+    if os.path.isdir(output) and os.listdir(output):
+        raise ValueError("The output directory " + str(output) + " is not empty")
+    os.makedirs(output, exist_ok=True)
+    store_path = os.path.join(output, STORE_DIRECTORY)
+    # Every depth draws from its own child seed, so results do not depend on
+    # which worker runs it
+    seeds = np.random.SeedSequence(seed).spawn(len(depths) + 1)
+    workers = workers or os.cpu_count()
+    if backend == "offline":
+        runs = _offline_runs(
+            depths, trials, shots, workers, seeds[:-1], n_qubits, cache
+        )
+    else:
+        if backend == "aer":
+            job_backend = AerBackend()
+        else:
+            job_backend = StatevectorBackend(n_qubits, seeds[-1])
+        runs = _backend_runs(
+            depths, trials, shots, workers, seeds[:-1], n_qubits, job_backend, cache
+        )
+
+    with open(os.path.join(output, RESULTS_FILE), "w", encoding="utf8") as results_file:
+        for i, gate_list, probabilities, counts in runs:
+            chi_value, _ = batch_chi_squared(probabilities * shots, counts)
+            dof = len(probabilities) - 1
+            result = {
+                "circuit_id": i,
+                "depth": depths[i],
+                "expected": probabilities.tolist(),
+                "chi_squared": chi_value.tolist(),
+                "significant": significance_mask(chi_value, dof=dof).tolist(),
+            }
+            append_counts(store_path, i, list(counts), gate_list)
+            results_file.write(json.dumps(result) + "\n")
+            results_file.flush()
+            yield result
+
+
+def main(argv=None):
+    """
+    Runs a sweep from the command line, printing a line as each depth completes.
+
+    Args:
+        argv: The command line arguments, read from sys.argv by default
+
+    Returns:
+        The exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--depths", required=True, help="e.g. 1,2,5,200")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--shots", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--qubits", type=int, default=2)
+    parser.add_argument("--output", default="sweep_results")
+    parser.add_argument("--backend", choices=BACKENDS, default="offline")
+    parser.add_argument("--cache", default=None, help="a result_cache directory")
+    parser.add_argument("--profile", default=None, help="a JSON file for the timings")
+    args = parser.parse_args(argv)
+
+    depths = [int(depth) for depth in args.depths.split(",")]
+    if len(set(depths)) != len(depths):
+        parser.error("every depth in --depths must be different")
+    if os.path.isdir(args.output) and os.listdir(args.output):
+        parser.error("the --output directory " + args.output + " is not empty")
+    if args.profile:
+        profiling.enable()
+    try:
+        for result in parallel_sweep(
+            depths,
+            args.output,
+            args.trials,
+            args.shots,
+            args.workers,
+            args.seed,
+            args.qubits,
+            args.backend,
+            args.cache,
+        ):
+            print(
+                "Depth "
+                + str(result["depth"])
+                + ": "
+                + str(sum(result["significant"]))
+                + " of "
+                + str(args.trials)
+                + " trials statistically significant"
+            )
+    finally:
+        # An interrupted sweep still writes the timings of what it ran
+        if args.profile:
+            profiling.write_summary(args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Check the benchmark suite on a small scale
+"""
+
+import json
+
+from benchmark import find_regressions, main
+
+
+def test_find_regressions():
+    """
+    Test that only benchmarks slower than the threshold allows are reported.
+    """
+    baseline = {"a": {"rate": 100.0}, "b": {"rate": 100.0}}
+    results = {"a": {"rate": 80.0}, "b": {"rate": 70.0}, "c": {"rate": 1.0}}
+    assert find_regressions(results, baseline, threshold=0.25) == [("b", 100.0, 70.0)]
+
+
+def test_baseline_comparison(tmp_path):
+    """
+    Test that a saved baseline holds every benchmark, and that comparing with a
+    much faster baseline fails.
+    """
+    baseline_path = tmp_path / "baseline.json"
+    assert (
+        main(["--scale", "0.005", "--depths", "1,10", "--save", str(baseline_path)])
+        == 0
+    )
+    with open(baseline_path, encoding="utf8") as baseline_file:
+        saved = json.load(baseline_file)
+    assert "gate_matrix.rzz" in saved["results"]
+    assert "statevector_output.depth_10" in saved["results"]
+    assert saved["results"]["batch_chi_squared"]["unit"] == "circuits"
+
+    for result in saved["results"].values():
+        result["rate"] *= 1000
+    with open(baseline_path, "w", encoding="utf8") as baseline_file:
+        json.dump(saved, baseline_file)
+    assert (
+        main(["--scale", "0.005", "--depths", "1", "--compare", str(baseline_path)])
+        == 1
+    )
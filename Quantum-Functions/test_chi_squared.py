@@ -3,9 +3,17 @@ Check the correctness of the chi-squared calculator
 """
 
 import math
+import numpy as np
 import pytest
 
-from chi_squared_calc import chi_squared, significance_statement
+from chi_squared_calc import (
+    batch_chi_squared,
+    chi_squared,
+    chi_squared_sf,
+    critical_value,
+    significance_mask,
+    significance_statement,
+)
 
 CHI_SQUARED_COMPARISON = [
     # Test that a trivial case outputs zero
@@ -67,6 +75,12 @@ CHI_SQUARED_COMPARISON = [
         [900, 1, 3100, 1],
         1614.001,
     ),
+    # Test a case with the eight configurations of three qubits
+    (
+        [1, 1, 1, 1, 1, 1, 1, 1],
+        [0, 0, 0, 0, 0, 0, 0, 8],
+        56,
+    ),
 ]
 
 
@@ -154,3 +168,83 @@ def test_significance(chi_val, sig_val, sig_statement):
     """
     test_sig_statement = significance_statement(chi_val, sig_val)
     assert test_sig_statement == sig_statement
+
+
+def test_batch_chi_squared():
+    """
+    Test that the batch calculator gives the same Chi-squared values as the
+    single test calculator and flags tests whose sums are not the same.
+    """
+    cases = [case for case in CHI_SQUARED_COMPARISON if len(case[0]) == 4]
+    theory_val = np.array([case[0] for case in cases])
+    experimental_val = np.array([case[1] for case in cases])
+    chi_val = np.array([case[2] for case in cases])
+
+    test_chi_val, invalid = batch_chi_squared(theory_val, experimental_val)
+    assert test_chi_val.dtype == np.float64
+    assert not invalid.any()
+    assert np.allclose(test_chi_val, chi_val, atol=0.0005)
+
+    # Broadcast one expected row against a stack of trials with a bad sum
+    trials = np.array([[[4, 6, 7, 3], [5, 5, 5, 6]]] * 3)
+    test_chi_val, invalid = batch_chi_squared([5, 5, 5, 5], trials)
+    assert test_chi_val.shape == invalid.shape == (3, 2)
+    assert np.allclose(test_chi_val[:, 0], 2.0)
+    assert invalid[:, 1].all() and np.isnan(test_chi_val[:, 1]).all()
+
+
+CRITICAL_COMPARISON = [
+    # Test the critical values of 3 degrees of freedom from the known table
+    (3, 0.99, 0.115),
+    (3, 0.50, 2.366),
+    (3, 0.05, 7.815),
+    (3, 0.01, 11.345),
+    # Test the critical value of a single degree of freedom
+    (1, 0.05, 3.841),
+    # Test the critical value for the 16 configurations of four qubits
+    (15, 0.05, 24.996),
+]
+
+
+@pytest.mark.parametrize("dof, sig_val, chi_val", CRITICAL_COMPARISON)
+def test_critical_value(dof, sig_val, chi_val):
+    """
+    Test that the critical Chi-squared values match known tables and that
+    their p-values are the level of significance.
+
+    Args:
+        dof: The number of degrees of freedom
+        sig_val: The level of significance
+        chi_val: The known critical Chi-squared value rounded to three places
+    """
+    assert math.isclose(critical_value(dof, sig_val), chi_val, abs_tol=0.0005)
+    assert math.isclose(chi_squared_sf(critical_value(dof, sig_val), dof), sig_val)
+
+
+def test_chi_squared_sf_array():
+    """
+    Test that p-values of a whole array are computed at once, using the closed
+    form of 2 degrees of freedom, and that the significance mask agrees.
+    """
+    chi_val = np.array([[0, 1.5, 6.333], [9.347, 30, 1614.001]])
+    assert np.allclose(chi_squared_sf(chi_val, 2), np.exp(-chi_val / 2))
+    assert np.array_equal(
+        significance_mask(chi_val), [[False, False, False], [True, True, True]]
+    )
+
+
+def test_chi_squared_sf_odd_dof():
+    """
+    Test that p-values of odd degrees of freedom match the closed forms built on
+    math.erfc to float precision, down to p-values far below any significance.
+    """
+    chi_val = np.concatenate([np.linspace(0, 60, 6001), [0.1, 0.4394, 32, 1400]])
+    erfc = np.array([math.erfc(math.sqrt(value / 2)) for value in chi_val])
+    assert np.allclose(chi_squared_sf(chi_val, 1), erfc, rtol=1e-14, atol=0)
+    dof_3 = erfc + np.sqrt(2 * chi_val / math.pi) * np.exp(-chi_val / 2)
+    assert np.allclose(chi_squared_sf(chi_val, 3), dof_3, rtol=1e-13, atol=0)
+    assert chi_squared_sf(2000.0, 1) == 0
+    assert np.isnan(chi_squared_sf(np.array([np.nan, 1.0]), 3)[0])
+
+    for dof in range(1, 6):
+        assert chi_squared_sf(np.inf, dof) == 0
@@ -0,0 +1,72 @@
+"""
+Check parameterized circuit templates against binding every angle by hand
+"""
+
+import numpy as np
+import pytest
+
+from circuit_template import compile_template, template_probabilities
+from expected_value import statevector_output
+
+TEMPLATE = [
+    "test.h(0)",
+    "test.rx(a, 1)",
+    "test.cx(0, 1)",
+    "test.u(a, 0.3, b, 0)",
+    "test.rzz(b, 1, 0)",
+    "test.s(1)",
+    "test.p(c, 0)",
+]
+
+
+def bound_gate_list(a, b, c):
+    """
+    Writes out TEMPLATE with its angles filled in.
+    """
+    return [
+        "test.h(0)",
+        "test.rx(" + str(a) + ", 1)",
+        "test.cx(0, 1)",
+        "test.u(" + str(a) + ", 0.3, " + str(b) + ", 0)",
+        "test.rzz(" + str(b) + ", 1, 0)",
+        "test.s(1)",
+        "test.p(" + str(c) + ", 0)",
+    ]
+
+
+def test_compile_template():
+    """
+    Test that every place a slot fills is recorded.
+    """
+    program, slots = compile_template(TEMPLATE)
+    assert len(program) == len(TEMPLATE)
+    assert slots == {"a": [(1, 0), (3, 0)], "b": [(3, 2), (4, 0)], "c": [(6, 0)]}
+    assert program["angles"][3].tolist() == [0, 0.3, 0]
+    with pytest.raises(ValueError):
+        compile_template(["test.rx(0.5, q)"])
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3])
+def test_template_probabilities(n_qubits):
+    """
+    Test that binding arrays of angles matches simulating each binding alone.
+
+    Args:
+        n_qubits: The number of qubits in the circuit
+    """
+    a = np.linspace(0, 3, 6)
+    b = np.linspace(1, 2, 6)
+    probabilities = template_probabilities(
+        compile_template(TEMPLATE), {"a": a, "b": b, "c": 0.7}, n_qubits
+    )
+    assert probabilities.shape == (6, 2**n_qubits)
+    for i in range(6):
+        expected = statevector_output(bound_gate_list(a[i], b[i], 0.7), n_qubits)[0]
+        assert np.allclose(probabilities[i], expected)
+    single = template_probabilities(
+        TEMPLATE, {"a": a, "b": b, "c": 0.7}, n_qubits, np.complex64
+    )
+    assert single.dtype == np.float32
+    assert np.allclose(single, probabilities, atol=1e-5)
+    with pytest.raises(ValueError):
+        template_probabilities(TEMPLATE, {"a": a, "b": b}, n_qubits)
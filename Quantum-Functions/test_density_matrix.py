@@ -0,0 +1,86 @@
+"""
+Check the noisy density matrix engine
+"""
+
+import numpy as np
+import pytest
+
+from density_matrix import density_matrix_output, unitary_superoperators
+from expected_value import statevector_output
+
+GATE_LIST = [
+    "test.h(0)",
+    "test.rx(0.7, 1)",
+    "test.cx(0, 1)",
+    "test.u(0.1, 0.2, 0.3, 1)",
+    "test.ryy(1.1, 1, 0)",
+    "test.swap(1, 0)",
+    "test.sx(0)",
+]
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3])
+def test_noiseless_matches_statevector(n_qubits):
+    """
+    Test that without noise the probabilities are those of statevector_output.
+
+    Args:
+        n_qubits: The number of qubits in the circuit
+    """
+    assert np.allclose(
+        density_matrix_output(GATE_LIST, n_qubits),
+        statevector_output(GATE_LIST, n_qubits)[0],
+    )
+
+
+def test_channels():
+    """
+    Test the limits of each noise channel.
+    """
+    # Full depolarizing after a two qubit gate leaves the maximally mixed state
+    assert np.allclose(
+        density_matrix_output(["test.x(0)", "test.cx(0, 1)"], depolarizing=1),
+        [0.25] * 4,
+    )
+    # Full amplitude damping returns the excited qubit to 0
+    assert np.allclose(
+        density_matrix_output(["test.x(1)"], amplitude_damping=1), [1, 0, 0, 0]
+    )
+    assert np.allclose(
+        density_matrix_output(["test.x(1)"], amplitude_damping=0.25), [0.25, 0, 0.75, 0]
+    )
+    # Readout errors flip the measured qubits
+    assert np.allclose(
+        density_matrix_output(["test.x(0)"], readout_error=1), [0, 0, 1, 0]
+    )
+    assert np.allclose(
+        density_matrix_output(["test.x(0)"], readout_error=0.1),
+        [0.09, 0.81, 0.01, 0.09],
+    )
+
+
+def test_batched_noise_models():
+    """
+    Test that arrays of noise parameters give the same probabilities as
+    simulating each noise model on its own, from precomputed superoperators.
+    """
+    superoperators = unitary_superoperators(GATE_LIST)
+    depolarizing = np.array([0, 0.01, 0.2])
+    readout_error = np.array([0.05, 0, 0.1])
+    probabilities = density_matrix_output(
+        superoperators, 2, depolarizing, 0.03, readout_error
+    )
+    assert probabilities.shape == (3, 4)
+    assert np.allclose(probabilities.sum(axis=1), 1)
+    for i in range(3):
+        assert np.allclose(
+            probabilities[i],
+            density_matrix_output(
+                GATE_LIST, 2, depolarizing[i], 0.03, readout_error[i]
+            ),
+        )
+    single = density_matrix_output(
+        superoperators, 2, depolarizing, 0.03, readout_error, np.complex64
+    )
+    assert single.dtype == np.float32
+    assert np.allclose(single, probabilities, atol=1e-5)
@@ -1,11 +1,24 @@
 """
 Check the correctness of the chi-squared calculator
 """
-
 import numpy as np
 import pytest
 
-from expected_value import statevector_output
+from chi_squared_calc import batch_chi_squared
+from expected_value import (
+    allocate_workspace,
+    batch_statevector_output,
+    clear_gate_cache,
+    compile_circuit,
+    compile_gate,
+    fuse_program,
+    prefix_probabilities,
+    gate_cache_info,
+    run_fused_program,
+    sample_counts,
+    statevector_output,
+)
+from random_circuit import random_program
 
 MATRIX_COMPARISON = [
     # Test the Hadamard gate on qubit 1
@@ -221,3 +234,320 @@ def test_statevector_output(gate_list, probabilities, statevector):
     test_probabilities = statevector_output(gate_list)
     assert np.allclose(test_probabilities[0], probabilities)
     assert np.allclose(test_probabilities[1], statevector)
+
+
+COMPILE_COMPARISON = [
+    # Test that a gate without angles only records its qubit
+    ("test.h(1)", (1, (1,), ())),
+    # Test that a controlled gate records the control qubit first
+    ("test.cx(1, 0)", (10, (1, 0), ())),
+    # Test that a phase angle is read before the qubit
+    ("test.rx(1.57079632679, 0)", (14, (0,), (1.57079632679,))),
+    # Test that the U gate reads all three of its Euler angles
+    ("test.u(0.1, 0.2, 0.3, 1)", (0, (1,), (0.1, 0.2, 0.3))),
+    # Test that an entangling gate reads its angle and both qubits
+    ("test.rzz(2.5, 1, 0)", (19, (1, 0), (2.5,))),
+]
+
+
+@pytest.mark.parametrize("gate, compiled_gate", COMPILE_COMPARISON)
+def test_compile_gate(gate, compiled_gate):
+    """
+    Test that a gate string is parsed into the right opcode, qubits and angles.
+
+    Args:
+        gate: The string of a quantum gate applied to the circuit
+        compiled_gate: The opcode, qubits and angles the gate should compile to
+    """
+    assert compile_gate(gate) == compiled_gate
+
+
+@pytest.mark.parametrize("gate_list, probabilities, statevector", MATRIX_COMPARISON)
+def test_compiled_statevector_output(gate_list, probabilities, statevector):
+    """
+    Test that simulating a compiled program gives the same result as simulating
+    the list of gate strings it was compiled from.
+
+    Args:
+        gate_list: The list of quantum gates two qubits will pass through before their states
+        are measured
+        probabilities: The list of probabilities the instances of 00, 01, 10, and 11 are expected
+        to occur respecitvely
+        statevector: The associated statevector of the qubit states
+    """
+    program = compile_circuit(gate_list)
+    assert compile_circuit(program) is program
+    test_probabilities = statevector_output(program)
+    assert np.allclose(test_probabilities[0], probabilities)
+    assert np.allclose(test_probabilities[1], statevector)
+
+
+def test_compile_unknown_gate():
+    """
+    Test that compiling a gate that does not exist raises an error.
+    """
+    with pytest.raises(ValueError):
+        compile_gate("test.ccx(0, 1)")
+
+
+@pytest.mark.parametrize(
+    "gate_list, n_qubits",
+    [
+        ([".h(0)"], 1),
+        ([".h(2)"], 2),
+        ([".h(-1)"], 2),
+        ([".x(0)", ".cx(0, -1)"], 3),
+        ([".h(0)", ".cx(0, 0)"], 2),
+        ([".h(0)", ".rzz(0.5, 2, 2)"], 3),
+    ],
+)
+def test_invalid_qubits(gate_list, n_qubits):
+    """
+    Test that circuits of fewer than two qubits, gates on qubits outside the
+    circuit and two qubit gates on one qubit raise an error instead of acting
+    on another qubit.
+
+    Args:
+        gate_list: A list of gate strings
+        n_qubits: The number of qubits in the circuit
+    """
+    with pytest.raises(ValueError):
+        statevector_output(gate_list, n_qubits)
+    with pytest.raises(ValueError):
+        fuse_program(gate_list, n_qubits)
+
+
+def test_batch_statevector_output():
+    """
+    Test that simulating every circuit in MATRIX_COMPARISON in one batch gives
+    the same probabilities as simulating them one at a time, even though the
+    circuits have different depths.
+    """
+    gate_lists = [case[0] for case in MATRIX_COMPARISON]
+    probabilities = [case[1] for case in MATRIX_COMPARISON]
+    test_probabilities = batch_statevector_output(gate_lists)
+    assert test_probabilities.shape == (len(MATRIX_COMPARISON), 4)
+    assert np.allclose(test_probabilities, probabilities)
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3])
+def test_batch_complex64(n_qubits):
+    """
+    Test that the batched, fused and prefix engines simulate in complex64 when
+    asked to, and agree with complex128 to single precision.
+
+    Args:
+        n_qubits: The number of qubits in the circuits
+    """
+    programs = [random_program(30, n_qubits=n_qubits, seed=seed) for seed in range(4)]
+    expected = batch_statevector_output(programs, n_qubits)
+    probabilities = batch_statevector_output(programs, n_qubits, np.complex64)
+    assert probabilities.dtype == np.float32
+    assert np.allclose(probabilities, expected, atol=1e-5)
+
+    statevectors = run_fused_program(
+        fuse_program(programs[0], n_qubits), n_qubits, dtype=np.complex64
+    )
+    assert statevectors.dtype == np.complex64
+    assert np.allclose(np.abs(statevectors[0]) ** 2, expected[0], atol=1e-5)
+
+    _, prefix = list(prefix_probabilities(programs[0], [30], n_qubits, np.complex64))[0]
+    assert prefix.dtype == np.float32
+    assert np.allclose(prefix, expected[0], atol=1e-5)
+
+
+def test_gate_cache_precision():
+    """
+    Test that gate matrices cached in one precision are not handed out for the
+    other.
+    """
+    clear_gate_cache()
+    gate_list = ["test.rx(0.5, 0)", "test.rzz(1.2, 0, 1)"]
+    statevector_output(gate_list)
+    statevector_output(gate_list, dtype=np.complex64)
+    assert gate_cache_info()["hits"] == 0
+    assert gate_cache_info()["size"] == 4
+    assert statevector_output(gate_list, dtype=np.complex64)[1].dtype == np.complex64
+    assert gate_cache_info()["hits"] == 2
+
+
+def test_gate_cache():
+    """
+    Test that simulating a circuit again reads the matrices of its gates with
+    angles from the gate cache instead of building them again.
+    """
+    clear_gate_cache()
+    gate_list = ["test.rx(0.5, 0)", "test.h(1)", "test.rzz(1.2, 0, 1)"]
+    first_run = statevector_output(gate_list)
+    assert gate_cache_info()["hits"] == 0
+    assert gate_cache_info()["misses"] == 2
+    second_run = statevector_output(gate_list)
+    assert gate_cache_info()["hits"] == 2
+    assert gate_cache_info()["size"] == 2
+    assert np.allclose(first_run[1], second_run[1])
+
+
+NQUBIT_COMPARISON = [
+    # Test the Pauli-X gate on the third qubit of three
+    (["test.x(2)"], 3, [0, 0, 0, 0, 1, 0, 0, 0]),
+    # Test a three qubit GHZ state made of a Hadamard gate and two controlled
+    # not gates, which should only output 000 or 111
+    (["test.h(0)", "test.cx(0, 1)", "test.cx(1, 2)"], 3, [0.5, 0, 0, 0, 0, 0, 0, 0.5]),
+    # Test swapping the first and third qubits when only the first is true
+    (["test.x(0)", "test.swap(0, 2)"], 3, [0, 0, 0, 0, 1, 0, 0, 0]),
+    # Test the controlled not gate with the highest qubit as the control
+    (["test.x(3)", "test.cx(3, 0)"], 4, [0] * 9 + [1] + [0] * 6),
+    # Test the rxx gate entangling two qubits that are not next to eachother
+    (
+        ["test.rxx(1.57079632679, 2, 0)"],
+        3,
+        [0.5, 0, 0, 0, 0, 0.5, 0, 0],
+    ),
+]
+
+
+@pytest.mark.parametrize("gate_list, n_qubits, probabilities", NQUBIT_COMPARISON)
+def test_nqubit_statevector_output(gate_list, n_qubits, probabilities):
+    """
+    Test that circuits with more than two qubits apply each gate to the
+    right qubits, both one circuit at a time and in a batch.
+
+    Args:
+        gate_list: The list of quantum gates the qubits will pass through before their
+        states are measured
+        n_qubits: The number of qubits in the circuit
+        probabilities: The list of probabilities of every qubit configuration
+    """
+    test_probabilities = statevector_output(gate_list, n_qubits)
+    assert np.allclose(test_probabilities[0], probabilities)
+    assert np.allclose(batch_statevector_output([gate_list], n_qubits), [probabilities])
+
+
+def test_nqubit_matches_two_qubits():
+    """
+    Test that the circuits in MATRIX_COMPARISON give the same statevectors when
+    they are simulated with an unused third qubit.
+    """
+    for gate_list, _, statevector in MATRIX_COMPARISON:
+        test_statevector = statevector_output(gate_list, 3)[1]
+        assert np.allclose(test_statevector[:4], statevector)
+        assert np.allclose(test_statevector[4:], 0)
+
+
+@pytest.mark.parametrize("gate_list, probabilities, statevector", MATRIX_COMPARISON)
+def test_fused_unitary(gate_list, probabilities, statevector):
+    """
+    Test that a two qubit circuit fuses into a single gate whose unitary takes
+    the 00 state to the expected statevector.
+
+    Args:
+        gate_list: The list of quantum gates two qubits will pass through before their states
+        are measured
+        probabilities: The list of probabilities the instances of 00, 01, 10, and 11 are expected
+        to occur respecitvely
+        statevector: The associated statevector of the qubit states
+    """
+    fused, unitary = fuse_program(gate_list, return_unitary=True)
+    assert len(fused) == 1
+    assert np.allclose(unitary[:, 0], statevector)
+    assert np.allclose(np.abs(unitary[:, 0]) ** 2, probabilities)
+    assert np.allclose(unitary @ np.conjugate(unitary.T), np.eye(4))
+
+
+def test_fuse_program_runs():
+    """
+    Test that gates are only fused while they act on the same two qubits.
+    """
+    gate_list = [
+        "test.h(0)",
+        "test.cx(0, 1)",
+        "test.x(1)",
+        "test.cx(1, 2)",
+        "test.z(2)",
+        "test.h(0)",
+    ]
+    fused = fuse_program(gate_list, 3)
+    assert fused["qubits"].tolist() == [[0, 1], [1, 2], [0, 1]]
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3])
+def test_prefix_probabilities(n_qubits):
+    """
+    Test that the probabilities yielded at each prefix depth match simulating
+    the first gates of the circuit from scratch.
+
+    Args:
+        n_qubits: The number of qubits in the circuit
+    """
+    gate_list = [
+        "test.h(0)",
+        "test.rx(0.7, 1)",
+        "test.cx(0, 1)",
+        "test.u(0.1, 0.2, 0.3, 1)",
+        "test.ryy(1.1, 1, 0)",
+        "test.sx(0)",
+    ]
+    depths = [5, 0, 2, 6, 2]
+    results = list(prefix_probabilities(gate_list, depths, n_qubits))
+    assert [depth for depth, _ in results] == [0, 2, 5, 6]
+    for depth, probabilities in results:
+        expected = statevector_output(gate_list[:depth], n_qubits)[0]
+        assert np.allclose(probabilities, expected)
+
+
+def test_sample_counts():
+    """
+    Test that counts of every circuit and trial are drawn at once, are
+    reproducible, follow the probabilities and can be tested against them.
+    """
+    probabilities = batch_statevector_output(
+        [["test.h(0)", "test.cx(0, 1)"], ["test.x(1)"], ["test.rx(0.3, 0)"]]
+    )
+    counts = sample_counts(probabilities, shots=1000, trials=50, seed=2)
+    assert counts.shape == (3, 50, 4)
+    assert (counts.sum(axis=-1) == 1000).all()
+    assert np.array_equal(counts, sample_counts(probabilities, 1000, 50, seed=2))
+    assert (counts[0, :, [1, 2]] == 0).all()
+    assert (counts[1, :, 2] == 1000).all()
+    assert np.allclose(counts.mean(axis=1) / 1000, probabilities, atol=0.02)
+    assert sample_counts(probabilities[0], shots=10).shape == (4,)
+
+    chi_value, invalid = batch_chi_squared(probabilities[:, None, :] * 1000, counts)
+    assert chi_value.shape == (3, 50)
+    assert not invalid.any()
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3, 12])
+def test_statevector_workspace(n_qubits):
+    """
+    Test that simulating in a reused workspace or in single precision matches
+    the batched engine, on circuits small and large enough for each kernel.
+
+    Args:
+        n_qubits: The number of qubits in the circuit
+    """
+    program = random_program(40, n_qubits=n_qubits, seed=n_qubits)
+    expected = batch_statevector_output(program[None], n_qubits)[0]
+    workspace = allocate_workspace(n_qubits)
+    for _ in range(2):
+        probabilities, statevector, conjugate = statevector_output(
+            program, n_qubits, workspace=workspace
+        )
+        assert isinstance(probabilities, np.ndarray)
+        assert np.shares_memory(probabilities, workspace["probabilities"])
+        assert np.allclose(probabilities, expected)
+        assert np.allclose(conjugate, np.conjugate(statevector))
+        operators = workspace["operators"]
+
+    # The operators are kept for the same program and rebuilt for another one
+    statevector_output(program.copy(), n_qubits, workspace=workspace)
+    assert workspace["operators"] is operators
+    other = random_program(40, n_qubits=n_qubits, seed=n_qubits + 1)
+    probabilities = statevector_output(other, n_qubits, workspace=workspace)[0]
+    assert workspace["operators"] is not operators
+    assert np.allclose(probabilities, batch_statevector_output(other[None], n_qubits))
+
+    probabilities, statevector, _ = statevector_output(program, n_qubits, np.complex64)
+    assert statevector.dtype == np.complex64
+    assert probabilities.dtype == np.float32
+    assert np.allclose(probabilities, expected, atol=1e-5)
@@ -0,0 +1,71 @@
+"""
+Check that the core engine imports quickly and without Qiskit
+"""
+
+import os
+import subprocess
+import sys
+
+# Run the interpreters next to the modules so they can be imported
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must be importable without loading Qiskit
+CORE_MODULES = [
+    "expected_value",
+    "random_circuit",
+    "chi_squared_calc",
+    "result_store",
+    "result_cache",
+    "job_pipeline",
+    "job_request",
+]
+
+# The most seconds importing every core module may take in a fresh interpreter
+IMPORT_TIME_LIMIT = 2.0
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+print(time.perf_counter() - start)
+print(sorted(name for name in sys.modules if name.split(".")[0] == "qiskit"))
+"""
+
+
+def test_core_imports_without_qiskit():
+    """
+    Test that importing the core modules does not load Qiskit, and stays within
+    the import time budget.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, *CORE_MODULES],
+        capture_output=True,
+        check=True,
+        cwd=HERE,
+        text=True,
+    ).stdout.split("\n")
+    assert output[1] == "[]"
+    assert float(output[0]) < IMPORT_TIME_LIMIT
+
+
+def test_circuit_objects_load_qiskit():
+    """
+    Test that Qiskit is still loaded once a circuit object is requested.
+    """
+    script = (
+        "import sys\n"
+        "from random_circuit import evaluate_circuit\n"
+        "evaluate_circuit(['.h(', '.cx('])\n"
+        "print('qiskit' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=HERE,
+        text=True,
+    )
+    assert output.stdout.strip() == "True"
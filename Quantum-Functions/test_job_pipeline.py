@@ -0,0 +1,154 @@
+"""
+Check the asyncio job pipeline against in-process backends
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from job_pipeline import StatevectorBackend, run_jobs, run_sweep, sweep_jobs
+
+CIRCUITS = [
+    (["test.x(0)"], None),
+    (["test.h(0)", "test.cx(0, 1)"], None),
+    (["test.x(1)", "test.swap(0, 1)"], None),
+]
+
+
+class FlakyBackend:
+    """
+    A backend that sleeps to stand in for a queue wait, fails the first attempt
+    of every job, and records how many jobs were in flight at once.
+    """
+
+    def __init__(self):
+        self.attempts = {}
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def run(self, gate_list, quantum_circuit, shots):
+        """
+        Waits briefly and returns every shot as the 00 configuration.
+        """
+        key = tuple(gate_list)
+        self.attempts[key] = self.attempts.get(key, 0) + 1
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(0.05)
+        self.in_flight -= 1
+        if self.attempts[key] == 1:
+            raise RuntimeError("Job failed")
+        return {"00": shots}
+
+
+def test_statevector_backend_sweep():
+    """
+    Test that a sweep on the fake backend returns counts for every circuit and
+    trial that match the deterministic circuits.
+    """
+    results = run_sweep(sweep_jobs(CIRCUITS, 4), StatevectorBackend(seed=3), shots=100)
+    assert len(results) == 12
+    for trial in range(4):
+        assert results[(0, trial)] == {"01": 100}
+        assert results[(2, trial)] == {"01": 100}
+        assert set(results[(1, trial)]) <= {"00", "11"}
+        assert sum(results[(1, trial)].values()) == 100
+
+
+def test_statevector_backend_is_reproducible():
+    """
+    Test that a seeded sweep gives the same counts for every job however many
+    jobs run at once, since each job samples from its own generator.
+    """
+    circuits = [([".h(0)", ".h(1)"], None), ([".rx(0.7, 0)", ".cx(0, 1)"], None)]
+    results = [
+        run_sweep(
+            sweep_jobs(circuits, 6),
+            StatevectorBackend(seed=11),
+            shots=50,
+            max_in_flight=max_in_flight,
+        )
+        for max_in_flight in (1, 8, 8)
+    ]
+    assert results[0] == results[1] == results[2]
+    assert len({str(results[0][(0, trial)]) for trial in range(6)}) > 1
+    other_seed = run_sweep(sweep_jobs(circuits, 6), StatevectorBackend(seed=12))
+    assert other_seed != run_sweep(sweep_jobs(circuits, 6), StatevectorBackend(seed=11))
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_bounded_concurrency_and_retries(max_in_flight):
+    """
+    Test that jobs overlap up to the configured limit and that failed jobs are
+    retried until they succeed.
+
+    Args:
+        max_in_flight: The most jobs to run at the same time
+    """
+    backend = FlakyBackend()
+    jobs = [(i, ["test.h(" + str(i) + ")"], None) for i in range(8)]
+    start = time.perf_counter()
+    results = run_sweep(jobs, backend, shots=10, max_in_flight=max_in_flight, backoff=0)
+    elapsed = time.perf_counter() - start
+    assert results == {i: {"00": 10} for i in range(8)}
+    assert set(backend.attempts.values()) == {2}
+    assert backend.most_in_flight == max_in_flight
+    # Sixteen attempts of 0.05 seconds only fit this time when they overlap
+    if max_in_flight > 1:
+        assert elapsed < 16 * 0.05
+
+
+def test_failed_job_raises():
+    """
+    Test that a job which keeps failing raises once its retries are used up.
+    """
+    backend = FlakyBackend()
+    with pytest.raises(RuntimeError):
+        run_sweep([(0, ["test.h(0)"], None)], backend, retries=0, backoff=0)
+
+
+class FailingBackend:
+    """
+    A backend on which job 0 fails at once, job 1 succeeds at once and every
+    other job waits until it is cancelled.
+    """
+
+    def __init__(self):
+        self.cancelled = 0
+
+    async def run(self, gate_list, quantum_circuit, shots, job_id=None):
+        """
+        Fails, succeeds or waits depending on the job_id.
+        """
+        if job_id == 0:
+            raise RuntimeError("Job failed")
+        if job_id == 1:
+            return {"00": shots}
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"00": shots}
+
+
+def test_failed_job_cancels_others():
+    """
+    Test that when a job fails for good the jobs that completed with it are
+    still yielded, and the jobs in flight are cancelled.
+    """
+    backend = FailingBackend()
+    jobs = [(i, ["test.h(0)"], None) for i in range(4)]
+    yielded = []
+
+    async def collect():
+        async for job_id, counts in run_jobs(jobs, backend, shots=5, retries=0):
+            yielded.append((job_id, counts))
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError):
+        asyncio.run(collect())
+    assert time.perf_counter() - start < 5
+    assert yielded == [(1, {"00": 5})]
+    assert backend.cancelled == 2
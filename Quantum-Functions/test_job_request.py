@@ -0,0 +1,220 @@
+"""
+Check the job requests against fake Qiskit backends
+"""
+
+import ast
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import qiskit
+
+from job_pipeline import AerBackend
+from job_request import (
+    API_TOKEN,
+    batch_job_acquisition,
+    get_backend,
+    reset_session,
+    set_backend,
+)
+from result_store import read_circuits, read_counts
+
+
+class FakeIBMQ:
+    """
+    Stands in for qiskit.IBMQ, counting how often the account is saved and
+    loaded.
+    """
+
+    saves = 0
+    loads = 0
+
+    @classmethod
+    def save_account(cls, token, overwrite=False):
+        """
+        Counts a saved account.
+        """
+        assert token == API_TOKEN and overwrite
+        cls.saves += 1
+
+    @classmethod
+    def load_account(cls):
+        """
+        Counts a loaded account.
+        """
+        cls.loads += 1
+
+
+class FakeAer:
+    """
+    Stands in for qiskit.Aer, returning the name of every backend looked up.
+    """
+
+    lookups = []
+
+    @classmethod
+    def get_backend(cls, name):
+        """
+        Records a backend lookup.
+        """
+        cls.lookups.append(name)
+        return "aer " + name
+
+
+@pytest.fixture(name="session")
+def fixture_session(monkeypatch):
+    """
+    Replaces qiskit.IBMQ and qiskit.Aer with fakes and starts from an empty
+    session.
+    """
+    monkeypatch.setattr(FakeIBMQ, "saves", 0)
+    monkeypatch.setattr(FakeIBMQ, "loads", 0)
+    monkeypatch.setattr(FakeAer, "lookups", [])
+    monkeypatch.setattr(qiskit, "IBMQ", FakeIBMQ, raising=False)
+    monkeypatch.setattr(qiskit, "Aer", FakeAer, raising=False)
+    reset_session()
+    yield
+    reset_session()
+
+
+@pytest.mark.usefixtures("session")
+def test_account_loaded_once():
+    """
+    Test that the account is loaded and each backend looked up once, however
+    many calls and threads ask for them.
+    """
+    with ThreadPoolExecutor(8) as executor:
+        backends = list(executor.map(lambda _: get_backend(), range(32)))
+    assert backends == ["aer qasm_simulator"] * 32
+    assert get_backend("statevector_simulator") == "aer statevector_simulator"
+    assert get_backend() == "aer qasm_simulator"
+    assert (FakeIBMQ.saves, FakeIBMQ.loads) == (1, 1)
+    assert FakeAer.lookups == ["qasm_simulator", "statevector_simulator"]
+
+
+@pytest.mark.usefixtures("session")
+def test_set_backend_skips_account():
+    """
+    Test that a backend set on the session is returned without loading the
+    account, including to the pipeline's AerBackend.
+    """
+    set_backend("local backend")
+    assert get_backend() == "local backend"
+    assert AerBackend().backend == "local backend"
+    assert (FakeIBMQ.saves, FakeIBMQ.loads) == (0, 0)
+    assert not FakeAer.lookups
+
+
+@pytest.mark.usefixtures("session")
+def test_reset_session():
+    """
+    Test that after a reset the account is loaded and the backend looked up
+    again.
+    """
+    get_backend()
+    set_backend("local backend", "fake_device")
+    reset_session()
+    assert get_backend() == "aer qasm_simulator"
+    assert get_backend("fake_device") == "aer fake_device"
+    assert (FakeIBMQ.saves, FakeIBMQ.loads) == (2, 2)
+    assert FakeAer.lookups == ["qasm_simulator", "qasm_simulator", "fake_device"]
+
+
+class FakeResult:
+    """
+    A result whose experiment i counted every shot as the configuration i mod 4.
+    """
+
+    def __init__(self, n_experiments, shots):
+        self.n_experiments = n_experiments
+        self.shots = shots
+
+    def get_counts(self, experiment):
+        """
+        Returns the counts dictionary of one experiment of the batch.
+        """
+        assert 0 <= experiment < self.n_experiments
+        return {format(experiment % 4, "02b"): self.shots}
+
+
+class FakeJob:
+    """
+    A job that has already finished with a FakeResult.
+    """
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        """
+        Returns the result of the job.
+        """
+        return self._result
+
+
+@pytest.fixture(name="executed")
+def fixture_executed(monkeypatch):
+    """
+    Replaces qiskit.execute with a fake that records every call, and the
+    session backend with a local stand-in.
+
+    Returns:
+        A list of the (batch, backend, shots) of every call to execute.
+    """
+    calls = []
+
+    def execute(batch, backend, shots=1024):
+        calls.append((batch, backend, shots))
+        return FakeJob(FakeResult(len(batch), shots))
+
+    monkeypatch.setattr(qiskit, "execute", execute, raising=False)
+    reset_session()
+    set_backend("local backend")
+    yield calls
+    reset_session()
+
+
+GATE_LISTS = [[".h(0)"], [".x(0)", ".cx(0, 1)", ".z(1)"]]
+
+
+def test_batch_job_files(executed, tmp_path, monkeypatch):
+    """
+    Test that every iteration of every circuit is sent in one batch, and that
+    iteration j of circuit i is written from experiment i * iterations + j.
+    """
+    monkeypatch.chdir(tmp_path)
+    result = batch_job_acquisition(GATE_LISTS, ["circuit 0", "circuit 1"], 3, 64)
+
+    assert len(executed) == 1
+    batch, backend, shots = executed[0]
+    assert batch == ["circuit 0"] * 3 + ["circuit 1"] * 3
+    assert backend == "local backend"
+    assert shots == 64
+    assert isinstance(result, FakeResult)
+
+    for i, gate_list in enumerate(GATE_LISTS):
+        with open(
+            tmp_path / ("job_id_strings_" + str(len(gate_list)) + ".txt"),
+            encoding="utf8",
+        ) as job_ids:
+            lines = job_ids.read().splitlines()
+        assert ast.literal_eval(lines[0]) == gate_list
+        assert [ast.literal_eval(line) for line in lines[1:]] == [
+            {format((i * 3 + j) % 4, "02b"): 64} for j in range(3)
+        ]
+
+
+def test_batch_job_store(executed, tmp_path):
+    """
+    Test that a batch written to a result store keeps each circuit's runs under
+    its own circuit id, without writing any text files.
+    """
+    batch_job_acquisition(
+        GATE_LISTS, ["circuit 0", "circuit 1"], 2, 8, store_path=tmp_path / "store"
+    )
+    assert len(executed) == 1
+    counts, index = read_counts(tmp_path / "store")
+    assert index.tolist() == [[0, 0], [0, 1], [1, 0], [1, 1]]
+    assert counts.tolist() == [[8, 0, 0, 0], [0, 8, 0, 0], [0, 0, 8, 0], [0, 0, 0, 8]]
+    circuits = read_circuits(tmp_path / "store")
+    assert circuits[1]["gate_list"] == GATE_LISTS[1]
+    assert not list(tmp_path.glob("job_id_strings_*.txt"))
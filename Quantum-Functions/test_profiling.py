@@ -0,0 +1,76 @@
+"""
+Check the opt-in stage profiler
+"""
+
+import json
+
+import profiling
+from chi_squared_calc import chi_squared
+from expected_value import clear_gate_cache, statevector_output
+from random_circuit import random_circuit
+
+
+def test_disabled_records_nothing():
+    """
+    Test that profiled stages are not recorded until profiling is enabled.
+    """
+    profiling.disable()
+    profiling.reset()
+    random_circuit(5)
+    chi_squared([1, 2, 3, 4], [1, 2, 3, 4])
+    assert profiling.summary() == {"stages": {}, "counters": {}}
+
+
+def test_stage_summary(tmp_path):
+    """
+    Test that calls, latencies and cache counters are summarised and written
+    to JSON.
+    """
+    profiling.reset()
+    clear_gate_cache()
+    profiling.enable()
+    try:
+        for _ in range(3):
+            statevector_output([".rx(0.5, 0)", ".cx(0, 1)"])
+        with profiling.StageTimer("block"):
+            chi_squared([1, 2, 3, 4], [1, 2, 3, 4])
+    finally:
+        profiling.disable()
+
+    summary = profiling.summary()
+    assert summary["stages"]["statevector_output"]["calls"] == 3
+    assert summary["stages"]["chi_squared"]["calls"] == 1
+    block = summary["stages"]["block"]
+    assert block["calls"] == 1
+    assert 0 < block["p50_seconds"] <= block["p99_seconds"] <= block["total_seconds"]
+    assert summary["counters"] == {"gate_cache.hits": 2, "gate_cache.misses": 1}
+
+    profiling.write_summary(tmp_path / "profile.json")
+    with open(tmp_path / "profile.json", encoding="utf8") as summary_file:
+        assert json.load(summary_file) == summary
+    profiling.reset()
+
+
+def test_collect_and_merge():
+    """
+    Test that recordings collected in one place are added to the stages and
+    counters recorded in another.
+    """
+    profiling.reset()
+    profiling.record("worker", 0.5)
+    profiling.enable()
+    try:
+        profiling.count("hits", 2)
+    finally:
+        profiling.disable()
+    recorded = profiling.collect()
+    assert profiling.summary() == {"stages": {}, "counters": {}}
+
+    profiling.record("worker", 1.5)
+    profiling.merge(recorded)
+    profiling.merge(recorded)
+    summary = profiling.summary()
+    assert summary["stages"]["worker"]["calls"] == 3
+    assert summary["stages"]["worker"]["total_seconds"] == 2.5
+    assert summary["counters"] == {"hits": 4}
+    profiling.reset()
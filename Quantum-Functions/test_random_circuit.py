@@ -0,0 +1,133 @@
+"""
+Check the random circuit generators
+"""
+
+import numpy as np
+import pytest
+
+from expected_value import GATE_NAMES, compile_circuit, statevector_output
+from random_circuit import (
+    POTENTIAL_GATES,
+    circuit_ensemble,
+    evaluate_circuit,
+    gate_strings,
+    random_circuit,
+    random_program,
+)
+
+
+def test_gate_codes_match():
+    """
+    Test that the keys of POTENTIAL_GATES are the opcodes of the same gates in
+    the simulator.
+    """
+    for opcode, gate in POTENTIAL_GATES.items():
+        assert gate == "." + GATE_NAMES[opcode] + "("
+
+
+def test_deep_random_circuit():
+    """
+    Test that a circuit deeper than the recursion limit can be generated, and
+    that a gate list passed in is still appended to.
+    """
+    gatelist = [".h("]
+    assert len(random_circuit(5000, gatelist)) == 5001
+    assert gatelist[0] == ".h("
+
+
+@pytest.mark.parametrize("n_circuits, n_qubits", [(None, 2), (50, 2), (50, 5)])
+def test_random_program(n_circuits, n_qubits):
+    """
+    Test that drawn programs are reproducible from a seed and only fill in the
+    qubits and angles that each gate uses.
+
+    Args:
+        n_circuits: The number of circuits to draw, or None for a single circuit
+        n_qubits: The number of qubits in each circuit
+    """
+    program = random_program(200, n_circuits, n_qubits, seed=7)
+    assert program.shape == ((200,) if n_circuits is None else (n_circuits, 200))
+    assert np.array_equal(program, random_program(200, n_circuits, n_qubits, seed=7))
+    assert not np.array_equal(program, random_program(200, n_circuits, n_qubits, 8))
+
+    gates = program.reshape(-1)
+    names = [GATE_NAMES[opcode] for opcode in gates["opcode"]]
+    for name, gate in zip(names, gates):
+        first, second = gate["qubits"]
+        assert 0 <= first < n_qubits
+        if name in ("cx", "swap", "rxx", "ryy", "rzz"):
+            assert 0 <= second < n_qubits and second != first
+        else:
+            assert second == -1
+        if name not in ("u", "p", "rx", "ry", "rz", "rxx", "ryy", "rzz"):
+            assert not gate["angles"].any()
+    assert np.isclose(sum(statevector_output(gates[:200], n_qubits)[0]), 1)
+
+
+def test_gate_strings_round_trip():
+    """
+    Test that gate strings written from a program compile back to it.
+    """
+    program = random_program(200, seed=3)
+    assert np.array_equal(compile_circuit(gate_strings(program)), program)
+
+
+def test_circuit_ensemble_shards():
+    """
+    Test that an ensemble split across workers gives the same circuits as
+    generating it in one place, and that the last shard holds the remainder.
+    """
+    ensemble = dict(circuit_ensemble(5, 23, chunk_size=10, n_qubits=3, seed=11))
+    assert [len(chunk) for chunk in ensemble.values()] == [10, 10, 3]
+
+    split = {}
+    for worker in range(2):
+        split.update(
+            circuit_ensemble(5, 23, 10, 3, seed=11, shards=range(worker, 3, 2))
+        )
+    for shard, chunk in ensemble.items():
+        assert [gate_list for gate_list, _ in chunk] == [
+            gate_list for gate_list, _ in split[shard]
+        ]
+    assert ensemble[0][0][0] != ensemble[1][0][0]
+
+
+@pytest.mark.parametrize("n_qubits", [2, 3])
+def test_evaluate_circuit_outputs(n_qubits):
+    """
+    Test that the qiskit circuit, the OpenQASM text and the gate list of an
+    evaluated circuit all describe the same circuit.
+
+    Args:
+        n_qubits: The number of qubits in the circuit
+    """
+    from qiskit import QuantumCircuit
+    from qiskit.quantum_info import Statevector
+
+    gatelist = list(POTENTIAL_GATES.values()) * 2
+    gate_list, circuit = evaluate_circuit(gatelist, n_qubits, np.random.default_rng(5))
+    qasm_gate_list, qasm = evaluate_circuit(
+        gatelist, n_qubits, np.random.default_rng(5), output="qasm"
+    )
+    assert qasm_gate_list == gate_list
+    assert evaluate_circuit(
+        gatelist, n_qubits, np.random.default_rng(5), output=None
+    ) == (gate_list, None)
+
+    expected = statevector_output(gate_list, n_qubits)[0]
+    for built in (circuit, QuantumCircuit.from_qasm_str(qasm)):
+        assert built.count_ops()["measure"] == n_qubits
+        built.remove_final_measurements()
+        assert np.allclose(Statevector(built).probabilities(), expected)
+    with pytest.raises(ValueError):
+        evaluate_circuit(gatelist, n_qubits, output="json")
+
+
+def test_one_qubit_rejected():
+    """
+    Test that drawing circuits of a single qubit raises a clear error.
+    """
+    with pytest.raises(ValueError, match="at least 2 qubits"):
+        random_program(5, n_qubits=1)
+    with pytest.raises(ValueError, match="at least 2 qubits"):
+        evaluate_circuit(random_circuit(5), 1, output=None)
@@ -0,0 +1,141 @@
+"""
+Check the content-addressed result cache
+"""
+
+import os
+
+import numpy as np
+
+import result_cache
+from result_cache import (
+    cache_info,
+    cached_counts,
+    cached_probabilities,
+    circuit_key,
+    evict,
+)
+
+
+class CountingBackend:
+    """
+    A backend that returns fixed counts and records how often it is run.
+    """
+
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, gate_list, quantum_circuit, shots):
+        """
+        Returns counts that change with every run.
+        """
+        self.runs += 1
+        return {"00": shots - self.runs, "11": self.runs}
+
+
+def test_circuit_key():
+    """
+    Test that the key depends on the circuit and not on how it is written.
+    """
+    key = circuit_key([".h(0)", ".cx(0, 1)"])
+    assert key == circuit_key(["circuit.h(0)", "circuit.cx(0,1)"])
+    assert key != circuit_key([".h(1)", ".cx(0, 1)"])
+    assert key != circuit_key([".h(0)", ".cx(0, 1)"], n_qubits=3)
+
+
+def test_cached_probabilities(tmp_path):
+    """
+    Test that probabilities are stored once and read back unchanged.
+    """
+    probabilities = cached_probabilities(tmp_path, [".h(0)", ".cx(0, 1)"])
+    assert np.allclose(probabilities, [0.5, 0, 0, 0.5])
+    assert cache_info(tmp_path)["files"] == 1
+    assert np.array_equal(
+        cached_probabilities(tmp_path, ["circuit.h(0)", "circuit.cx(0,1)"]),
+        probabilities,
+    )
+    assert cache_info(tmp_path)["files"] == 1
+
+
+def test_cached_counts(tmp_path):
+    """
+    Test that only trials missing from the cache are run on the backend.
+    """
+    backend = CountingBackend()
+    # The backends only need the gate list
+    circuit = None
+    counts = cached_counts(tmp_path, [".x(0)"], circuit, 3, backend, shots=100)
+    assert counts.tolist() == [[99, 0, 0, 1], [98, 0, 0, 2], [97, 0, 0, 3]]
+    assert np.array_equal(
+        cached_counts(tmp_path, [".x(0)"], circuit, 2, backend, shots=100),
+        counts[:2],
+    )
+    assert backend.runs == 3
+    assert len(cached_counts(tmp_path, [".x(0)"], circuit, 5, backend, shots=100)) == 5
+    assert backend.runs == 5
+    cached_counts(tmp_path, [".x(0)"], circuit, 1, backend, shots=10)
+    assert backend.runs == 6
+    counts = cached_counts(tmp_path, [".x(2)"], circuit, 2, backend, 8, n_qubits=3)
+    assert counts.tolist() == [[1, 0, 0, 7] + [0] * 4, [0, 0, 0, 8] + [0] * 4]
+
+
+def test_cached_counts_per_backend(tmp_path):
+    """
+    Test that counts of the same circuit on different backends are cached
+    apart, by class name or by the backend name given.
+    """
+
+    class OtherBackend(CountingBackend):
+        """
+        A backend of another class with the same counts.
+        """
+
+    # The backends only need the gate list
+    circuit = None
+    backend = CountingBackend()
+    other = OtherBackend()
+    cached_counts(tmp_path, [".x(0)"], circuit, 2, backend, shots=100)
+    cached_counts(tmp_path, [".x(0)"], circuit, 2, other, shots=100)
+    assert (backend.runs, other.runs) == (2, 2)
+    cached_counts(tmp_path, [".x(0)"], circuit, 2, backend, 100, backend_name="dev")
+    assert backend.runs == 4
+    cached_counts(tmp_path, [".x(0)"], circuit, 2, other, 100, backend_name="dev")
+    assert other.runs == 2
+    assert cache_info(tmp_path)["files"] == 3
+
+
+def test_evict(tmp_path):
+    """
+    Test that the least recently used entries are deleted first.
+    """
+    for depth in range(1, 4):
+        cached_probabilities(tmp_path, [".x(0)"] * depth)
+    oldest = os.path.join(tmp_path, circuit_key([".x(0)"]) + "-expected.npy")
+    os.utime(oldest, ns=(0, 0))
+    size = os.path.getsize(oldest)
+    assert evict(tmp_path, max_bytes=2 * size) == 1
+    assert not os.path.exists(oldest)
+    assert cache_info(tmp_path) == {"files": 2, "bytes": 2 * size}
+
+
+def test_write_scans_past_limit(tmp_path, monkeypatch):
+    """
+    Test that writes only scan the cache directory once its running total of
+    bytes passes the size limit.
+    """
+    scans = []
+    list_entries = result_cache._cache_entries  # pylint: disable=protected-access
+
+    def counting_entries(cache_path):
+        scans.append(cache_path)
+        return list_entries(cache_path)
+
+    monkeypatch.setattr(result_cache, "_cache_entries", counting_entries)
+    cached_probabilities(tmp_path, [".x(0)"])
+    size = cache_info(tmp_path)["bytes"]
+    scans.clear()
+    for depth in range(2, 5):
+        cached_probabilities(tmp_path, [".x(0)"] * depth, max_bytes=4 * size)
+    assert not scans
+    cached_probabilities(tmp_path, [".x(0)"] * 5, max_bytes=4 * size)
+    assert len(scans) == 1
+    assert cache_info(tmp_path) == {"files": 4, "bytes": 4 * size}
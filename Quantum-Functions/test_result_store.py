@@ -0,0 +1,167 @@
+"""
+Check the binary result store
+"""
+
+import numpy as np
+import pytest
+
+from result_store import (
+    add_circuit,
+    append_counts,
+    convert_job_archive,
+    counts_to_array,
+    load_job_archive,
+    load_counts_tensor,
+    read_circuits,
+    read_counts,
+)
+
+
+def test_counts_to_array():
+    """
+    Test that bitstrings are placed at the index they spell in binary and
+    missing configurations are zero.
+    """
+    assert counts_to_array({"01": 3, "11": 5}, 4).tolist() == [0, 3, 0, 5]
+    assert counts_to_array({"110": 7}, 8).tolist() == [0, 0, 0, 0, 0, 0, 7, 0]
+
+
+def test_store_round_trip(tmp_path):
+    """
+    Test that counts appended over several calls come back as one
+    (circuit, trial, configuration) tensor with their metadata.
+    """
+    store_path = tmp_path / "store"
+    append_counts(store_path, 2, [{"00": 10, "11": 6}], [".h(0)", ".cx(0, 1)"])
+    append_counts(store_path, 1, [{"01": 16}, {"01": 15, "00": 1}], [".x(0)"])
+    append_counts(store_path, 2, [np.array([8, 0, 0, 8])], first_trial=1)
+
+    counts, index = read_counts(store_path)
+    assert isinstance(counts, np.memmap)
+    assert counts.shape == (4, 4)
+    assert index.tolist() == [[2, 0], [1, 0], [1, 1], [2, 1]]
+
+    circuit_ids, tensor = load_counts_tensor(store_path)
+    assert circuit_ids.tolist() == [1, 2]
+    assert tensor.dtype == np.uint32
+    assert tensor.tolist() == [
+        [[0, 16, 0, 0], [1, 15, 0, 0]],
+        [[10, 0, 0, 6], [8, 0, 0, 8]],
+    ]
+    circuits = read_circuits(store_path)
+    assert circuits[2]["depth"] == 2
+    assert circuits[1]["gate_list"] == [".x(0)"]
+
+
+def test_circuits_of_same_depth(tmp_path):
+    """
+    Test that circuits of the same depth get their own ids and that trials
+    continue after the ones already stored for an id.
+    """
+    store_path = tmp_path / "store"
+    assert add_circuit(store_path, [".h(0)"], [{"01": 4}, {"00": 4}]) == 0
+    assert add_circuit(store_path, [".x(0)"], [{"01": 4}]) == 1
+    append_counts(store_path, 1, [{"01": 3, "00": 1}])
+
+    _, index = read_counts(store_path)
+    assert index.tolist() == [[0, 0], [0, 1], [1, 0], [1, 1]]
+    circuits = read_circuits(store_path)
+    assert circuits[0]["gate_list"] == [".h(0)"]
+    assert circuits[1]["gate_list"] == [".x(0)"]
+    assert circuits[1]["depth"] == 1
+
+
+def test_append_counts_rejects_bad_runs(tmp_path):
+    """
+    Test that rows of the wrong width, trials already stored and a different
+    gate list for a stored id raise ValueErrors and leave the store unchanged.
+    """
+    store_path = tmp_path / "store"
+    append_counts(store_path, 0, [{"00": 4}], [".h(0)"])
+    with pytest.raises(ValueError):
+        append_counts(store_path, 0, [np.arange(8)])
+    with pytest.raises(ValueError):
+        append_counts(store_path, 0, [{"00": 4}], first_trial=0)
+    with pytest.raises(ValueError):
+        append_counts(store_path, 0, [{"00": 4}], [".x(0)"])
+    counts, index = read_counts(store_path)
+    assert counts.tolist() == [[4, 0, 0, 0]]
+    assert index.tolist() == [[0, 0]]
+
+
+def test_interrupted_append(tmp_path):
+    """
+    Test that counts left without an index row by an interrupted append are cut
+    off, so later runs stay paired with their own counts.
+    """
+    store_path = tmp_path / "store"
+    append_counts(store_path, 0, [{"00": 4}], [".h(0)"])
+    with open(store_path / "counts.u32", "ab") as counts_file:
+        counts_file.write(np.arange(6, dtype=np.uint32).tobytes())
+    with open(store_path / "index.i64", "ab") as index_file:
+        index_file.write(b"\x01\x02")
+    append_counts(store_path, 0, [{"11": 4}])
+    counts, index = read_counts(store_path)
+    assert counts.tolist() == [[4, 0, 0, 0], [0, 0, 0, 4]]
+    assert index.tolist() == [[0, 0], [0, 1]]
+
+
+def test_store_without_ids(tmp_path):
+    """
+    Test that a store written before ids.i64 was kept gets it rebuilt from its
+    index and metadata.
+    """
+    store_path = tmp_path / "store"
+    append_counts(store_path, 3, [{"00": 4}, {"01": 4}], [".h(0)"])
+    append_counts(store_path, 1, [{"00": 4}], [".x(0)"])
+    (store_path / "ids.i64").unlink()
+    assert add_circuit(store_path, [".z(0)"], [{"00": 4}]) == 4
+    append_counts(store_path, 3, [{"11": 4}])
+    with pytest.raises(ValueError):
+        append_counts(store_path, 1, [{"00": 4}], [".y(0)"])
+    _, index = read_counts(store_path)
+    assert index.tolist() == [[3, 0], [3, 1], [1, 0], [4, 0], [3, 2]]
+
+
+def write_archive(directory):
+    """
+    Writes two job files in the same format as job_request.write_job_file.
+
+    Args:
+        directory: The directory to write the files to
+    """
+    archive = {
+        2: ([".h(0)", ".cx(0, 1)"], [{"00": 520, "11": 504}, {"11": 530, "00": 494}]),
+        10: ([".rx(0.25, 1)"] * 10, [{"00": 1000, "10": 24}]),
+    }
+    for depth, (gate_list, counts_list) in archive.items():
+        with open(
+            directory / ("job_id_strings_" + str(depth) + ".txt"), "w", encoding="utf8"
+        ) as job_ids:
+            job_ids.write(str(gate_list) + "\n")
+            for counts in counts_list:
+                job_ids.write(str(counts) + "\n")
+
+
+def test_load_job_archive(tmp_path):
+    """
+    Test that a directory of job files is read into one counts array ordered
+    by depth, and that converting it to a store gives the same counts.
+    """
+    write_archive(tmp_path)
+    depths, counts, gate_lists = load_job_archive(tmp_path)
+    assert depths.tolist() == [2, 10]
+    assert counts.tolist() == [
+        [[520, 0, 0, 504], [494, 0, 0, 530]],
+        [[1000, 0, 24, 0], [0, 0, 0, 0]],
+    ]
+    assert gate_lists[0] == [".h(0)", ".cx(0, 1)"]
+    assert len(gate_lists[1]) == 10
+
+    assert convert_job_archive(tmp_path, tmp_path / "store") == [0, 1]
+    circuit_ids, tensor = load_counts_tensor(tmp_path / "store")
+    assert circuit_ids.tolist() == [0, 1]
+    assert np.array_equal(tensor, counts)
+    circuits = read_circuits(tmp_path / "store")
+    assert circuits[1]["depth"] == 10
+    assert circuits[1]["gate_list"] == gate_lists[1]
@@ -0,0 +1,219 @@
+"""
+Check the parallel sweep command line
+"""
+
+import json
+import threading
+
+import numpy as np
+import pytest
+
+import profiling
+from result_cache import cache_info
+from result_store import load_counts_tensor, read_circuits
+from sweep import _backend_runs, main, run_depth
+
+
+def test_run_depth_is_reproducible():
+    """
+    Test that a depth's circuit and counts only depend on its seed.
+    """
+    first = run_depth(20, 5, 100, 2, np.random.SeedSequence(4))
+    second = run_depth(20, 5, 100, 2, np.random.SeedSequence(4))
+    assert first[0] == second[0]
+    assert len(first[0]) == 20
+    assert np.array_equal(first[2], second[2])
+    assert first[2].shape == (5, 4)
+    assert (first[2].sum(axis=1) == 100).all()
+
+
+def test_sweep_writes_results(tmp_path):
+    """
+    Test that every depth is written to the result store and results.jsonl,
+    and that the same seed gives the same sweep on any number of workers. The
+    sweep runs offline unless another backend is given.
+    """
+    arguments = ["--depths", "1,2,5,200", "--trials", "4", "--shots", "256"]
+    assert (
+        main(
+            arguments
+            + ["--seed", "9", "--workers", "2", "--output", str(tmp_path / "a")]
+        )
+        == 0
+    )
+    assert (
+        main(
+            arguments
+            + ["--seed", "9", "--workers", "1", "--output", str(tmp_path / "b")]
+        )
+        == 0
+    )
+
+    with open(tmp_path / "a" / "results.jsonl", encoding="utf8") as results_file:
+        results = {result["depth"]: result for result in map(json.loads, results_file)}
+    assert sorted(results) == [1, 2, 5, 200]
+    assert results[200]["circuit_id"] == 3
+    assert len(results[200]["chi_squared"]) == 4
+    assert np.isclose(sum(results[5]["expected"]), 1)
+
+    circuit_ids, counts = load_counts_tensor(tmp_path / "a" / "store")
+    assert circuit_ids.tolist() == [0, 1, 2, 3]
+    assert counts.shape == (4, 4, 4)
+    circuits = read_circuits(tmp_path / "a" / "store")
+    assert [circuits[i]["depth"] for i in range(4)] == [1, 2, 5, 200]
+    assert np.array_equal(load_counts_tensor(tmp_path / "b" / "store")[1], counts)
+
+
+def test_sweep_on_backend(tmp_path):
+    """
+    Test that a sweep on a job_pipeline backend stores the counts of every
+    trial of the same circuits as an offline sweep.
+    """
+    arguments = ["--depths", "3,7", "--trials", "3", "--shots", "128", "--seed", "2"]
+    main(arguments + ["--backend", "statevector", "--output", str(tmp_path / "a")])
+    main(arguments + ["--backend", "offline", "--output", str(tmp_path / "b")])
+
+    _, counts = load_counts_tensor(tmp_path / "a" / "store")
+    assert counts.shape == (2, 3, 4)
+    assert (counts.sum(axis=2) == 128).all()
+    assert read_circuits(tmp_path / "a" / "store") == read_circuits(
+        tmp_path / "b" / "store"
+    )
+
+
+def test_sweep_rejects_collisions(tmp_path):
+    """
+    Test that repeated depths and an output directory holding an earlier sweep
+    are rejected instead of mixing their runs in one store.
+    """
+    arguments = ["--trials", "2", "--backend", "offline", "--output", str(tmp_path)]
+    with pytest.raises(SystemExit):
+        main(["--depths", "3,3"] + arguments)
+    main(["--depths", "3"] + arguments)
+    with pytest.raises(SystemExit):
+        main(["--depths", "4"] + arguments)
+
+
+class BlockingBackend:
+    """
+    A backend whose first trial of the first depth only completes once a trial
+    of the second depth has started.
+    """
+
+    def __init__(self):
+        self.second_depth_started = threading.Event()
+
+    def run(self, gate_list, quantum_circuit, shots, job_id=None):
+        """
+        Returns every shot as 00, waiting for the second depth on job (0, 0).
+        """
+        assert quantum_circuit is None and gate_list
+        if job_id[0] == 1:
+            self.second_depth_started.set()
+        if job_id == (0, 0):
+            assert self.second_depth_started.wait(10)
+        return {"00": shots}
+
+
+def test_backend_runs_stream_across_depths():
+    """
+    Test that the trials of every depth share one stream of jobs, so a later
+    depth runs while an earlier one is still waiting.
+    """
+    seeds = np.random.SeedSequence(3).spawn(2)
+    runs = list(_backend_runs([4, 6], 2, 16, 4, seeds, 2, BlockingBackend()))
+    runs.sort(key=lambda run: run[0])
+    assert [len(gate_list) for _, gate_list, _, _ in runs] == [4, 6]
+    for _, _, probabilities, counts in runs:
+        assert np.isclose(probabilities.sum(), 1)
+        assert counts.tolist() == [[16, 0, 0, 0]] * 2
+
+
+class RecordingBackend:
+    """
+    A backend that records the job_id of every job it runs.
+    """
+
+    def __init__(self):
+        self.job_ids = []
+
+    def run(self, gate_list, quantum_circuit, shots, job_id=None):
+        """
+        Returns counts that spell out the trial of the job.
+        """
+        self.job_ids.append(job_id)
+        return {"00": shots - job_id[1], "11": job_id[1]}
+
+
+def test_backend_runs_cache(tmp_path):
+    """
+    Test that a sweep with a cache only runs the trials that are not cached
+    yet for each circuit, and reuses every cached trial.
+    """
+    seeds = np.random.SeedSequence(5).spawn(2)
+    backend = RecordingBackend()
+    first = {
+        i: counts
+        for i, _, _, counts in _backend_runs(
+            [3, 5], 2, 16, 2, seeds, 2, backend, tmp_path
+        )
+    }
+    assert sorted(backend.job_ids) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+
+    backend = RecordingBackend()
+    runs = list(_backend_runs([3, 5], 3, 16, 2, seeds, 2, backend, tmp_path))
+    assert sorted(backend.job_ids) == [(0, 2), (1, 2)]
+    for i, _, _, counts in runs:
+        assert counts[:, 3].tolist() == [0, 1, 2]
+        assert np.array_equal(counts[:2], first[i])
+
+    backend = RecordingBackend()
+    runs = list(_backend_runs([5, 3], 3, 16, 2, seeds[::-1], 2, backend, tmp_path))
+    assert not backend.job_ids
+    assert sorted(i for i, _, _, _ in runs) == [0, 1]
+
+
+def test_sweep_cache(tmp_path):
+    """
+    Test that an offline sweep with --cache stores the expected probabilities
+    of every depth and gives the same results as a sweep without it.
+    """
+    arguments = ["--depths", "2,6", "--trials", "3", "--seed", "4"]
+    main(arguments + ["--output", str(tmp_path / "a")])
+    for output in ("b", "c"):
+        cache_arguments = ["--cache", str(tmp_path / "cache")]
+        main(arguments + cache_arguments + ["--output", str(tmp_path / output)])
+    assert cache_info(tmp_path / "cache")["files"] == 2
+    results = {}
+    for output in ("a", "b", "c"):
+        with open(tmp_path / output / "results.jsonl", encoding="utf8") as lines:
+            results[output] = sorted(lines)
+    assert results["a"] == results["b"] == results["c"]
+
+
+@pytest.mark.parametrize("backend", ["offline", "statevector"])
+def test_sweep_profile(tmp_path, backend):
+    """
+    Test that --profile writes the stages of the sweep, including the ones run
+    on worker processes, to a JSON summary.
+
+    Args:
+        backend: The backend the sweep runs on
+    """
+    profiling.reset()
+    arguments = ["--depths", "2,4,8", "--trials", "3", "--workers", "2"]
+    arguments += ["--backend", backend, "--output", str(tmp_path / "sweep")]
+    try:
+        main(arguments + ["--profile", str(tmp_path / "profile.json")])
+    finally:
+        profiling.disable()
+        profiling.reset()
+    with open(tmp_path / "profile.json", encoding="utf8") as summary_file:
+        stages = json.load(summary_file)["stages"]
+    assert stages["draw_depth"]["calls"] == 3
+    assert stages["batch_chi_squared"]["calls"] == 3
+    if backend == "offline":
+        assert stages["sample_counts"]["calls"] == 3
+    else:
+        assert stages["run_job"]["calls"] == 9
+        assert stages["sample_counts"]["calls"] == 9